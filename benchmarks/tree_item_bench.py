@@ -0,0 +1,83 @@
+"""
+TreeItem benchmark
+
+Measures scroll and paint cost against sibling count on a flat tree: the
+rowCount/index/parent calls Qt makes for every visible row, and one repaint
+of the view scrolled to a random position. Every sibling holds one child, so
+parent() of the child has to find the row of the sibling. With the rowNumber
+index the times stay flat while the number of siblings grows; list.index,
+which childNumber used before, is shown for comparison.
+
+    python benchmarks/tree_item_bench.py [sibling counts]
+
+"""
+
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5 import QtCore, QtWidgets
+
+from model.tree_model import TreeModel
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def flat_model(count):
+    model = TreeModel()
+    model.load_data([{"title": "f{}".format(i), "varId": "f{}".format(i), "dataType": "Folder",
+                      "children": [{"title": "t{}".format(i), "varId": "t{}".format(i), "dataType": "Text"}]}
+                     for i in range(count)])
+    return model
+
+
+def measure(count, rng):
+    model = flat_model(count)
+    root = QtCore.QModelIndex()
+    rows = [rng.randrange(count) for _ in range(1000)]
+    indexes = [model.index(0, 0, model.index(row, 0, root)) for row in rows]
+    items = [model.get_item(index).parent() for index in indexes]
+    siblings = model.root_item.childItems
+    view = QtWidgets.QTreeView()
+    view.setUniformRowHeights(True)
+    view.setModel(model)
+    view.resize(400, 800)
+    view.show()
+    scroll_bar = view.verticalScrollBar()
+
+    def paint():
+        scroll_bar.setValue(rng.randrange(scroll_bar.maximum() + 1))
+        view.viewport().grab()
+
+    paint()
+    result = (timed(lambda: model.rowCount(root), 1000) * 1e6,
+              timed(lambda: [model.index(row, 0, root) for row in rows], 10) * 1e3,
+              timed(lambda: [model.parent(index) for index in indexes], 10) * 1e3,
+              timed(lambda: [siblings.index(item) for item in items[:20]], 1) * 1e3 * 50,
+              timed(paint, 20) * 1e3)
+    view.close()
+    return result
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or [10000, 30000, 100000]
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    rng = random.Random(1)
+    print("{:>10} {:>13} {:>14} {:>15} {:>17} {:>11}".format(
+        "siblings", "rowCount us", "1000 index ms", "1000 parent ms", "1000 list.index", "repaint ms"))
+    for count in counts:
+        print("{:>10} {:>13.2f} {:>14.2f} {:>15.2f} {:>14.2f} ms {:>11.2f}".format(count, *measure(count, rng)))
+    app.processEvents()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Change journal
+
+Keeps the items that differ from the last loaded or saved state in dirty sets,
+so listing, reverting and saving changes costs O(changed) instead of a walk
+over the whole tree. The pristine fields of a modified item are captured the
+first time it changes, that snapshot is what a per-item revert restores.
+
+Every change bumps a version number. A save remembers the version of its
+snapshot, edits made while it is written stay in the journal afterwards.
+
+"""
+
+
+class ChangeTracker(object):
+    MODIFIED = "Modified"
+    ADDED = "Added"
+    REMOVED = "Removed"
+    MOVED = "Moved"
+
+    def __init__(self, root_item):
+        self.root_item = root_item
+        self.fragments = {}
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        # item -> (title, varId, dataType, sources, metadata) before the first change
+        self.modified = {}
+        self.added = set()
+        # item -> version, items added inside an added subtree, they are written with it
+        self.added_inside = {}
+        # item -> (parent item, row) it was removed from / moved away from
+        self.removed = {}
+        self.moved = {}
+        # item -> version of its last change
+        self.changed_at = {}
+        # top-level item -> version of the last change in its subtree since the last save
+        self.dirty_roots = {}
+        # item -> metadata dict copied for key edits in place, no snapshot or pristine state shares it
+        self.owned_metadata = {}
+
+    def reset(self):
+        """Forgets all changes and the cached save fragments, used when the tree is reloaded"""
+        self.clear()
+        self.fragments = {}
+
+    def has_changes(self):
+        return bool(self.modified or self.added or self.removed or self.moved)
+
+    def is_added(self, item):
+        while item is not None:
+            if item in self.added:
+                return True
+            item = item.parent()
+        return False
+
+    def record_modified(self, item):
+        """call before the fields of item change"""
+        self.mark_dirty(item)
+        self.changed_at[item] = self.version
+        # kept inside added subtrees too, a save of the subtree can come before the change
+        if item in self.modified:
+            return
+        self.modified[item] = (item.data(), item.getVarId(), item.getDataType(),
+                               item.getSources(), item.getMetaData())
+        self.owned_metadata.pop(item, None)
+
+    def own_metadata(self, item):
+        """The metadata dict of item that may be edited in place, copied once after a snapshot or record_modified"""
+        metadata = item.getMetaData()
+        if self.owned_metadata.get(item) is not metadata:
+            metadata = dict(metadata)
+            item.setMetaData(metadata)
+            self.owned_metadata[item] = metadata
+        return metadata
+
+    def release_metadata(self):
+        """A save snapshot shares the metadata dicts of the items, the next key edit copies them again"""
+        self.owned_metadata = {}
+
+    def record_added(self, item):
+        self.mark_dirty(item)
+        self.changed_at[item] = self.version
+        if self.is_added(item.parent()):
+            self.added_inside[item] = self.version
+        else:
+            self.added.add(item)
+
+    def record_inserted(self, item, parent, row):
+        """call once item is in parent, an item removed before counts as moved from its old place"""
+        if item not in self.removed:
+            self.record_added(item)
+            return
+        self.mark_dirty(item)
+        self.changed_at[item] = self.version
+        origin = self.removed.pop(item)
+        if origin != (parent, row):
+            self.moved[item] = origin
+
+    def record_removed(self, item, parent, row):
+        self.mark_dirty(item)
+        self.changed_at[item] = self.version
+        self.added_inside.pop(item, None)
+        if item in self.added:
+            self.added.discard(item)
+        elif not self.is_added(parent):
+            self.removed.setdefault(item, self.moved.pop(item, (parent, row)))
+
+    def record_moved(self, item, parent, row):
+        """call before item leaves parent"""
+        self.mark_dirty(item)
+        self.changed_at[item] = self.version
+        if item in self.moved or item in self.added:
+            return
+        if self.is_added(item):
+            # it was never saved where it is, wherever it lands it is new
+            self.added_inside.pop(item, None)
+            self.added.add(item)
+            return
+        self.moved[item] = (parent, row)
+
+    def record_restored(self, kind, item):
+        self.mark_dirty(item)
+        if kind == self.MODIFIED:
+            self.modified.pop(item, None)
+        elif kind == self.ADDED:
+            self.added.discard(item)
+        elif kind == self.REMOVED:
+            self.removed.pop(item, None)
+        elif kind == self.MOVED:
+            self.moved.pop(item, None)
+
+    def changes(self):
+        """Returns [(kind, item)] for the changes that are visible in the tree"""
+        result = [(self.ADDED, item) for item in self.added]
+        result += [(self.MODIFIED, item) for item in self.modified if not self.is_added(item) and self.is_attached(item)]
+        result += [(self.MOVED, item) for item in self.moved if self.is_attached(item)]
+        result += [(self.REMOVED, item) for item in self.removed]
+        return result
+
+    def is_attached(self, item):
+        while item is not self.root_item:
+            parent = item.parent()
+            row = item.childNumber()
+            if parent is None or row >= parent.childCount() or parent.child(row) is not item:
+                return False
+            item = parent
+        return True
+
+    def snapshot(self):
+        """
+        Returns (version, top-level items, entries) for a save. An entry is the
+        cached json text of a subtree that did not change since the last save,
+        or a fresh dict from create_new_item that still has to be serialised.
+        """
+        self.release_metadata()
+        children = list(self.root_item.childItems)
+        entries = []
+        for child in children:
+            text = None if child in self.dirty_roots else self.fragments.get(child)
+            entries.append(text if text is not None else child.create_new_item())
+        return self.version, children, entries
+
+    def store_fragments(self, version, children, texts):
+        """Keeps the texts written by a save, subtrees edited after its snapshot stay dirty"""
+        self.fragments = dict(zip(children, texts))
+        for child in children:
+            if self.dirty_roots.get(child, -1) <= version:
+                self.dirty_roots.pop(child, None)
+
+    def mark_saved(self, version):
+        """
+        The saved state becomes the new pristine state for everything changed up
+        to version, returns the items whose flags were cleared
+        """
+        saved = [item for item, changed in self.changed_at.items() if changed <= version]
+        items = set()
+        for item in saved:
+            del self.changed_at[item]
+            self.added_inside.pop(item, None)
+            if self.modified.pop(item, None) is not None:
+                item.setValueChanged(False)
+                items.add(item)
+            if item in self.added:
+                self.added.discard(item)
+                items.add(item)
+                self._mark_subtree_saved(item, version)
+            self.removed.pop(item, None)
+            if self.moved.pop(item, None) is not None:
+                item.setValueChanged(False)
+                items.add(item)
+        return items
+
+    def _mark_subtree_saved(self, item, version):
+        """Clears the flags of a saved added subtree, what changed in it after version keeps them"""
+        item.setNewAdded(False)
+        item.setValueChanged(False)
+        stack = list(item.childItems)
+        while stack:
+            current = stack.pop()
+            if current in self.added:
+                continue
+            if self.added_inside.get(current, -1) > version:
+                # not in the save, it is an addition of its own now
+                del self.added_inside[current]
+                self.added.add(current)
+                continue
+            current.setNewAdded(False)
+            current.setValueChanged(current in self.modified and self.changed_at.get(current, -1) > version)
+            stack.extend(current.childItems)
+
+    def mark_dirty(self, item):
+        """Marks the top-level subtree of item for re-serialisation"""
+        self.version += 1
+        while item is not None and item.parent() is not None and item.parent() is not self.root_item:
+            item = item.parent()
+        if item is not None:
+            self.dirty_roots[item] = self.version
@@ -0,0 +1,36 @@
+"""
+Subtree content hashes
+
+The digest of a node covers its title, varId, dataType, sources and metadata
+and the digests of its children in order, so two subtrees with the same
+digest are equal and comparing them costs O(1). TreeItem caches its digest,
+raw element dicts are hashed with data_hash; both give the same digest for
+the same content.
+
+"""
+
+import json
+import hashlib
+
+from model.tree_file import json_default
+
+DIGEST_SIZE = 16
+# one encoder for all nodes, json.dumps builds a new one per call when given options
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=json_default)
+
+
+def node_digest(title, var_id, data_type, sources, metadata, child_digests):
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    digest.update(_encoder.encode([title, var_id, data_type, sources, metadata]).encode("utf-8"))
+    # json text never holds a NUL, the fixed-size child digests follow it
+    digest.update(b"\0")
+    for child_digest in child_digests:
+        digest.update(child_digest)
+    return digest.digest()
+
+
+def data_hash(data):
+    """Digest of a raw element dict, equal to the one of the TreeItem built from it"""
+    return node_digest(data["title"], data.get("varId"), data.get("dataType"), data.get("sources", []),
+                       data.get("metadata", {}),
+                       [data_hash(child) for child in data.get("children") or () if len(child)])
@@ -0,0 +1,104 @@
+"""
+Append-only edit journal
+
+Every edit emitted by TreeModel.edited is appended as one json line to
+<file>.journal next to the opened file, so a crash loses nothing that was
+already on screen. Compaction writes the current tree to <file>.autosave and
+drops the journal lines it contains. Recovery loads the autosave (or the file
+itself) and replays the remaining lines through TreeModel.apply_edit.
+
+"""
+
+import os
+import json
+
+from model.tree_file import json_default
+from model.tree_item import TreeItem
+
+
+def journal_default(obj):
+    """Serialises the subtree of an add edit when its line is written"""
+    if isinstance(obj, TreeItem):
+        return obj.create_new_item()
+    return json_default(obj)
+
+
+class EditJournal(object):
+
+    def __init__(self, file_path):
+        self.path = file_path + ".journal"
+        self.autosave_path = file_path + ".autosave"
+        self.file = None
+        self.seq = 0
+        self.paused = False
+
+    def has_recovery(self):
+        return os.path.exists(self.autosave_path) or (os.path.exists(self.path) and os.path.getsize(self.path) > 0)
+
+    def recovery_source(self, file_path):
+        return self.autosave_path if os.path.exists(self.autosave_path) else file_path
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        result = []
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    result.append(json.loads(line))
+                except ValueError:
+                    # the last line can be cut off by a crash
+                    break
+        return result
+
+    def resume(self):
+        """Continues after the entries that were recovered"""
+        entries = self.entries()
+        self.seq = entries[-1]["seq"] if entries else 0
+
+    def append(self, edit):
+        if self.paused:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.seq += 1
+        entry = dict(edit)
+        entry["seq"] = self.seq
+        self.file.write(json.dumps(entry, default=journal_default) + "\n")
+        # flush only reaches the OS, a power loss would still drop the line
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def compact(self, seq):
+        """Drops the entries up to seq, they are contained in a save or the autosave"""
+        self.close()
+        remaining = [entry for entry in self.entries() if entry["seq"] > seq]
+        if not remaining:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            for entry in remaining:
+                file.write(json.dumps(entry, default=json_default) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def saved(self, seq):
+        """The opened file itself now contains everything up to seq"""
+        self.compact(seq)
+        if os.path.exists(self.autosave_path):
+            os.remove(self.autosave_path)
+
+    def discard(self):
+        self.close()
+        self.seq = 0
+        for path in (self.path, self.autosave_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -3,38 +3,246 @@ JSON I/O
 
 """
 
-import sys
+import os
 import json
+import time
+import shutil
+import tempfile
+import traceback
 
-from PyQt5 import  QtWidgets
+from PyQt5 import  QtCore, QtWidgets
+from model.tree_item import TreeItem
+from model.tree_file import TreeFile, is_tree_file, write_tree_file, json_default
+from model.tree_store import TreeStore, is_store_file
 
 
 class JsonFileManager(QtWidgets.QWidget):
+    chunk_size = 1 << 16
+    file_filter = "Json Files (*.json);;Tree Files (*.ptree);;Tree Stores (*.sqlite *.db);;All Files (*)"
+
     def __init__(self):
         super().__init__()
         self.file_path = ""
-        self.json_data = []
 
-    def get_json_data(self):
-        print(self.file_path)
+    def choose_file(self):
+        if self.file_path == "":
+            options = QtWidgets.QFileDialog.Options()
+            options |= QtWidgets.QFileDialog.DontUseNativeDialog
+            self.file_path, _ = QtWidgets.QFileDialog.getOpenFileName(QtWidgets.QFileDialog(), "Open", "", self.file_filter,
+                                                                options=options)
+        return self.file_path
+
+    def is_tree_file(self):
+        return is_tree_file(self.file_path)
+
+    def is_store_file(self):
+        return is_store_file(self.file_path)
+
+    def stream_elements(self, file_path, cache=None):
+        """Yields (element, percent) of the top-level array in the format of the opened file"""
+        if self.is_tree_file():
+            return TreeFile(file_path).iter_elements()
+        if self.is_store_file():
+            return TreeStore(file_path).iter_elements()
+        if cache is not None:
+            return cache.stream(self, file_path)
+        return self._stream_array(file_path)
+
+    def _stream_array(self, file_path):
+        decoder = json.JSONDecoder()
+        size = max(os.path.getsize(file_path), 1)
+        with open(file_path) as f:
+            buffer = f.read(self.chunk_size)
+            read = len(buffer)
+            pos = self._skip_whitespace(buffer, 0)
+            if buffer[pos:pos + 1] != '[':
+                # not an array, nothing to stream
+                for element in json.loads(buffer + f.read()):
+                    yield element, 100
+                return
+            pos += 1
+            expect_value = True
+            while True:
+                pos = self._skip_whitespace(buffer, pos)
+                if pos == len(buffer):
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        raise ValueError("Unexpected end of json array")
+                    buffer, pos = buffer[pos:] + chunk, 0
+                    read += len(chunk)
+                    continue
+                if buffer[pos] == ']':
+                    return
+                if not expect_value:
+                    if buffer[pos] != ',':
+                        raise ValueError("Expecting ',' delimiter at {}".format(read - len(buffer) + pos))
+                    pos += 1
+                    expect_value = True
+                    continue
+                try:
+                    element, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    element, end = None, None
+                # an element may continue in the next chunk, a scalar cut at the boundary still decodes
+                if end is None or end == len(buffer) or self._number_cut(element, buffer, end):
+                    # read at least as much again so retries stay linear in the element size
+                    chunk = f.read(max(self.chunk_size, len(buffer) - pos))
+                    if chunk:
+                        buffer, pos = buffer[pos:] + chunk, 0
+                        read += len(chunk)
+                        continue
+                    if end is None:
+                        raise ValueError("Invalid json element at {}".format(read - len(buffer) + pos))
+                if end > self.chunk_size:
+                    buffer, end = buffer[end:], 0
+                pos = end
+                expect_value = False
+                yield element, min(100, read * 100 // size)
+
+    @staticmethod
+    def _number_cut(element, buffer, end):
+        # "1." or "1.5e+" at the end of the buffer decode as the digits before the cut
+        return (isinstance(element, (int, float)) and not isinstance(element, bool)
+                and len(buffer) - end <= 2 and buffer[end] in ".eE")
+
+    @staticmethod
+    def _skip_whitespace(buffer, pos):
+        while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+            pos += 1
+        return pos
+
+    def write_atomic(self, write, file_path=None, binary=False):
+        """
+        Writes through a temp file next to the target and renames it over the
+        target, a crash in the middle leaves the old file untouched
+        """
+        file_path = file_path or self.file_path
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb' if binary else 'w') as file:
+                write(file)
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temp_path)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            # directories cannot be opened on Windows
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+class JsonLoader(QtCore.QThread):
+    """
+    Streams a json file and builds detached TreeItems off the GUI thread.
+    Items are handed over in batches, the model attaches them on the GUI thread.
+    """
+    batch_loaded = QtCore.pyqtSignal(object, int)
+    loading_finished = QtCore.pyqtSignal()
+    loading_failed = QtCore.pyqtSignal(str)
+    batch_size = 500
+    batch_interval = 0.05
+
+    def __init__(self, file_manager, lazy=False, file_path=None, cache=None):
+        super().__init__()
+        self.file_manager = file_manager
+        self.lazy = lazy
+        self.file_path = file_path or file_manager.file_path
+        self.cache = cache
+
+    def run(self):
         try:
-            if self.file_path == "":
-                options = QtWidgets.QFileDialog.Options()
-                options |= QtWidgets.QFileDialog.DontUseNativeDialog
-                self.file_path, _ = QtWidgets.QFileDialog.getOpenFileName(QtWidgets.QFileDialog(), "Open", "", "Json Files (*.json);;All Files (*)",
-                                                                    options=options)
-            if self.file_path:
-                with open(self.file_path) as f:
-                    try:
-                        self.json_data = json.load(f)
-                    except ValueError:
-                        QtWidgets.QMessageBox.critical(QtWidgets.QMessageBox(), "Json Error", "Json TypeError")
-                        sys.exit()
+            holder = TreeItem(None)
+            last_emit = time.monotonic()
+            percent = 0
+            for element, percent in self.file_manager.stream_elements(self.file_path, self.cache):
+                if self.isInterruptionRequested():
+                    return
+                holder.createChildren([element], self.lazy)
+                if holder.childCount() >= self.batch_size or time.monotonic() - last_emit > self.batch_interval:
+                    self.batch_loaded.emit(holder.childItems, percent)
+                    holder = TreeItem(None)
+                    last_emit = time.monotonic()
+            if not self.isInterruptionRequested():
+                self.batch_loaded.emit(holder.childItems, percent)
+                self.loading_finished.emit()
         except Exception as e:
-            print(str(e))
-            QtWidgets.QMessageBox.critical(QtWidgets.QMessageBox(), "Json Error", "Json TypeError")
-            sys.exit()
+            print("JsonLoader failed: {}".format(e))
+            print(traceback.format_exc())
+            self.loading_failed.emit(str(e))
+
+
+class SaveCancelled(Exception):
+    pass
+
+
+class JsonSaver(QtCore.QThread):
+    """
+    Serialises a save snapshot and writes it atomically off the GUI thread.
+    Entries are either cached json text or dicts that still need json.dumps.
+    Tree files are written in the binary format and cache no texts, for a
+    tree store entries are the StoreChanges of the snapshot.
+    """
+    progress = QtCore.pyqtSignal(int)
+    saving_finished = QtCore.pyqtSignal(object)
+    saving_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, file_manager, entries, file_path=None):
+        super().__init__()
+        self.file_manager = file_manager
+        self.entries = entries
+        self.file_path = file_path
+
+    def run(self):
+        try:
+            texts = []
+            if self.file_manager.is_store_file():
+                self.entries.write(self.file_path or self.file_manager.file_path, self._tree_progress)
+            elif self.file_manager.is_tree_file():
+                self.file_manager.write_atomic(self._write_tree, self.file_path, binary=True)
+            else:
+                self.file_manager.write_atomic(lambda file: self._write(file, texts), self.file_path)
+            self.saving_finished.emit(texts)
+        except SaveCancelled:
+            return
+        except Exception as e:
+            print("JsonSaver failed: {}".format(e))
+            self.saving_failed.emit(str(e))
+
+    def _write(self, file, texts):
+        count = max(len(self.entries), 1)
+        last_percent = -1
+        file.write('[')
+        for i, entry in enumerate(self.entries):
+            if self.isInterruptionRequested():
+                raise SaveCancelled()
+            text = entry if isinstance(entry, str) else json.dumps(entry, default=json_default)
+            texts.append(text)
+            if i:
+                file.write(', ')
+            file.write(text)
+            percent = i * 100 // count
+            if percent != last_percent:
+                self.progress.emit(percent)
+                last_percent = percent
+        file.write(']')
+
+    def _write_tree(self, file):
+        elements = [json.loads(entry) if isinstance(entry, str) else entry for entry in self.entries]
+        write_tree_file(file, elements, self._tree_progress)
 
-    def save_json_file(self, result_file):
-        with open(self.file_path, 'w') as file:
-            json.dump(result_file, file)
+    def _tree_progress(self, percent):
+        if self.isInterruptionRequested():
+            raise SaveCancelled()
+        self.progress.emit(percent)
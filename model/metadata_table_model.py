@@ -1,11 +1,23 @@
 from PyQt5 import QtCore, QtWidgets
-import qtawesome as qta
+from model.type_manager import TypeManager
+import collections
 import traceback
 
 
 class MetadataTableModel(QtCore.QAbstractTableModel):
+    """
+    Rows are {"key", "value"} dicts in table order. key_counts indexes the
+    keys so duplicate checks do not scan the rows. key_edit is (key, value)
+    when the last edit only changed the value of a key held by one row, that
+    change is written back to the item alone; other edits write back
+    getMetaData. Inserted rows emit nothing, rows_inserted keeps the next
+    write-back a whole one.
+    """
     def __init__(self, metadata=None, parent=None):
         super().__init__(parent)
+        self.key_counts = collections.Counter()
+        self.key_edit = None
+        self.rows_inserted = False
         try:
             if metadata is None:
                 self.metadata = None
@@ -16,11 +28,23 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
             print("Initialization failed: {}".format(e))
             print(traceback.format_exc())
 
+    def reset(self, item=None):
+        """Shows the metadata of item, no rows without one; the views keep this model"""
+        self.beginResetModel()
+        if item is None:
+            self.metadata = None
+            self.key_counts = collections.Counter()
+            self.key_edit = None
+            self.rows_inserted = False
+        else:
+            self.initialize_table(item.getMetaData())
+        self.endResetModel()
+
     def initialize_table(self, metadata):
-        self.metadata = []
-        for key, value in metadata.items():
-            if key != "":
-                self.metadata.append({"key": key, "value": value})
+        self.metadata = [{"key": key, "value": value} for key, value in metadata.items() if key != ""]
+        self.key_counts = collections.Counter(row["key"] for row in self.metadata)
+        self.key_edit = None
+        self.rows_inserted = False
 
     """
        The methods below are overridden methods of the base abstract class QAbstractItemModel
@@ -63,9 +87,9 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
 
             if role == QtCore.Qt.DecorationRole:
                 if column == 2:
-                    return qta.icon('fa5s.plus-circle')
+                    return TypeManager.get_icon('fa5s.plus-circle')
                 if  column == 3:
-                    return qta.icon('fa5s.minus-circle')
+                    return TypeManager.get_icon('fa5s.minus-circle')
         except Exception as e:
             print("data failed: {}".format(e))
             print(traceback.format_exc())
@@ -77,25 +101,30 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
                 return False
             column = index.column()
             row = index.row()
+            self.key_edit = None
             if column == 0:
-                for e in self.metadata:
-                    if e["key"] == value or value == '' and row > 0:
-                        print(value)
-                        QtWidgets.QMessageBox.critical(None,"Critical","this key already exists")
-                        return False
+                if value in self.key_counts or value == '' and row > 0 and self.metadata:
+                    print(value)
+                    QtWidgets.QMessageBox.critical(None,"Critical","this key already exists")
+                    return False
                 if not self.metadata:
-                    self.metadata.append({'key': '#real_empty#', 'value': ''})
-                self.metadata[row]["key"] = value
+                    self._append_row({'key': '#real_empty#', 'value': ''})
+                self._set_key(row, value)
 
             elif column == 1:
+                # a new first row or a renamed empty key change the keys too
+                key_unchanged = bool(self.metadata) and self.metadata[row]["key"] != ''
                 if not self.metadata:
-                    self.metadata.append({'key': '#real_empty#', 'value': ''})
+                    self._append_row({'key': '#real_empty#', 'value': ''})
                 if value == "" and self.metadata[row]["key"] == "#real_empty#":
                     QtWidgets.QMessageBox.critical(None,"Critical","cannot have empty value")
                     return False
                 if self.metadata[row]["key"] == '':
-                    self.metadata[row]["key"] = '#real_empty#'
+                    self._set_key(row, '#real_empty#')
+                key = self.metadata[row]["key"]
                 self.metadata[row]["value"] = value
+                if key_unchanged and not self.rows_inserted and self.key_counts[key] == 1:
+                    self.key_edit = key, value
 
             else:
                 return False
@@ -118,6 +147,9 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
         try:
             self.beginInsertRows(QtCore.QModelIndex(), row, row)
             self.metadata.insert(row + 1, {"key":"#real_empty#", "value":""})
+            self.key_counts["#real_empty#"] += 1
+            self.key_edit = None
+            self.rows_inserted = True
             self.endInsertRows()
             return True
         except Exception as e:
@@ -128,17 +160,17 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
         try:
             if len(self.metadata) == 1:
                 self.metadata = []
+                self.key_counts = collections.Counter()
+                self.key_edit = None
                 self.beginRemoveRows(QtCore.QModelIndex(), 0, 0)
                 self.endRemoveRows()
                 self.beginInsertRows(QtCore.QModelIndex(), 0, 0)
                 self.endInsertRows()
             else:
                 self.beginRemoveRows(QtCore.QModelIndex(), row, row)
-                new_metas = []
-                for i in range(len(self.metadata)):
-                    if i != row:
-                        new_metas.append(self.metadata[i])
-                self.metadata = new_metas
+                self._count_key(self.metadata[row]["key"], -1)
+                del self.metadata[row]
+                self.key_edit = None
                 self.endRemoveRows()
 
             self.dataChanged.emit(QtCore.QModelIndex(), QtCore.QModelIndex())
@@ -148,8 +180,22 @@ class MetadataTableModel(QtCore.QAbstractTableModel):
             print(traceback.format_exc())
 
     def getMetaData(self):
-        metadata = {}
-        for e in self.metadata:
-            key = e["key"]
-            metadata[key] = e["value"]
-        return metadata
+        """A new dict on every call, the item keeps it"""
+        self.rows_inserted = False
+        return {e["key"]: e["value"] for e in self.metadata}
+
+    def _append_row(self, row):
+        self.metadata.append(row)
+        self._count_key(row["key"], 1)
+
+    def _set_key(self, row, key):
+        self._count_key(self.metadata[row]["key"], -1)
+        self.metadata[row]["key"] = key
+        self._count_key(key, 1)
+
+    def _count_key(self, key, sign):
+        count = self.key_counts[key] + sign
+        if count > 0:
+            self.key_counts[key] = count
+        else:
+            self.key_counts.pop(key, None)
@@ -0,0 +1,454 @@
+"""
+Search index
+
+Titles, varIds and sources are grouped by their lowered value, and the
+distinct values are indexed by trigrams so a substring query only checks
+values that share all of its trigrams. Metadata keys are indexed exactly and
+the words of keys and values go to a sorted token index for prefix lookups.
+New values are indexed on the next query, loading stays cheap.
+
+Queries are plain text for titles, or field scoped:
+    varId:abc        varId contains abc
+    source:abc       one of the sources contains abc
+    meta:abc         a metadata key or value contains abc at the start of a word
+    meta:key=abc     the value of key contains abc at the start of a word
+Metadata candidates are found by word prefix, then checked for the text. The
+raw dicts of unexpanded subtrees are checked the same way, see data_matcher.
+A single metadata key edit indexes only its new words, the words it replaced
+stay as extra candidates of the item until its fields are removed.
+
+Titles and varIds are also looked up exactly, for paths, the uniqueness
+checks and "go to varId". The varIds inside raw subtrees that are not expanded yet (lazy mode)
+are counted separately, on the first lookup, and the counts follow later edits.
+Subtrees still in a tree store are not counted, the store is asked with SQL.
+
+Queries run on a SearchWorker thread while edits happen on the GUI thread,
+every public method holds the index lock.
+
+"""
+
+import bisect
+import collections
+import re
+import threading
+
+from PyQt5 import QtCore
+from model.tree_store import StoreChildren
+
+
+class SubstringIndex(object):
+    gram_size = 3
+
+    def __init__(self):
+        self.value_items = {}
+        self.gram_values = {}
+        self.unindexed_values = set()
+
+    def add(self, value, item):
+        value = _lower(value)
+        items = self.value_items.get(value)
+        if items is None:
+            self.value_items[value] = {item}
+            self.unindexed_values.add(value)
+        else:
+            items.add(item)
+
+    def remove(self, value, item):
+        value = _lower(value)
+        items = self.value_items.get(value)
+        if items is None:
+            return
+        items.discard(item)
+        if items:
+            return
+        del self.value_items[value]
+        if value in self.unindexed_values:
+            self.unindexed_values.discard(value)
+            return
+        for gram in self._grams(value):
+            values = self.gram_values.get(gram)
+            if values is not None:
+                values.discard(value)
+                if not values:
+                    del self.gram_values[gram]
+
+    def search(self, text):
+        result = set()
+        for value in self._matching_values(text.lower()):
+            result.update(self.value_items[value])
+        return result
+
+    def _matching_values(self, text):
+        if len(text) < self.gram_size:
+            return [value for value in self.value_items if text in value]
+        self._index_pending()
+        candidates = None
+        for gram in sorted(self._grams(text), key=lambda g: len(self.gram_values.get(g, ()))):
+            values = self.gram_values.get(gram)
+            if not values:
+                return []
+            candidates = set(values) if candidates is None else candidates & values
+            if not candidates:
+                return []
+        return [value for value in candidates if text in value]
+
+    def _index_pending(self):
+        for value in self.unindexed_values:
+            for gram in self._grams(value):
+                values = self.gram_values.get(gram)
+                if values is None:
+                    self.gram_values[gram] = {value}
+                else:
+                    values.add(value)
+        self.unindexed_values = set()
+
+    def _grams(self, value):
+        return {value[i:i + self.gram_size] for i in range(len(value) - self.gram_size + 1)}
+
+
+class TokenIndex(object):
+    """word -> items, with a sorted word list for prefix lookups"""
+
+    def __init__(self):
+        self.token_items = {}
+        self.sorted_tokens = []
+        self.dirty = False
+
+    def add(self, tokens, item):
+        for token in tokens:
+            items = self.token_items.get(token)
+            if items is None:
+                self.token_items[token] = {item}
+                self.dirty = True
+            else:
+                items.add(item)
+
+    def remove(self, tokens, item):
+        for token in tokens:
+            items = self.token_items.get(token)
+            if items is None:
+                continue
+            items.discard(item)
+            if not items:
+                del self.token_items[token]
+                self.dirty = True
+
+    def search_prefix(self, prefix):
+        if self.dirty:
+            self.sorted_tokens = sorted(self.token_items)
+            self.dirty = False
+        result = set()
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            result.update(self.token_items[token])
+        return result
+
+
+class SearchIndex(object):
+    fields = {"varid": "varId", "source": "source", "meta": "meta"}
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.titles = SubstringIndex()
+            self.var_ids = SubstringIndex()
+            self.sources = SubstringIndex()
+            self.meta_keys = {}
+            self.meta_tokens = TokenIndex()
+            # items whose children are still raw dicts (lazy mode)
+            self.pending_items = set()
+            # varId -> number of raw dicts with it below pending items
+            self.pending_var_ids = collections.Counter()
+            # pending items whose raw children are not counted yet
+            self.uncounted_items = set()
+            # pending items whose children are still in a tree store
+            self.stored_items = set()
+            # item -> metadata words of replaced values, they may still be in another key
+            self.stale_meta_tokens = {}
+
+    def add(self, item):
+        with self.lock:
+            if item.hasPendingChildren():
+                self.pending_items.add(item)
+                if isinstance(item.pendingChildren, StoreChildren):
+                    self.stored_items.add(item)
+                else:
+                    # counted on the first varId lookup, loading stays as fast as before
+                    self.uncounted_items.add(item)
+            self.titles.add(item.data(), item)
+            self._add_fields(item)
+
+    def remove(self, item):
+        with self.lock:
+            self.pending_items.discard(item)
+            if item.hasPendingChildren():
+                if item in self.uncounted_items or item in self.stored_items:
+                    self.uncounted_items.discard(item)
+                    self.stored_items.discard(item)
+                else:
+                    self._count_pending(item.pendingChildren, -1)
+            self.titles.remove(item.data(), item)
+            self._remove_fields(item)
+
+    def add_expanded(self, item, children):
+        """call once the raw children of item became the items children, their subtrees stay counted"""
+        with self.lock:
+            self.pending_items.discard(item)
+            counted = item not in self.uncounted_items and item not in self.stored_items
+            self.uncounted_items.discard(item)
+            self.stored_items.discard(item)
+            for child in children:
+                if counted:
+                    self._count_var_id(child.getVarId(), -1)
+                    if child.hasPendingChildren():
+                        self.pending_items.add(child)
+                    self.titles.add(child.data(), child)
+                    self._add_fields(child)
+                else:
+                    self.add(child)
+
+    def var_id_count(self, var_id):
+        """Number of items and raw dicts in the tree with exactly this varId"""
+        with self.lock:
+            self._count_uncounted()
+            count = len(self.items_with_var_id(var_id)) + self.pending_var_ids.get(var_id, 0)
+            for store, parents in self.stored_parents().items():
+                count += len(store.chains_below(store.var_id_ids(var_id), parents))
+            return count
+
+    def stored_parents(self):
+        """store -> {row id: pending item} of the pending items whose children are in a tree store"""
+        with self.lock:
+            result = {}
+            for item in self.stored_items:
+                children = item.pendingChildren
+                result.setdefault(children.store, {})[children.parent_id] = item
+            return result
+
+    def items_with_var_id(self, var_id):
+        with self.lock:
+            return [item for item in self.var_ids.value_items.get(_lower(var_id), ()) if item.getVarId() == var_id]
+
+    def items_with_title(self, title):
+        with self.lock:
+            return [item for item in self.titles.value_items.get(_lower(title), ()) if item.data() == title]
+
+    def _count_uncounted(self):
+        for item in self.uncounted_items:
+            self._count_pending(item.pendingChildren or [], 1)
+        self.uncounted_items = set()
+
+    def _count_pending(self, children, sign):
+        stack = list(children)
+        while stack:
+            data = stack.pop()
+            if len(data) == 0:
+                continue
+            self._count_var_id(data.get("varId"), sign)
+            stack.extend(data.get("children") or ())
+
+    def _count_var_id(self, var_id, sign):
+        if var_id is None:
+            return
+        count = self.pending_var_ids[var_id] + sign
+        if count > 0:
+            self.pending_var_ids[var_id] = count
+        else:
+            self.pending_var_ids.pop(var_id, None)
+
+    def rename(self, item, old_title):
+        with self.lock:
+            self.titles.remove(old_title, item)
+            self.titles.add(item.data(), item)
+
+    def remove_fields(self, item):
+        """call before changing varId, sources or metadata of an indexed item"""
+        with self.lock:
+            self._remove_fields(item)
+
+    def add_fields(self, item):
+        with self.lock:
+            self._add_fields(item)
+
+    def set_metadata_value(self, item, metadata, key, value, row=None):
+        """
+        Sets one key of the metadata dict of item, which it owns, and indexes only
+        that key; a new key goes to row or the end. The dict changes under the lock,
+        a SearchWorker may be reading it.
+        """
+        with self.lock:
+            if key in metadata:
+                self._add_stale_tokens(item, _tokens(_lower(metadata[key])))
+                metadata[key] = value
+            else:
+                self.meta_keys.setdefault(_lower(key), set()).add(item)
+                self.meta_tokens.add(_tokens(_lower(key)), item)
+                tail = [(k, metadata.pop(k)) for k in list(metadata)[row:]] if row is not None else []
+                metadata[key] = value
+                metadata.update(tail)
+            self.meta_tokens.add(_tokens(_lower(value)), item)
+
+    def remove_metadata_value(self, item, metadata, key):
+        with self.lock:
+            value = metadata.pop(key)
+            self._add_stale_tokens(item, _tokens(_lower(key)) + _tokens(_lower(value)))
+            lowered = _lower(key)
+            items = self.meta_keys.get(lowered)
+            if items is not None and not any(_lower(k) == lowered for k in metadata):
+                items.discard(item)
+                if not items:
+                    del self.meta_keys[lowered]
+
+    def _add_stale_tokens(self, item, tokens):
+        # the token index only yields candidates, a stale word costs a check until the fields are removed
+        self.stale_meta_tokens.setdefault(item, set()).update(tokens)
+
+    def add_subtree(self, item):
+        with self.lock:
+            stack = [item]
+            while stack:
+                item = stack.pop()
+                self.add(item)
+                stack.extend(item.childItems)
+
+    def remove_subtree(self, item):
+        with self.lock:
+            stack = [item]
+            while stack:
+                item = stack.pop()
+                self.remove(item)
+                stack.extend(item.childItems)
+
+    def search(self, text):
+        """Returns the set of items matching the query, case insensitive"""
+        field, value = self.parse_query(text)
+        with self.lock:
+            if field == "varId":
+                return self.var_ids.search(value)
+            if field == "source":
+                return self.sources.search(value)
+            if field == "meta":
+                return self._search_metadata(value)
+            return self.titles.search(value)
+
+    @staticmethod
+    def parse_query(text):
+        field, sep, value = text.partition(":")
+        if sep and field.strip().lower() in SearchIndex.fields:
+            return SearchIndex.fields[field.strip().lower()], value.strip()
+        return None, text
+
+    @staticmethod
+    def data_matcher(text):
+        """Returns a predicate with the same meaning as search() for raw json dicts"""
+        field, value = SearchIndex.parse_query(text)
+        value = value.lower()
+        if field == "varId":
+            return lambda data: value in _lower(data.get("varId"))
+        if field == "source":
+            return lambda data: any(value in _lower(source) for source in data.get("sources", []))
+        if field == "meta":
+            return lambda data: SearchIndex._metadata_matches(data.get("metadata", {}), value)
+        return lambda data: value in _lower(data.get("title"))
+
+    def _add_fields(self, item):
+        self.var_ids.add(item.getVarId(), item)
+        for source in item.getSources() or []:
+            self.sources.add(source, item)
+        metadata = item.getMetaData() or {}
+        for key in metadata:
+            self.meta_keys.setdefault(_lower(key), set()).add(item)
+        self.meta_tokens.add(self._metadata_tokens(metadata), item)
+
+    def _remove_fields(self, item):
+        self.var_ids.remove(item.getVarId(), item)
+        for source in item.getSources() or []:
+            self.sources.remove(source, item)
+        metadata = item.getMetaData() or {}
+        for key in metadata:
+            items = self.meta_keys.get(_lower(key))
+            if items is not None:
+                items.discard(item)
+                if not items:
+                    del self.meta_keys[_lower(key)]
+        self.meta_tokens.remove(self._metadata_tokens(metadata) | self.stale_meta_tokens.pop(item, set()), item)
+
+    def _search_metadata(self, value):
+        key, sep, text = value.partition("=")
+        if not sep:
+            key, text = None, value
+        key, text = key.strip().lower() if key else None, text.strip().lower()
+        candidates = set(self.meta_keys.get(key, ())) if key is not None else None
+        for word in _tokens(text):
+            if candidates is not None and not candidates:
+                break
+            items = self.meta_tokens.search_prefix(word)
+            candidates = items if candidates is None else candidates & items
+        if candidates is None:
+            return set()
+        if key is not None:
+            text = key + "=" + text
+        return {item for item in candidates if self._metadata_matches(item.getMetaData() or {}, text)}
+
+    @staticmethod
+    def _metadata_matches(metadata, value):
+        key, sep, text = value.partition("=")
+        if sep:
+            key, pattern = key.strip(), _word_start(text.strip())
+            return any(_lower(k) == key and pattern.search(_lower(v)) for k, v in metadata.items())
+        if not _tokens(value):
+            # no words to look up, the token index finds nothing either
+            return False
+        pattern = _word_start(value)
+        return any(pattern.search(_lower(k)) or pattern.search(_lower(v)) for k, v in metadata.items())
+
+    @staticmethod
+    def _metadata_tokens(metadata):
+        tokens = set()
+        for key, value in metadata.items():
+            tokens.update(_tokens(_lower(key)))
+            tokens.update(_tokens(_lower(value)))
+        return tokens
+
+
+class SearchWorker(QtCore.QThread):
+    """Runs one query and streams the matches back in chunks"""
+    matches_found = QtCore.pyqtSignal(object)
+    chunk_size = 200
+
+    def __init__(self, search_index, text):
+        super().__init__()
+        self.search_index = search_index
+        self.text = text
+
+    def run(self):
+        try:
+            if self.isInterruptionRequested():
+                return
+            matches = list(self.search_index.search(self.text))
+            for i in range(0, len(matches), self.chunk_size):
+                if self.isInterruptionRequested():
+                    return
+                self.matches_found.emit(matches[i:i + self.chunk_size])
+        except Exception as e:
+            print("SearchWorker failed: {}".format(e))
+
+
+def _lower(value):
+    if value is None:
+        return ""
+    return value.lower() if isinstance(value, str) else str(value).lower()
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text)
+
+
+def _word_start(text):
+    """Finds text where its first word starts a word, so every word of text is the prefix of a token"""
+    return re.compile((r"(?<!\w)" if re.match(r"\w", text) else "") + re.escape(text))
@@ -0,0 +1,198 @@
+"""
+Parsed-snapshot cache
+
+Keeps the parsed top-level elements of a json file in marshal format under
+~/.cache/ploytropos-ui, so opening an unchanged file skips json decoding.
+An entry is keyed by the absolute path, size, mtime and a hash of the content.
+Elements are stored in length-prefixed chunks so loading can stream them.
+
+"""
+
+import os
+import gc
+import sys
+import struct
+import marshal
+import hashlib
+import tempfile
+
+
+class SnapshotCache(object):
+    chunk_size = 1000
+    # a truncated or overwritten entry fails with one of these while decoding
+    corrupt_errors = (EOFError, ValueError, TypeError)
+    length = struct.Struct("<Q")
+    hash_block = 1 << 20
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "ploytropos-ui")
+
+    def key(self, file_path):
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(self.hash_block), b''):
+                digest.update(block)
+        # marshal is only readable by the same python version
+        return file_path, stat.st_size, stat.st_mtime_ns, digest.hexdigest(), marshal.version, sys.version_info[:2]
+
+    def cache_path(self, file_path):
+        name = hashlib.blake2b(os.path.abspath(file_path).encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name + ".marshal")
+
+    def read(self, key):
+        """Returns a generator of (element, percent) or None if there is no valid entry"""
+        cache_path = self.cache_path(key[0])
+        try:
+            file = open(cache_path, 'rb')
+        except OSError:
+            return None
+        try:
+            if tuple(self._read_chunk(file)) != key:
+                file.close()
+                return None
+        except self.corrupt_errors as e:
+            print("SnapshotCache read failed: {}".format(e))
+            file.close()
+            self.remove(key)
+            return None
+        except Exception:
+            file.close()
+            return None
+        return self._read_chunks(file, max(os.path.getsize(cache_path), 1))
+
+    def remove(self, key):
+        try:
+            os.unlink(self.cache_path(key[0]))
+        except OSError:
+            pass
+
+    def _read_chunks(self, file, size):
+        with file:
+            while True:
+                chunk = self._read_chunk(file)
+                if chunk is None:
+                    return
+                percent = min(100, file.tell() * 100 // size)
+                for element in chunk:
+                    yield element, percent
+
+    def _read_chunk(self, file):
+        header = file.read(self.length.size)
+        if not header:
+            return None
+        if len(header) < self.length.size:
+            raise EOFError("truncated chunk header")
+        size = self.length.unpack(header)[0]
+        data = file.read(size)
+        if len(data) < size:
+            raise EOFError("truncated chunk")
+        # the collector would rescan every container created so far, a chunk holds no cycles
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return marshal.loads(data)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def write_chunk(self, file, chunk):
+        data = marshal.dumps(chunk)
+        file.write(self.length.pack(len(data)))
+        file.write(data)
+
+    def writer(self, key):
+        return SnapshotWriter(self, key)
+
+    def stream(self, file_manager, file_path):
+        """
+        Yields (element, percent) like JsonFileManager._stream_array, from the cache
+        when the file did not change, otherwise from the json while filling the cache
+        """
+        key = self.key(file_path)
+        cached = self.read(key)
+        done = 0
+        if cached is not None:
+            try:
+                for element, percent in cached:
+                    done += 1
+                    yield element, percent
+                return
+            except self.corrupt_errors as e:
+                # the elements read so far match the json, continue from there and rebuild the entry
+                print("SnapshotCache read failed: {}".format(e))
+                self.remove(key)
+        with self.writer(key) as writer:
+            for index, (element, percent) in enumerate(file_manager._stream_array(file_path)):
+                writer.add(element)
+                if index >= done:
+                    yield element, percent
+
+
+class SnapshotWriter(object):
+    """
+    Writes a cache entry through a temp file, it only replaces the entry when
+    the whole file was parsed; a broken cache never breaks loading
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.file = None
+        self.temp_path = None
+        self.chunk = []
+
+    def __enter__(self):
+        try:
+            os.makedirs(self.cache.cache_dir, exist_ok=True)
+            fd, self.temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache.cache_dir)
+            self.file = os.fdopen(fd, 'wb')
+            self.cache.write_chunk(self.file, self.key)
+        except Exception as e:
+            print("SnapshotWriter failed: {}".format(e))
+            self._discard()
+        return self
+
+    def add(self, element):
+        if self.file is None:
+            return
+        self.chunk.append(element)
+        if len(self.chunk) >= self.cache.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        try:
+            self.cache.write_chunk(self.file, self.chunk)
+        except Exception as e:
+            print("SnapshotWriter failed: {}".format(e))
+            self._discard()
+        self.chunk = []
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.file is None:
+            return False
+        if exc_type is not None:
+            # cancelled or invalid json
+            self._discard()
+            return False
+        if self.chunk:
+            self._flush()
+        if self.file is None:
+            return False
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.temp_path, self.cache.cache_path(self.key[0]))
+        except Exception as e:
+            print("SnapshotWriter failed: {}".format(e))
+            self._discard()
+        return False
+
+    def _discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
@@ -1,5 +1,5 @@
 from PyQt5 import QtCore
-import qtawesome as qta
+from model.type_manager import TypeManager
 import traceback
 
 
@@ -8,17 +8,23 @@ class SourceTableModel(QtCore.QAbstractTableModel):
     def __init__(self, sources=None, parent=None):
         super().__init__(parent)
         try:
-            if sources is None:
-                self.sources = None
-                return
-            self.sources = []
-            for source in sources:
-                if source != "":
-                    self.sources.append(source)
+            self.initialize_table(sources)
         except Exception as e:
             print("Initialization failed: {}".format(e))
             print(traceback.format_exc())
 
+    def initialize_table(self, sources):
+        if sources is None:
+            self.sources = None
+            return
+        self.sources = [source for source in sources if source != ""]
+
+    def reset(self, item=None):
+        """Shows the sources of item, no rows without one; the views keep this model"""
+        self.beginResetModel()
+        self.initialize_table(item.getSources() if item is not None else None)
+        self.endResetModel()
+
     """
        The methods below are overridden methods of the base abstract class QAbstractItemModel
     """
@@ -47,9 +53,9 @@ class SourceTableModel(QtCore.QAbstractTableModel):
         column = index.column()
         if role == QtCore.Qt.DecorationRole:
             if column == 1:
-                return qta.icon('fa5s.plus-circle')
+                return TypeManager.get_icon('fa5s.plus-circle')
             if column == 2:
-                return qta.icon('fa5s.minus-circle')
+                return TypeManager.get_icon('fa5s.minus-circle')
 
         if role == QtCore.Qt.DisplayRole and column == 0:
             if len(self.sources) == 0:
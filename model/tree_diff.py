@@ -0,0 +1,191 @@
+"""
+Tree diff
+
+Compares two trees of TreeItems by their content hashes. Subtrees with equal
+digests are skipped without looking inside, so the cost depends on what
+changed, not on the size of the trees. Children are matched by digest first,
+the rest by title and then by varId, whatever stays unmatched was added or
+removed.
+
+Each change is (kind, path, fields) where path is a fullPath style title path
+and fields names the fields of a modified node.
+
+Compare two files with: python -m model.tree_diff old.json new.json
+
+"""
+
+import sys
+import json
+import collections
+
+from PyQt5 import QtCore
+from model.tree_item import TreeItem
+from model.tree_file import TreeFile, is_tree_file
+from model.tree_store import TreeStore, is_store_file
+
+ADDED = "Added"
+REMOVED = "Removed"
+MODIFIED = "Modified"
+REORDERED = "Reordered"
+
+FIELDS = (("title", TreeItem.data), ("varId", TreeItem.getVarId), ("dataType", TreeItem.getDataType),
+          ("sources", TreeItem.getSources), ("metadata", TreeItem.getMetaData))
+
+
+def load_root(file_path):
+    """A root TreeItem over the elements of a json, tree or store file, subtrees stay raw until compared"""
+    if is_tree_file(file_path):
+        elements = TreeFile(file_path).children()
+    elif is_store_file(file_path):
+        elements = TreeStore(file_path).children()
+    else:
+        with open(file_path) as file:
+            elements = json.load(file)
+    return root_of(elements)
+
+
+def root_of(elements):
+    # same fields as TreeModel.root_item, so the root digests compare
+    root = TreeItem({"title": "root"})
+    root.createChildren(elements, lazy=True)
+    return root
+
+
+def children_of(item):
+    children = list(item.childItems)
+    if item.hasPendingChildren():
+        # a detached copy, the compared tree is not touched
+        holder = TreeItem(None)
+        holder.createChildren(item.pendingChildren, lazy=True)
+        children.extend(holder.childItems)
+    return children
+
+
+def changed_fields(old, new):
+    return [name for name, getter in FIELDS if getter(old) != getter(new)]
+
+
+def diff_items(old_root, new_root):
+    """Returns the changes that turn the tree under old_root into the one under new_root"""
+    changes = []
+    stack = [(old_root, new_root, "")]
+    while stack:
+        old, new, path = stack.pop()
+        if old.contentHash() == new.contentHash():
+            continue
+        if old is not old_root:
+            fields = changed_fields(old, new)
+            if fields:
+                changes.append((MODIFIED, path, fields))
+        old_children = children_of(old)
+        new_children = children_of(new)
+        # equal subtrees are matched anywhere among the siblings
+        by_digest = collections.defaultdict(collections.deque)
+        for row, child in enumerate(new_children):
+            by_digest[child.contentHash()].append(row)
+        matched_rows = []
+        old_left = []
+        for child in old_children:
+            rows = by_digest.get(child.contentHash())
+            if rows:
+                matched_rows.append(rows.popleft())
+            else:
+                old_left.append(child)
+        matched = set(matched_rows)
+        new_left = [child for row, child in enumerate(new_children) if row not in matched]
+        if matched_rows != sorted(matched_rows):
+            changes.append((REORDERED, path or "/", []))
+        for old_child, new_child in _pair(old_left, new_left):
+            if old_child is None:
+                changes.append((ADDED, path + "/" + str(new_child.data()), []))
+            elif new_child is None:
+                changes.append((REMOVED, path + "/" + str(old_child.data()), []))
+            else:
+                stack.append((old_child, new_child, path + "/" + str(new_child.data())))
+    return changes
+
+
+def warm_digests(root, step=5000):
+    """
+    Fills the cached digests under root bottom-up and yields the percent of the
+    top-level items done after every step hashed nodes, so the open tree can be
+    hashed on the GUI thread in slices. An edit between two slices only drops
+    digests on its path again, contentHash fills them when the diff runs.
+    """
+    children = list(root.childItems)
+    count = max(len(children), 1)
+    hashed = 0
+    for row, child in enumerate(children):
+        stack = [(child, False)]
+        while stack:
+            item, children_done = stack.pop()
+            if item.contentDigest is not None:
+                continue
+            if not children_done:
+                stack.append((item, True))
+                stack.extend((grandchild, False) for grandchild in item.childItems
+                             if grandchild.contentDigest is None)
+                continue
+            item.contentHash()
+            hashed += 1
+            if hashed % step == 0:
+                yield row * 100 // count
+
+
+def _pair(old_children, new_children):
+    """Yields (old, new) pairs by title then varId, (old, None) and (None, new) for the rest"""
+    new_left = list(new_children)
+    old_left = []
+    for key in (TreeItem.data, TreeItem.getVarId):
+        by_key = collections.defaultdict(collections.deque)
+        for child in new_left:
+            if key(child) is not None:
+                by_key[key(child)].append(child)
+        paired = set()
+        for child in old_children:
+            candidates = by_key.get(key(child))
+            if candidates:
+                match = candidates.popleft()
+                paired.add(match)
+                yield child, match
+            else:
+                old_left.append(child)
+        new_left = [child for child in new_left if child not in paired]
+        old_children, old_left = old_left, []
+    for child in old_children:
+        yield child, None
+    for child in new_left:
+        yield None, child
+
+
+class DiffLoader(QtCore.QThread):
+    """Reads and hashes the trees of files off the GUI thread"""
+    loading_finished = QtCore.pyqtSignal(object)
+    loading_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, file_paths):
+        super().__init__()
+        self.file_paths = file_paths
+
+    def run(self):
+        try:
+            roots = []
+            for file_path in self.file_paths:
+                if self.isInterruptionRequested():
+                    return
+                root = load_root(file_path)
+                root.contentHash()
+                roots.append(root)
+            if not self.isInterruptionRequested():
+                self.loading_finished.emit(roots)
+        except Exception as e:
+            print("DiffLoader failed: {}".format(e))
+            self.loading_failed.emit(str(e))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python -m model.tree_diff old.json new.json")
+        sys.exit(1)
+    for kind, path, fields in diff_items(load_root(sys.argv[1]), load_root(sys.argv[2])):
+        print("{}\t{}\t{}".format(kind, path, ", ".join(fields)))
@@ -0,0 +1,170 @@
+"""
+Memory-mapped binary tree format (.ptree)
+
+Layout, little endian:
+    header      magic, node count, top-level count, node table offset
+    payloads    one compact json object per node, the node without "children"
+    node table  one fixed-size record per node: payload offset and length,
+                child count and id of the first child
+
+Nodes are numbered breadth first, so the children of a node are the
+contiguous records first_child .. first_child + child_count and the top-level
+nodes are 0 .. top-level count. A subtree is decoded without touching the
+rest of the file; children come as a lazy BinaryChildren sequence that the
+lazy TreeModel keeps as pending children until a folder is expanded.
+
+Convert with: python -m model.tree_file input.json output.ptree (or back)
+
+"""
+
+import os
+import sys
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+import collections
+import collections.abc
+
+MAGIC = b"PTREE001"
+HEADER = struct.Struct("<8sQQQ")
+RECORD = struct.Struct("<QIIQ")
+# child count of a node without a "children" key
+NO_CHILDREN = 0xFFFFFFFF
+EXTENSION = ".ptree"
+
+
+def is_tree_file(file_path):
+    return file_path.lower().endswith(EXTENSION)
+
+
+def json_default(obj):
+    """json.dumps hook for subtrees that were not decoded yet"""
+    if isinstance(obj, collections.abc.Sequence):
+        return list(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+class TreeFile(object):
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.node_count, self.top_count, self.table_offset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a tree file: {}".format(file_path))
+        if self.table_offset + self.node_count * RECORD.size > len(self.map):
+            raise ValueError("Truncated tree file: {}".format(file_path))
+
+    def node(self, node_id):
+        offset, length, child_count, first_child = RECORD.unpack_from(self.map, self.table_offset + node_id * RECORD.size)
+        data = json.loads(self.map[offset:offset + length].decode("utf-8"))
+        if child_count != NO_CHILDREN:
+            data["children"] = BinaryChildren(self, first_child, child_count)
+        return data
+
+    def children(self):
+        return BinaryChildren(self, 0, self.top_count)
+
+    def iter_elements(self):
+        """Yields (element, percent) like JsonFileManager._stream_array"""
+        count = max(self.top_count, 1)
+        for node_id in range(self.top_count):
+            yield self.node(node_id), (node_id + 1) * 100 // count
+
+
+class BinaryChildren(collections.abc.Sequence):
+    """Lazy sequence of the child dicts of one node, decoded on access"""
+    __slots__ = ("tree_file", "first", "count")
+
+    def __init__(self, tree_file, first, count):
+        self.tree_file = tree_file
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError("child index out of range")
+        return self.tree_file.node(self.first + row)
+
+    def __iter__(self):
+        for node_id in range(self.first, self.first + self.count):
+            yield self.tree_file.node(node_id)
+
+
+def write_tree_file(file, elements, progress=None):
+    """
+    Writes the top-level element dicts to a binary file object. Children may be
+    lists or BinaryChildren of another file; only one tree level of pending
+    sibling sequences is held at a time. progress(percent) is called as nodes
+    are written and may raise to cancel.
+    """
+    file.write(HEADER.pack(MAGIC, 0, 0, 0))
+    offset = HEADER.size
+    node_count = 0
+    next_id = len(elements)
+    last_percent = -1
+    queue = collections.deque([elements])
+    with tempfile.TemporaryFile() as table:
+        while queue:
+            for data in queue.popleft():
+                fields = {key: value for key, value in data.items() if key != "children"}
+                payload = json.dumps(fields, separators=(',', ':'), ensure_ascii=False,
+                                     default=json_default).encode("utf-8")
+                children = data.get("children")
+                if children is None:
+                    child_count, first_child = NO_CHILDREN, 0
+                else:
+                    child_count, first_child = len(children), next_id
+                    next_id += child_count
+                    if child_count:
+                        queue.append(children)
+                file.write(payload)
+                table.write(RECORD.pack(offset, len(payload), child_count, first_child))
+                offset += len(payload)
+                node_count += 1
+                if progress is not None:
+                    percent = node_count * 100 // next_id
+                    if percent > last_percent:
+                        progress(percent)
+                        last_percent = percent
+        table.seek(0)
+        shutil.copyfileobj(table, file)
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, node_count, len(elements), offset))
+    file.seek(0, os.SEEK_END)
+
+
+def json_to_tree_file(json_path, tree_path):
+    with open(json_path) as file:
+        elements = json.load(file)
+    with open(tree_path, 'wb') as file:
+        write_tree_file(file, elements)
+
+
+def tree_file_to_json(tree_path, json_path):
+    tree_file = TreeFile(tree_path)
+    with open(json_path, 'w') as file:
+        file.write('[')
+        for i, data in enumerate(tree_file.children()):
+            if i:
+                file.write(', ')
+            file.write(json.dumps(data, default=json_default))
+        file.write(']')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python -m model.tree_file input.json output.ptree | input.ptree output.json")
+        sys.exit(1)
+    if is_tree_file(sys.argv[1]):
+        tree_file_to_json(sys.argv[1], sys.argv[2])
+    else:
+        json_to_tree_file(sys.argv[1], sys.argv[2])
@@ -0,0 +1,101 @@
+from PyQt5 import QtCore
+
+# role of the dataChanged the filter sends for rows whose visibility changed
+FILTER_ROLE = QtCore.Qt.UserRole + 1
+
+
+class TreeFilterModel(QtCore.QSortFilterProxyModel):
+    """
+    Sits between TreeModel and TreeView while a search is shown and hides the
+    rows that are not on the path to a search match. Matches keep their whole
+    subtree visible. The view goes back to TreeModel itself when the search is
+    cleared, so clearing only drops the sets.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.matches = None
+        self.visible = set()
+        self.setFilterRole(FILTER_ROLE)
+
+    def is_filtering(self):
+        return self.matches is not None
+
+    def start_filter(self):
+        self.matches = set()
+        self.visible = set()
+        self.invalidate()
+
+    def clear_filter(self):
+        self.matches = None
+        self.visible = set()
+
+    def add_matches(self, items):
+        """Shows items and their ancestors, returns the ancestors that became visible"""
+        if self.matches is None:
+            self.matches = set()
+        opened = []
+        changed = {}
+        for item in items:
+            if item in self.matches:
+                continue
+            if item in self.visible:
+                # only the paths to earlier matches are shown below it
+                self._visible_parents(item, changed)
+            self.matches.add(item)
+            while item not in self.visible:
+                self.visible.add(item)
+                parent = item.parent()
+                if parent is None:
+                    break
+                rows = changed.setdefault(parent, set())
+                if rows is not None:
+                    rows.add(item.childNumber())
+                opened.append(parent)
+                item = parent
+        self._rows_changed(changed)
+        return opened
+
+    def _visible_parents(self, item, changed):
+        stack = [item]
+        while stack:
+            item = stack.pop()
+            changed[item] = None
+            stack.extend(child for child in item.childItems if child in self.visible)
+
+    def _rows_changed(self, changed):
+        # the proxy re-filters the rows of a dataChanged, rows under parents it never mapped cost nothing
+        model = self.sourceModel()
+        for parent, rows in changed.items():
+            if rows is None:
+                rows = range(parent.childCount())
+            parent_index = model.index_of(parent)
+            first = last = None
+            for row in sorted(rows):
+                if last is not None and row == last + 1:
+                    last = row
+                    continue
+                if first is not None:
+                    self._emit_rows(model, parent_index, first, last)
+                first = last = row
+            if first is not None:
+                self._emit_rows(model, parent_index, first, last)
+
+    def _emit_rows(self, model, parent_index, first, last):
+        model.dataChanged.emit(model.index(first, 0, parent_index), model.index(last, 0, parent_index), [FILTER_ROLE])
+
+    def get_item(self, index):
+        return self.sourceModel().get_item(self.mapToSource(index))
+
+    # inherited Method
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.matches is None:
+            return True
+        parent_item = self.sourceModel().get_item(source_parent)
+        if parent_item.child(source_row) in self.visible:
+            return True
+        while parent_item is not None:
+            if parent_item in self.matches:
+                return True
+            parent_item = parent_item.parent()
+        return False
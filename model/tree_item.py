@@ -1,7 +1,14 @@
+import sys
 import traceback
 
+from model.content_hash import node_digest, data_hash
+
 
 class TreeItem(object):
+    # no per-instance __dict__, the tree can hold millions of items
+    __slots__ = ("parentItem", "childItems", "varId", "dataType", "sources", "metadata", "itemData",
+                 "valueChanged", "newAdded", "rowNumber", "pendingChildren", "storeId", "contentDigest",
+                 "pathCache")
 
     def __init__(self, data, parent=None):
         self.parentItem = parent
@@ -13,27 +20,68 @@ class TreeItem(object):
         self.itemData = None
         self.valueChanged = False
         self.newAdded = False
-        self.isHidden = True
+        self.rowNumber = 0
+        self.pendingChildren = None
+        # row id of the node in a tree store, only nodes read from a store have one
+        self.storeId = None
+        # cached contentHash, None until computed and after any change in the subtree
+        self.contentDigest = None
+        # cached fullPath, None until computed and after a rename or move above the item
+        self.pathCache = None
 
         if data is not None:
+            self.storeId = getattr(data, "storeId", None)
             self.itemData = data["title"]
             self.varId = (data["varId"] if 'varId' in data else None)
             self.dataType = (data["dataType"] if 'dataType' in data else None)
+            if isinstance(self.dataType, str):
+                self.dataType = sys.intern(self.dataType)
             self.sources = (data["sources"] if 'sources' in data else [])
-            self.metadata = (data["metadata"] if 'metadata' in data else {})
+            metadata = (data["metadata"] if 'metadata' in data else {})
+            # the streamed elements are decoded one by one, json shares equal keys only inside one element
+            self.metadata = {sys.intern(key): value for key, value in metadata.items()} if metadata else metadata
 
     def parent(self):
         return self.parentItem
 
+    def setParent(self, parent):
+        self.parentItem = parent
+        self.invalidatePath()
+
     def child(self, row):
         return self.childItems[row]
 
     def childCount(self):
         return len(self.childItems)
 
+    def hasPendingChildren(self):
+        return bool(self.pendingChildren)
+
+    def setPendingChildren(self, children):
+        self.pendingChildren = children if children else None
+        self.invalidateHash()
+        return True
+
+    def takePendingChildren(self):
+        children = self.pendingChildren or []
+        self.pendingChildren = None
+        return children
+
+    def pendingMatches(self, matches):
+        # walks the raw dicts of a not yet materialized subtree
+        stack = list(self.pendingChildren or [])
+        while stack:
+            data = stack.pop()
+            if len(data) == 0:
+                continue
+            if matches(data):
+                return True
+            stack.extend(data.get("children", []))
+        return False
+
     def childNumber(self):
         if self.parentItem != None:
-            return self.parentItem.childItems.index(self)
+            return self.rowNumber
         return 0
 
     def data(self):
@@ -41,6 +89,8 @@ class TreeItem(object):
 
     def setData(self, value):
         self.itemData = value
+        self.invalidateHash()
+        self.invalidatePath()
         return True
 
     def getVarId(self):
@@ -48,13 +98,15 @@ class TreeItem(object):
 
     def setVarId(self, value):
         self.varId = value
+        self.invalidateHash()
         return True
 
     def getDataType(self):
         return self.dataType
 
     def setDataType(self, value):
-        self.dataType = value
+        self.dataType = sys.intern(value) if isinstance(value, str) else value
+        self.invalidateHash()
         return True
 
     def getSources(self):
@@ -62,6 +114,7 @@ class TreeItem(object):
 
     def setSources(self, sources):
         self.sources = sources
+        self.invalidateHash()
         return True
 
     def setValueChanged(self, flag):
@@ -77,6 +130,7 @@ class TreeItem(object):
 
     def setMetaData(self, metadata):
         self.metadata = metadata
+        self.invalidateHash()
         return True
 
     def create_new_item(self):
@@ -89,10 +143,12 @@ class TreeItem(object):
                 new_item["sources"] = self.sources
             if len(self.metadata):
                 new_item["metadata"] = self.metadata
-            if self.childCount():
+            if self.childCount() or self.hasPendingChildren():
                 new_item["children"] = []
                 for child in self.childItems:
                     new_item["children"].append(child.create_new_item())
+                if self.hasPendingChildren():
+                    new_item["children"].extend(self.pendingChildren)
             return new_item
         except Exception as e:
             print("create_new_item failed: {}".format(e))
@@ -104,37 +160,105 @@ class TreeItem(object):
             if self.childCount():
                 for child in self.childItems:
                     new_item.appendChild(child.create_duplicate(new_item))
+            if self.hasPendingChildren():
+                new_item.createChildren(self.pendingChildren)
+                # the stored rows still belong to the original
+                stack = list(new_item.childItems)
+                while stack:
+                    current = stack.pop()
+                    current.storeId = None
+                    stack.extend(current.childItems)
 
             return new_item
         except Exception as e:
             print("create_duplicate failed: {}".format(e))
             print(traceback.format_exc())
 
+    def createChildren(self, children, lazy=False):
+        for data in children:
+            if len(data) == 0:
+                continue
+            item = TreeItem(data, self)
+            self.appendChild(item)
+            if 'children' in data:
+                if lazy:
+                    item.setPendingChildren(data["children"])
+                else:
+                    item.createChildren(data["children"])
+
     def appendChild(self, item):
+        item.setParent(self)
+        item.rowNumber = len(self.childItems)
         self.childItems.append(item)
+        self.invalidateHash()
 
     def insertChild(self, position, item):
         if position > len(self.childItems):
             return False
         self.childItems.insert(position, item)
+        item.setParent(self)
+        self._renumberChildren(position)
+        self.invalidateHash()
+        return True
+
+    def insertChildren(self, position, items):
+        if position > len(self.childItems):
+            return False
+        self.childItems[position:position] = items
+        for item in items:
+            item.setParent(self)
+        self._renumberChildren(position)
+        self.invalidateHash()
         return True
 
     def removeChildren(self, position, count):
         if position < 0 or position + count > len(self.childItems):
             return False
-        while count > 0:
-            self.childItems.pop(position)
-            count -= 1
+        del self.childItems[position:position + count]
+        self._renumberChildren(position)
+        self.invalidateHash()
         return True
 
+    def contentHash(self):
+        """Digest of the fields and the subtree, see model.content_hash"""
+        if self.contentDigest is None:
+            child_digests = [child.contentHash() for child in self.childItems]
+            if self.pendingChildren:
+                child_digests.extend(data_hash(data) for data in self.pendingChildren if len(data))
+            self.contentDigest = node_digest(self.itemData, self.varId, self.dataType, self.sources, self.metadata,
+                                             child_digests)
+        return self.contentDigest
+
+    def invalidateHash(self):
+        # a cached digest implies cached child digests, so the walk up stops at the first stale one
+        item = self
+        while item is not None and item.contentDigest is not None:
+            item.contentDigest = None
+            item = item.parentItem
+
+    def invalidatePath(self):
+        # a cached path implies a cached parent path, so the walk down skips subtrees without one
+        if self.pathCache is None:
+            return
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            item.pathCache = None
+            stack.extend(child for child in item.childItems if child.pathCache is not None)
+
+    def _renumberChildren(self, position):
+        # keeps childNumber() O(1); only the rows after position have shifted
+        for row in range(position, len(self.childItems)):
+            self.childItems[row].rowNumber = row
+
     def fullPath(self):
         try:
-            path = [self.data()]
-            parent = self.parent()
-            while parent.parent() is not None:
-                path.append(parent.data())
-                parent = parent.parent()
-            return '/' + '/'.join(reversed(path))
+            # built from the cached path of the parent, so one join per uncached item
+            if self.pathCache is None:
+                parent = self.parent()
+                prefix = parent.fullPath() if parent.parent() is not None else ""
+                self.pathCache = prefix + '/' + self.data()
+            return self.pathCache
         except Exception as e:
             print("fullPath failed: {}".format(e))
             print(traceback.format_exc())
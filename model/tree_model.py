@@ -1,29 +1,698 @@
-import qtawesome as qta
 from PyQt5 import QtCore, QtGui
 from model.tree_item import TreeItem
 from model.type_manager import TypeManager
+from model.search_index import SearchIndex
+from model.change_tracker import ChangeTracker
+from model.tree_store import StoreChanges, StoreChildren
+from model.undo_stack import UndoStack, changed_rows
+import bisect
+import random
+import string
 import traceback
 
 
 class TreeModel(QtCore.QAbstractItemModel):
     rowMoved = QtCore.pyqtSignal(object)
+    # every edit as a json-serialisable operation, see apply_edit; an added
+    # subtree is passed as its TreeItem and serialised only by whoever writes it
+    edited = QtCore.pyqtSignal(object)
 
     def __init__(self):
         QtCore.QAbstractItemModel.__init__(self)
         self.root_item = TreeItem({"title": "root"})
+        # in lazy mode children stay raw dicts until their parent is expanded
+        self.lazy = False
+        self.search_index = SearchIndex()
+        self.change_tracker = ChangeTracker(self.root_item)
+        self.undo_stack = UndoStack()
+        # edits collected between begin_batch and end_batch
+        self._batch_edits = None
+        self._batch_depth = 0
 
     def load_data(self, data):
-        for element in data:
-            self.create_tree(element, self.root_item)
+        holder = TreeItem(None)
+        holder.createChildren(data, self.lazy)
+        self.replace_all(holder.childItems)
 
-    def create_tree(self, data, parent_item):
-        if len(data) == 0:
+    def clear(self):
+        """Drops the whole tree with one model reset, the change journal starts over"""
+        self.beginResetModel()
+        self.root_item.childItems = []
+        self.root_item.invalidateHash()
+        self.search_index.clear()
+        self.change_tracker.reset()
+        self.undo_stack.clear()
+        self.endResetModel()
+
+    def replace_all(self, items):
+        """Replaces the top-level items with one model reset, used for a fresh load"""
+        self.beginResetModel()
+        self.root_item.childItems = []
+        self.root_item.invalidateHash()
+        self.search_index.clear()
+        self.change_tracker.reset()
+        self.undo_stack.clear()
+        for item in items:
+            item.parentItem = self.root_item
+            self.root_item.appendChild(item)
+            self.search_index.add_subtree(item)
+        self.endResetModel()
+
+    def begin_batch(self):
+        """Edits until the matching end_batch are journaled as one batch operation and undone as one"""
+        if self._batch_depth == 0:
+            self._batch_edits = []
+        self._batch_depth += 1
+        self.undo_stack.begin()
+
+    def end_batch(self):
+        self._batch_depth -= 1
+        self.undo_stack.end()
+        if self._batch_depth:
+            return
+        edits, self._batch_edits = self._batch_edits, None
+        if edits:
+            self.edited.emit(edits[0] if len(edits) == 1 else {"op": "batch", "edits": edits})
+
+    def _emit_edit(self, edit):
+        if self._batch_edits is not None:
+            self._batch_edits.append(edit)
+        else:
+            self.edited.emit(edit)
+
+    def items_changed(self, items):
+        """One dataChanged per parent, spanning the changed rows"""
+        rows_by_parent = {}
+        for item in items:
+            rows_by_parent.setdefault(item.parent(), []).append(item.childNumber())
+        for parent, rows in rows_by_parent.items():
+            parent_index = self.index_of(parent)
+            self.dataChanged.emit(self.index(min(rows), 0, parent_index), self.index(max(rows), 0, parent_index))
+
+    def top_items(self, items):
+        """items without the ones inside another of them, in tree order"""
+        selected = set(items)
+        items = [item for item in selected if item is not self.root_item and not self._has_ancestor_in(item, selected)]
+        return sorted(items, key=self.item_path)
+
+    def insert_items(self, parent_item, row, items):
+        """Inserts new items at row of parent_item with one insertRows"""
+        parent_item.insertChildren(row, items)
+        return self.insertRows(row, len(items), self.index_of(parent_item))
+
+    def move_items(self, items, folder):
+        """
+        Appends items to folder with one layout change instead of a move signal
+        per row. Returns the moved items, nothing moves into itself.
+        """
+        folder_index = self.index_of(folder)
+        if self.canFetchMore(folder_index):
+            self.fetchMore(folder_index)
+        items = [item for item in self.top_items(items)
+                 if item is not folder and not self._has_ancestor_in(folder, {item}) and item.parent() is not folder]
+        if not items:
+            return []
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistent_items = [index.internalPointer() for index in persistent]
+        # the edits replay as moves one by one, each path leaves out the items
+        # moved before it. The rows of each source parent are rebuilt once afterwards
+        removed = {}
+        origins = []
+        row = folder.childCount()
+        for item in items:
+            source_parent_item = item.parent()
+            path = self._path_after_removals(item, removed)
+            self._emit_edit({"op": "move", "path": path, "parent": self._path_after_removals(folder, removed),
+                             "row": row})
+            self.change_tracker.record_moved(item, source_parent_item, item.childNumber())
+            origins.append((source_parent_item, item.childNumber()))
+            item.setValueChanged(True)
+            # items come in tree order, so the rows of each parent stay sorted
+            removed.setdefault(source_parent_item, []).append(item.childNumber())
+            row += 1
+        moved = set(items)
+        for source_parent_item in removed:
+            source_parent_item.childItems = [child for child in source_parent_item.childItems if child not in moved]
+            source_parent_item._renumberChildren(0)
+            source_parent_item.invalidateHash()
+        folder.insertChildren(folder.childCount(), items)
+        for item in items:
+            self.change_tracker.mark_dirty(item)
+        # items keep their identity, only their rows changed
+        self.changePersistentIndexList(persistent, [self.index_of(item) for item in persistent_items])
+        self.layoutChanged.emit()
+        self.undo_stack.record({"op": "return", "items": items, "origins": origins},
+                               {"op": "moveItems", "items": items, "folder": folder})
+        return items
+
+    def return_items(self, items, origins):
+        """
+        Inverse of move_items: puts the items appended to their folder back at
+        the (parent, row) they came from, with one layout change
+        """
+        folder = items[0].parent()
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        persistent_items = [index.internalPointer() for index in persistent]
+        moved = set(items)
+        folder.childItems = [child for child in folder.childItems if child not in moved]
+        folder._renumberChildren(0)
+        folder.invalidateHash()
+        by_parent = {}
+        for item, (parent, row) in zip(items, origins):
+            by_parent.setdefault(parent, []).append((row, item))
+        # items come in tree order, so each parent gets them back in ascending rows
+        for parent, entries in by_parent.items():
+            children = parent.childItems
+            merged = []
+            taken = 0
+            for row, item in entries:
+                count = row - len(merged)
+                merged.extend(children[taken:taken + count])
+                taken += count
+                merged.append(item)
+                item.setParent(parent)
+            merged.extend(children[taken:])
+            parent.childItems = merged
+            parent._renumberChildren(0)
+            parent.invalidateHash()
+        # journaled as moves one by one in tree order, the items not back yet
+        # still sit at the end of the folder
+        not_back = {parent: [row for row, item in entries] for parent, entries in by_parent.items()}
+        back = {}
+        tracker = self.change_tracker
+        if folder is not self.root_item:
+            tracker.mark_dirty(folder)
+        for item, (parent, row) in zip(items, origins):
+            path = self._path_before_returns(folder, not_back, back) + [folder.childCount()]
+            self._emit_edit({"op": "move", "path": path, "parent": self._path_before_returns(parent, not_back, back),
+                             "row": row})
+            back[parent] = back.get(parent, 0) + 1
+            tracker.record_moved(item, folder, folder.childCount())
+            if tracker.moved.get(item) == (parent, row):
+                tracker.record_restored(ChangeTracker.MOVED, item)
+                item.setValueChanged(item in tracker.modified)
+        self.changePersistentIndexList(persistent, [self.index_of(item) for item in persistent_items])
+        self.layoutChanged.emit()
+        self.undo_stack.record({"op": "moveItems", "items": items, "folder": folder},
+                               {"op": "return", "items": items, "origins": origins})
+
+    def _path_before_returns(self, item, not_back, back):
+        """item_path while only back[parent] of the sorted rows in not_back[parent] are filled"""
+        path = []
+        while item is not None and item is not self.root_item:
+            row = item.childNumber()
+            missing = bisect.bisect_left(not_back.get(item.parent(), ()), row) - back.get(item.parent(), 0)
+            path.append(row - max(missing, 0))
+            item = item.parent()
+        path.reverse()
+        return path
+
+    def _path_after_removals(self, item, removed):
+        """item_path once the sorted rows in removed[parent] are gone"""
+        path = []
+        while item is not None and item is not self.root_item:
+            row = item.childNumber()
+            path.append(row - bisect.bisect_left(removed.get(item.parent(), ()), row))
+            item = item.parent()
+        path.reverse()
+        return path
+
+    def set_data_type_items(self, items, value):
+        for item in items:
+            if item.getDataType() != value:
+                self.set_data_type(item, value)
+        self.items_changed(items)
+
+    def set_metadata_key_items(self, items, key, value):
+        for item in items:
+            self.set_metadata_key(item, key, value)
+        self.items_changed(items)
+
+    def remove_metadata_key_items(self, items, key):
+        items = [item for item in items if key in item.getMetaData()]
+        for item in items:
+            self.remove_metadata_key(item, key)
+        self.items_changed(items)
+        return items
+
+    def remove_items(self, items):
+        """
+        Removes items with one removeRows per run of adjacent rows, items inside
+        another removed item go with it. Returns the number of removed rows.
+        """
+        removing = set(items)
+        rows_by_parent = {}
+        for item in items:
+            if item is self.root_item or self._has_ancestor_in(item, removing):
+                continue
+            rows_by_parent.setdefault(item.parent(), set()).add(item.childNumber())
+        removed = 0
+        for parent, rows in rows_by_parent.items():
+            parent_index = self.index_of(parent)
+            rows = sorted(rows, reverse=True)
+            # bottom-up so the rows of the next run do not shift
+            while rows:
+                last = first = rows.pop(0)
+                while rows and rows[0] == first - 1:
+                    first = rows.pop(0)
+                self.removeRows(first, last - first + 1, parent_index)
+                removed += last - first + 1
+        return removed
+
+    def append_items(self, items):
+        """Attaches top-level items that were built outside of the model"""
+        if not items:
+            return
+        first = self.root_item.childCount()
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+        for item in items:
+            item.parentItem = self.root_item
+            self.root_item.appendChild(item)
+            self.search_index.add_subtree(item)
+        self.endInsertRows()
+
+    def search(self, text):
+        """Returns the set of items matching the query, see SearchIndex for the syntax"""
+        self.fetch_pending_matches(text)
+        return self.search_index.search(text)
+
+    def fetch_pending_matches(self, text):
+        """Materializes only the raw subtrees that contain a match, lazy mode only"""
+        if not self.lazy:
             return
-        new_item = TreeItem(data, parent_item)
-        parent_item.appendChild(new_item)
-        if 'children' in data:
-            for element in data["children"]:
-                self.create_tree(element, new_item)
+        field, value = SearchIndex.parse_query(text)
+        self._fetch_pending(SearchIndex.data_matcher(text), lambda store: store.match_ids(field, value.lower()))
+
+    def _fetch_pending(self, matches, stored_ids):
+        """
+        Expands the pending subtrees that hold a node matches accepts. Stores
+        give the candidate ids with stored_ids(store), only those are read.
+        """
+        children_by_id = {}
+        for store, parents in self.search_index.stored_parents().items():
+            chains = store.chains_below(stored_ids(store), parents)
+            found = store.matching_ids([chain[-1] for chain in chains], matches)
+            for chain in chains:
+                if chain[-1] in found:
+                    self._fetch_chain(parents[chain[0]], chain[1:-1], children_by_id)
+        pending = [item for item in self.search_index.pending_items if not isinstance(item.pendingChildren, StoreChildren)]
+        while pending:
+            item = pending.pop()
+            if item.hasPendingChildren() and item.pendingMatches(matches):
+                self.fetchMore(self.index_of(item))
+                pending.extend(child for child in item.childItems if child.hasPendingChildren())
+
+    def _fetch_chain(self, item, node_ids, children_by_id):
+        # expands item and the stored children with node_ids below it, one level each
+        for node_id in [None] + node_ids:
+            if node_id is not None:
+                if item not in children_by_id:
+                    children_by_id[item] = {child.storeId: child for child in item.childItems}
+                item = children_by_id[item].get(node_id)
+                if item is None:
+                    return
+            index = self.index_of(item)
+            if self.canFetchMore(index):
+                self.fetchMore(index)
+
+    def var_id_in_use(self, var_id, item=None):
+        """True when another node than item has this varId, O(1) once the tree is counted"""
+        if var_id is None or var_id == "":
+            return False
+        count = self.search_index.var_id_count(var_id)
+        if item is not None and item.getVarId() == var_id:
+            count -= 1
+        return count > 0
+
+    def unique_var_id(self, base=None, reserved=None):
+        """
+        base when it is free, else base_2, base_3 ...; a random id without base.
+        Ids in reserved are taken too, the new id is added to it.
+        """
+        reserved = reserved if reserved is not None else set()
+        if base is None:
+            letters = string.ascii_letters + string.digits
+            candidate = ''.join(random.choice(letters) for i in range(20))
+            while candidate in reserved or self.var_id_in_use(candidate):
+                candidate = ''.join(random.choice(letters) for i in range(20))
+        else:
+            candidate = base
+            number = 1
+            while candidate in reserved or self.var_id_in_use(candidate):
+                number += 1
+                candidate = "{}_{}".format(base, number)
+        reserved.add(candidate)
+        return candidate
+
+    def item_with_var_id(self, var_id):
+        """The first node with var_id, raw subtrees holding it are expanded; None if there is none"""
+        items = [item for item in self.search_index.items_with_var_id(var_id) if self.change_tracker.is_attached(item)]
+        if not items and self.search_index.var_id_count(var_id):
+            self._fetch_pending(lambda data: data.get("varId") == var_id, lambda store: store.var_id_ids(var_id))
+            items = [item for item in self.search_index.items_with_var_id(var_id)
+                     if self.change_tracker.is_attached(item)]
+        return min(items, key=self.item_path) if items else None
+
+    def set_var_id(self, item, value):
+        self.undo_stack.record({"op": "varId", "item": item, "value": item.getVarId()},
+                               {"op": "varId", "item": item, "value": value})
+        self.change_tracker.record_modified(item)
+        self.search_index.remove_fields(item)
+        item.setVarId(value)
+        item.setValueChanged(True)
+        self.search_index.add_fields(item)
+        self._emit_edit({"op": "varId", "path": self.item_path(item), "value": value})
+
+    def set_sources(self, item, sources):
+        row, old_rows, new_rows = changed_rows(item.getSources(), list(sources))
+        self.undo_stack.record({"op": "sourceRows", "item": item, "row": row, "count": len(new_rows), "value": old_rows},
+                               {"op": "sourceRows", "item": item, "row": row, "count": len(old_rows), "value": new_rows})
+        self.change_tracker.record_modified(item)
+        self.search_index.remove_fields(item)
+        # the source table keeps editing its own list in place
+        item.setSources(list(sources))
+        item.setValueChanged(True)
+        self.search_index.add_fields(item)
+        self._emit_edit({"op": "sources", "path": self.item_path(item), "value": item.getSources()})
+
+    def set_metadata(self, item, metadata):
+        # rows are (key, value) pairs in dict order, a value edit is one pair
+        row, old_rows, new_rows = changed_rows(list(item.getMetaData().items()), list(metadata.items()))
+        self.undo_stack.record({"op": "metadataRows", "item": item, "row": row, "count": len(new_rows), "value": old_rows},
+                               {"op": "metadataRows", "item": item, "row": row, "count": len(old_rows), "value": new_rows})
+        self.change_tracker.record_modified(item)
+        self.search_index.remove_fields(item)
+        item.setMetaData(metadata)
+        item.setValueChanged(True)
+        self.search_index.add_fields(item)
+        self._emit_edit({"op": "metadata", "path": self.item_path(item), "value": metadata})
+
+    def set_metadata_key(self, item, key, value, row=None):
+        """
+        Sets the value of one key in place, only that key is reindexed, recorded
+        and journaled. An existing key keeps its place, a new one goes to row or
+        the end.
+        """
+        metadata = item.getMetaData()
+        undo = {"op": "metadataKey", "item": item, "key": key}
+        if key in metadata:
+            undo["value"] = metadata[key]
+        self.undo_stack.record(undo, {"op": "metadataKey", "item": item, "key": key, "value": value})
+        self.change_tracker.record_modified(item)
+        self.search_index.set_metadata_value(item, self.change_tracker.own_metadata(item), key, value, row)
+        item.invalidateHash()
+        item.setValueChanged(True)
+        edit = {"op": "metadataKey", "path": self.item_path(item), "key": key, "value": value}
+        if row is not None:
+            edit["row"] = row
+        self._emit_edit(edit)
+
+    def remove_metadata_key(self, item, key):
+        metadata = item.getMetaData()
+        row = list(metadata).index(key)
+        self.undo_stack.record({"op": "metadataKey", "item": item, "key": key, "value": metadata[key], "row": row},
+                               {"op": "metadataKey", "item": item, "key": key})
+        self.change_tracker.record_modified(item)
+        self.search_index.remove_metadata_value(item, self.change_tracker.own_metadata(item), key)
+        item.invalidateHash()
+        item.setValueChanged(True)
+        self._emit_edit({"op": "metadataKey", "path": self.item_path(item), "key": key})
+
+    def set_data_type(self, item, value):
+        self.undo_stack.record({"op": "dataType", "item": item, "value": item.getDataType()},
+                               {"op": "dataType", "item": item, "value": value})
+        self.change_tracker.record_modified(item)
+        item.setDataType(value)
+        item.setValueChanged(True)
+        self._emit_edit({"op": "dataType", "path": self.item_path(item), "value": value})
+
+    def revert_change(self, kind, item):
+        """
+        Undoes one entry of the change journal, returns False when it cannot be
+        reverted on its own (its original parent is gone, or it holds moved items)
+        """
+        tracker = self.change_tracker
+        if kind == ChangeTracker.MODIFIED and item in tracker.modified:
+            self._set_fields(item, tracker.modified[item], item in tracker.moved)
+            tracker.record_restored(kind, item)
+            return True
+        if kind == ChangeTracker.ADDED and item in tracker.added:
+            stack = list(item.childItems)
+            while stack:
+                child = stack.pop()
+                if child in tracker.moved:
+                    return False
+                stack.extend(child.childItems)
+            self.removeRow(item.childNumber(), self.index_of(item.parent()))
+            return True
+        if kind == ChangeTracker.REMOVED and item in tracker.removed:
+            parent, row = tracker.removed[item]
+            if not tracker.is_attached(parent):
+                return False
+            row = min(row, parent.childCount())
+            self.beginInsertRows(self.index_of(parent), row, row)
+            parent.insertChild(row, item)
+            item.parentItem = parent
+            self.search_index.add_subtree(item)
+            self.endInsertRows()
+            tracker.record_restored(kind, item)
+            self.undo_stack.record({"op": "remove", "parent": parent, "row": row, "count": 1},
+                                   {"op": "insert", "parent": parent, "row": row, "items": [item]})
+            self._emit_edit({"op": "add", "parent": self.item_path(parent), "row": row,
+                              "item": item, "newAdded": False})
+            return True
+        if kind == ChangeTracker.MOVED and item in tracker.moved:
+            parent, row = tracker.moved[item]
+            if not tracker.is_attached(parent) or self._has_ancestor_in(parent, {item}):
+                return False
+            self.move_rows([self.index_of(item)], self.index_of(parent), min(row, parent.childCount()), record=False)
+            tracker.record_restored(kind, item)
+            item.setValueChanged(item in tracker.modified)
+            index = self.index_of(item)
+            self.dataChanged.emit(index, index)
+            return True
+        return False
+
+    def _set_fields(self, item, fields, value_changed):
+        title, var_id, data_type, sources, metadata = fields
+        old_title = item.data()
+        self.undo_stack.record({"op": "fields", "item": item, "value": self._fields_of(item),
+                                "valueChanged": item.valueChanged},
+                               {"op": "fields", "item": item, "value": tuple(fields), "valueChanged": value_changed})
+        self.search_index.remove_fields(item)
+        item.setData(title)
+        item.setVarId(var_id)
+        item.setDataType(data_type)
+        item.setSources(sources)
+        item.setMetaData(metadata)
+        item.setValueChanged(value_changed)
+        self.search_index.rename(item, old_title)
+        self.search_index.add_fields(item)
+        index = self.index_of(item)
+        self.dataChanged.emit(index, index)
+        self._emit_edit({"op": "fields", "path": self.item_path(item), "value": list(fields),
+                          "valueChanged": value_changed})
+
+    def item_path(self, item):
+        """Row numbers from the root down to item"""
+        path = []
+        while item is not None and item is not self.root_item:
+            path.append(item.childNumber())
+            item = item.parent()
+        path.reverse()
+        return path
+
+    def item_at_path(self, path):
+        item = self.root_item
+        for row in path:
+            index = self.index_of(item)
+            if self.canFetchMore(index):
+                self.fetchMore(index)
+            item = item.child(row)
+        return item
+
+    def item_at_title_path(self, path):
+        """The first item at a fullPath style path, None if there is none"""
+        titles = [title for title in path.split('/') if title]
+        if not titles:
+            return self.root_item
+        path = '/' + '/'.join(titles)
+        # the title index gives the candidates, their cached paths decide
+        items = [item for item in self.search_index.items_with_title(titles[-1])
+                 if item.fullPath() == path and self.change_tracker.is_attached(item)]
+        if items:
+            return min(items, key=self.item_path)
+        if not self.lazy:
+            return None
+        # the item may still be a raw dict, expand along the path
+        item = self.root_item
+        for title in titles:
+            index = self.index_of(item)
+            if self.canFetchMore(index):
+                self.fetchMore(index)
+            item = next((child for child in item.childItems if child.data() == title), None)
+            if item is None:
+                return None
+        return item
+
+    def apply_edit(self, edit):
+        """Replays an operation emitted by edited, used to recover the edit journal"""
+        op = edit["op"]
+        if op == "batch":
+            self.begin_batch()
+            try:
+                return all([self.apply_edit(sub_edit) for sub_edit in edit["edits"]])
+            finally:
+                self.end_batch()
+        if op == "add":
+            parent = self.item_at_path(edit["parent"])
+            element = edit["item"]
+            if isinstance(element, TreeItem):
+                element = element.create_new_item()
+            holder = TreeItem(None)
+            holder.createChildren([element])
+            item = holder.child(0)
+            if edit["newAdded"]:
+                stack = [item]
+                while stack:
+                    current = stack.pop()
+                    current.setNewAdded(True)
+                    stack.extend(current.childItems)
+            parent.insertChild(edit["row"], item)
+            item.parentItem = parent
+            return self.insertRow(edit["row"], self.index_of(parent))
+        if op == "remove":
+            return self.removeRows(edit["row"], edit.get("count", 1), self.index_of(self.item_at_path(edit["parent"])))
+        item = self.item_at_path(edit["path"])
+        if op == "move":
+            self.move_rows([self.index_of(item)], self.index_of(self.item_at_path(edit["parent"])), edit["row"])
+        elif op == "rename":
+            self.setData(self.index_of(item), edit["value"])
+        elif op == "varId":
+            self.set_var_id(item, edit["value"])
+        elif op == "sources":
+            self.set_sources(item, edit["value"])
+        elif op == "metadata":
+            self.set_metadata(item, edit["value"])
+        elif op == "metadataKey":
+            if "value" in edit:
+                self.set_metadata_key(item, edit["key"], edit["value"], edit.get("row"))
+            else:
+                self.remove_metadata_key(item, edit["key"])
+        elif op == "dataType":
+            self.set_data_type(item, edit["value"])
+        elif op == "fields":
+            self.change_tracker.record_modified(item)
+            self._set_fields(item, edit["value"], edit["valueChanged"])
+        return True
+
+    def undo(self):
+        """Reverts the last action, returns the item it ended on or None"""
+        if not self.undo_stack.can_undo():
+            return None
+        return self._apply_steps(self.undo_stack.take_undo())
+
+    def redo(self):
+        if not self.undo_stack.can_redo():
+            return None
+        return self._apply_steps(self.undo_stack.take_redo())
+
+    def _apply_steps(self, steps):
+        # journaled as one batch like any other edit, but not recorded again
+        changed = []
+        self.undo_stack.paused = True
+        self.begin_batch()
+        try:
+            for step in steps:
+                item = self._apply_step(step)
+                if "item" in step and step["op"] != "move":
+                    changed.append(item)
+        finally:
+            self.end_batch()
+            self.undo_stack.paused = False
+        self.items_changed([item for item in changed if self.change_tracker.is_attached(item)])
+        return item
+
+    def _apply_step(self, step):
+        op = step["op"]
+        if op == "insert":
+            self.insert_items(step["parent"], step["row"], step["items"])
+            return step["items"][-1]
+        if op == "remove":
+            self.removeRows(step["row"], step["count"], self.index_of(step["parent"]))
+            return None if step["parent"] is self.root_item else step["parent"]
+        if op == "moveItems":
+            self.move_items(step["items"], step["folder"])
+            return step["items"][-1]
+        if op == "return":
+            self.return_items(step["items"], step["origins"])
+            return step["items"][-1]
+        item = step["item"]
+        tracker = self.change_tracker
+        if op == "move":
+            parent, row = step["parent"], step["row"]
+            # move_rows counts the target row before the item leaves its parent
+            if item.parent() is parent and row > item.childNumber():
+                row += 1
+            self.move_rows([self.index_of(item)], self.index_of(parent), row)
+            if tracker.moved.get(item) == (item.parent(), item.childNumber()):
+                tracker.record_restored(ChangeTracker.MOVED, item)
+                item.setValueChanged(item in tracker.modified)
+            return item
+        if op == "rename":
+            self.setData(self.index_of(item), step["value"])
+        elif op == "varId":
+            self.set_var_id(item, step["value"])
+        elif op == "sourceRows":
+            sources = list(item.getSources())
+            sources[step["row"]:step["row"] + step["count"]] = step["value"]
+            self.set_sources(item, sources)
+        elif op == "metadataRows":
+            rows = list(item.getMetaData().items())
+            rows[step["row"]:step["row"] + step["count"]] = step["value"]
+            self.set_metadata(item, dict(rows))
+        elif op == "metadataKey":
+            if "value" in step:
+                self.set_metadata_key(item, step["key"], step["value"], step.get("row"))
+            else:
+                self.remove_metadata_key(item, step["key"])
+        elif op == "dataType":
+            self.set_data_type(item, step["value"])
+        elif op == "fields":
+            tracker.record_modified(item)
+            self._set_fields(item, step["value"], step["valueChanged"])
+        # back to the loaded values, the item no longer shows as changed
+        if tracker.modified.get(item) == self._fields_of(item):
+            tracker.record_restored(ChangeTracker.MODIFIED, item)
+            item.setValueChanged(item in tracker.moved)
+        return item
+
+    def _fields_of(self, item):
+        return item.data(), item.getVarId(), item.getDataType(), item.getSources(), item.getMetaData()
+
+    def snapshot(self):
+        """Cheap save snapshot, see ChangeTracker.snapshot"""
+        return self.change_tracker.snapshot()
+
+    def store_snapshot(self):
+        """Save snapshot for a tree store, only the changed rows are written"""
+        self.change_tracker.release_metadata()
+        return self.change_tracker.version, list(self.root_item.childItems), StoreChanges(self.root_item, self.change_tracker)
+
+    def saved(self, version, children, texts):
+        """Called once a snapshot was written, clears the change flags saved with it"""
+        self.change_tracker.store_fragments(version, children, texts)
+        for item in self.change_tracker.mark_saved(version):
+            if self.change_tracker.is_attached(item):
+                index = self.index_of(item)
+                self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole, QtCore.Qt.ForegroundRole])
+
+    def index_of(self, item):
+        if item is None or item is self.root_item:
+            return QtCore.QModelIndex()
+        return self.createIndex(item.childNumber(), 0, item)
 
     def get_item(self, index):
         if index.isValid():
@@ -60,6 +729,27 @@ class TreeModel(QtCore.QAbstractItemModel):
     def rowCount(self, parent):
         return self.get_item(parent).childCount()
 
+    # inherited Method
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        item = self.get_item(parent)
+        return item.childCount() > 0 or item.hasPendingChildren()
+
+    # inherited Method
+    def canFetchMore(self, parent):
+        return self.get_item(parent).hasPendingChildren()
+
+    # inherited Method
+    def fetchMore(self, parent):
+        item = self.get_item(parent)
+        children = [data for data in item.takePendingChildren() if len(data)]
+        if not children:
+            return
+        first = item.childCount()
+        self.beginInsertRows(parent, first, first + len(children) - 1)
+        item.createChildren(children, lazy=True)
+        self.search_index.add_expanded(item, item.childItems[first:])
+        self.endInsertRows()
+
     # inherited Method
     def columnCount(self, index):
         return 1
@@ -83,11 +773,11 @@ class TreeModel(QtCore.QAbstractItemModel):
                     return None
             elif role == QtCore.Qt.DecorationRole:
                 if item.newAdded:
-                    return qta.icon(TypeManager.type_icon_dictionary[item.getDataType()], options=[{'color': 'green'}])
+                    return TypeManager.get_type_icon(item.getDataType(), 'green')
                 elif item.valueChanged:
-                    return qta.icon(TypeManager.type_icon_dictionary[item.getDataType()], options=[{'color': 'blue'}])
+                    return TypeManager.get_type_icon(item.getDataType(), 'blue')
                 else:
-                    return qta.icon(TypeManager.type_icon_dictionary[item.getDataType()], options=[{'color': 'black'}])
+                    return TypeManager.get_type_icon(item.getDataType(), 'black')
             elif role == QtCore.Qt.DisplayRole:
                 return item.data()
             else:
@@ -104,21 +794,60 @@ class TreeModel(QtCore.QAbstractItemModel):
         if value == "":
             return False
         item = self.get_item(index)
+        old_value = item.data()
+        self.undo_stack.record({"op": "rename", "item": item, "value": old_value},
+                               {"op": "rename", "item": item, "value": value})
+        self.change_tracker.record_modified(item)
         item.setData(value)
+        item.setValueChanged(True)
+        self.search_index.rename(item, old_value)
         self.dataChanged.emit(index, index)
+        self._emit_edit({"op": "rename", "path": self.item_path(item), "value": value})
         return True
 
     # inherited Method
     def insertRow(self, row, parent=QtCore.QModelIndex()):
-        self.beginInsertRows(parent, row, row)
+        return self.insertRows(row, 1, parent)
+
+    # inherited Method
+    def insertRows(self, row, count, parent=QtCore.QModelIndex()):
+        """The items must already be in the parent item at row .. row + count - 1"""
+        parent_item = self.get_item(parent)
+        if count <= 0 or row < 0 or row + count > parent_item.childCount():
+            return False
+        items = parent_item.childItems[row:row + count]
+        self.beginInsertRows(parent, row, row + count - 1)
+        for offset, item in enumerate(items):
+            self.search_index.add_subtree(item)
+            self.change_tracker.record_inserted(item, parent_item, row + offset)
         self.endInsertRows()
+        self.undo_stack.record({"op": "remove", "parent": parent_item, "row": row, "count": count},
+                               {"op": "insert", "parent": parent_item, "row": row, "items": items})
+        path = self.item_path(parent_item)
+        for offset, item in enumerate(items):
+            self._emit_edit({"op": "add", "parent": path, "row": row + offset,
+                              "item": item, "newAdded": item.newAdded})
         return True
 
     # inherited Method
     def removeRow(self, row, parent=QtCore.QModelIndex()):
-        self.beginRemoveRows(parent, row, row)
-        self.get_item(parent).removeChildren(row, 1)
+        return self.removeRows(row, 1, parent)
+
+    # inherited Method
+    def removeRows(self, row, count, parent=QtCore.QModelIndex()):
+        parent_item = self.get_item(parent)
+        if count <= 0 or row < 0 or row + count > parent_item.childCount():
+            return False
+        items = parent_item.childItems[row:row + count]
+        self.beginRemoveRows(parent, row, row + count - 1)
+        for offset, item in enumerate(items):
+            self.search_index.remove_subtree(item)
+            self.change_tracker.record_removed(item, parent_item, row + offset)
+        parent_item.removeChildren(row, count)
         self.endRemoveRows()
+        self.undo_stack.record({"op": "insert", "parent": parent_item, "row": row, "items": items},
+                               {"op": "remove", "parent": parent_item, "row": row, "count": count})
+        self._emit_edit({"op": "remove", "parent": self.item_path(parent_item), "row": row, "count": count})
         return True
 
     # inherited Method
@@ -141,7 +870,7 @@ class TreeModel(QtCore.QAbstractItemModel):
 
     # inherited Method
     def mimeData(self, indexes):
-        self.drag_item_index = indexes[0]
+        self.drag_indexes = [QtCore.QPersistentModelIndex(index) for index in indexes if index.isValid()]
         mimedata = QtCore.QMimeData()
         mimedata.setData('text/xml', bytes('mimeData', encoding='ascii'))
         return mimedata
@@ -151,20 +880,75 @@ class TreeModel(QtCore.QAbstractItemModel):
         try:
             if action != QtCore.Qt.MoveAction:
                 return False
-            target_parent_item = self.get_item(parent)
-            source_item = self.get_item(self.drag_item_index)
-            source_parent_idx = self.drag_item_index.parent()
-            num = source_item.childNumber()
-            new_item = source_item.create_duplicate(target_parent_item)
-            self.removeRow(num, source_parent_idx)
-            if row == -1:
-                target_parent_item.appendChild(new_item)
-                row = target_parent_item.childCount() - 1
-            else:
-                target_parent_item.insertChild(row, new_item)
-            self.insertRow(row, parent)
-            self.rowMoved.emit(self.index(row, 0, parent))
-            return True
+            indexes = [QtCore.QModelIndex(index) for index in self.drag_indexes if index.isValid()]
+            last_index = self.move_rows(indexes, parent, row)
+            if last_index is None:
+                return False
+            self.rowMoved.emit(last_index)
+            # the rows are re-linked already, an accepted MoveAction would make
+            # the dragging view remove the source rows again (QAbstractItemView::startDrag)
+            return False
         except Exception as e:
             print("dropMineData failed: {}".format(e))
             print(traceback.format_exc())
+
+    def move_rows(self, indexes, parent, row=-1, record=True):
+        """
+        Re-links the items at indexes under parent starting at row (-1 appends).
+        Items keep their identity, only the parent/row links change.
+        Returns the index of the last moved item or None if nothing could be moved.
+        """
+        if self.canFetchMore(parent):
+            self.fetchMore(parent)
+        target_parent_item = self.get_item(parent)
+        items = [self.get_item(index) for index in indexes]
+        moving = set(items)
+        # a folder cannot be dropped into itself or one of its descendants
+        ancestor = target_parent_item
+        while ancestor is not None:
+            if ancestor in moving:
+                return None
+            ancestor = ancestor.parent()
+        # children of moved items travel with their parent
+        items = [item for item in items if not self._has_ancestor_in(item, moving)]
+        if not items:
+            return None
+        target = QtCore.QPersistentModelIndex(parent)
+        if row == -1:
+            row = target_parent_item.childCount()
+        for item in items:
+            target_index = QtCore.QModelIndex(target)
+            source_parent_item = item.parent()
+            source_row = item.childNumber()
+            source_parent_idx = self.parent(self.createIndex(source_row, 0, item))
+            if source_parent_item is target_parent_item and row in (source_row, source_row + 1):
+                # already in place, Qt refuses no-op moves
+                row = source_row + 1
+                continue
+            edit = {"op": "move", "path": self.item_path(item), "parent": self.item_path(target_parent_item),
+                    "row": row}
+            if record:
+                self.change_tracker.record_moved(item, source_parent_item, source_row)
+                item.setValueChanged(True)
+            self.beginMoveRows(source_parent_idx, source_row, source_row, target_index, row)
+            source_parent_item.removeChildren(source_row, 1)
+            if source_parent_item is target_parent_item and source_row < row:
+                row -= 1
+            target_parent_item.insertChild(row, item)
+            item.parentItem = target_parent_item
+            self.change_tracker.mark_dirty(item)
+            self.endMoveRows()
+            self.undo_stack.record({"op": "move", "item": item, "parent": source_parent_item, "row": source_row},
+                                   {"op": "move", "item": item, "parent": target_parent_item, "row": row})
+            self._emit_edit(edit)
+            row += 1
+        last_item = items[-1]
+        return self.createIndex(last_item.childNumber(), 0, last_item)
+
+    def _has_ancestor_in(self, item, items):
+        ancestor = item.parent()
+        while ancestor is not None:
+            if ancestor in items:
+                return True
+            ancestor = ancestor.parent()
+        return False
@@ -0,0 +1,481 @@
+"""
+SQLite tree store (.sqlite / .db)
+
+Nodes, sources and metadata live in their own tables, indexed by parent,
+varId and title. The lazy TreeModel reads children on demand through
+StoreChildren; nodes read from the store are StoreNode dicts that carry their
+row id as an attribute, so TreeItem can remember it without the id ever
+ending up in json. Searches and varId lookups find the matching rows with
+SQL and only the subtrees on the way to them are read. A save writes only the rows the ChangeTracker knows about,
+in one transaction on its own connection.
+
+Keys TreeItem does not know and values a column cannot hold exactly (bools,
+lists, objects) are kept in the extra json column, sources and metadata
+values are stored as json, so json -> store -> json is lossless.
+
+Convert with: python -m model.tree_store input.json output.sqlite (or back)
+
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import threading
+import collections.abc
+
+from model.tree_file import json_default
+
+EXTENSIONS = (".sqlite", ".db")
+# bits of nodes.fields, set when the key is present
+FIELD_BITS = (("title", 1), ("varId", 2), ("dataType", 4), ("sources", 8), ("metadata", 16))
+FIELDS = dict(FIELD_BITS)
+COLUMNS = ("title", "varId", "dataType")
+# parameters per IN (...) query, below the SQLite limit
+CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    position INTEGER NOT NULL,
+    -- no declared type, numbers stay numbers
+    title,
+    varId,
+    dataType,
+    fields INTEGER NOT NULL,
+    has_children INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes(parent, position);
+CREATE INDEX IF NOT EXISTS nodes_var_id ON nodes(varId);
+CREATE INDEX IF NOT EXISTS nodes_title ON nodes(title);
+CREATE TABLE IF NOT EXISTS sources (node INTEGER NOT NULL, position INTEGER NOT NULL, source TEXT);
+CREATE INDEX IF NOT EXISTS sources_node ON sources(node, position);
+CREATE TABLE IF NOT EXISTS metadata (node INTEGER NOT NULL, position INTEGER NOT NULL, key TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS metadata_node ON metadata(node, position);
+"""
+
+
+def is_store_file(file_path):
+    return file_path.lower().endswith(EXTENSIONS)
+
+
+def connect(file_path):
+    connection = sqlite3.connect(file_path, check_same_thread=False)
+    # readers of the GUI thread are not blocked while a save writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.create_function("search_text", 2, _search_text, deterministic=True)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _is_column_value(value):
+    return value is None or (isinstance(value, (str, int, float)) and not isinstance(value, bool))
+
+
+def _search_text(value, is_json):
+    """The lower case text SearchIndex compares, of a column or of a json column"""
+    if value is None:
+        return ""
+    if is_json:
+        value = json.loads(value)
+    return value.lower() if isinstance(value, str) else str(value).lower()
+
+
+def _contains(column, value, is_json=False):
+    # LIKE ignores the case of ASCII letters only, other text is lowered in python
+    if value.isascii():
+        return "{} LIKE ? ESCAPE '\\'".format(column)
+    return "instr(search_text({}, {}), ?) > 0".format(column, int(is_json))
+
+
+def _pattern(value, is_json=False):
+    if not value.isascii():
+        return value
+    if is_json:
+        # the text as json.dumps writes it inside a string
+        value = json.dumps(value)[1:-1]
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _chunks(values):
+    for start in range(0, len(values), CHUNK):
+        yield values[start:start + CHUNK]
+
+
+class StoreNode(dict):
+    """A node dict read from the store, storeId is not a key so json never sees it"""
+    __slots__ = ("storeId",)
+
+
+class TreeStore(object):
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.connection = connect(file_path)
+        # the loader thread and the GUI thread share the connection
+        self.lock = threading.Lock()
+
+    def child_ids(self, parent_id):
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT id FROM nodes WHERE parent IS ? ORDER BY position", (parent_id,))]
+
+    def nodes(self, ids):
+        """Returns the StoreNodes of ids in the same order, their children stay in the store"""
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        with self.lock:
+            rows = {row[0]: row for row in self.connection.execute(
+                "SELECT id, title, varId, dataType, fields, has_children, extra FROM nodes WHERE id IN ({})".format(marks), ids)}
+            sources = collections.defaultdict(list)
+            for node_id, source in self.connection.execute(
+                    "SELECT node, source FROM sources WHERE node IN ({}) ORDER BY node, position".format(marks), ids):
+                sources[node_id].append(json.loads(source))
+            metadata = collections.defaultdict(dict)
+            for node_id, key, value in self.connection.execute(
+                    "SELECT node, key, value FROM metadata WHERE node IN ({}) ORDER BY node, position".format(marks), ids):
+                metadata[node_id][key] = json.loads(value)
+            counts = dict(self.connection.execute(
+                "SELECT parent, count(*) FROM nodes WHERE parent IN ({}) GROUP BY parent".format(marks), ids))
+        result = []
+        for node_id in ids:
+            node_id, title, var_id, data_type, fields, has_children, extra = rows[node_id]
+            data = StoreNode()
+            data.storeId = node_id
+            values = {"title": title, "varId": var_id, "dataType": data_type,
+                      "sources": sources.get(node_id, []), "metadata": metadata.get(node_id, {})}
+            for key, bit in FIELD_BITS:
+                if fields & bit:
+                    data[key] = values[key]
+            if extra:
+                data.update(json.loads(extra))
+            if has_children:
+                data["children"] = StoreChildren(self, node_id, counts.get(node_id, 0))
+            result.append(data)
+        return result
+
+    def children(self):
+        return StoreChildren(self, None, len(self.child_ids(None)))
+
+    def var_id_ids(self, var_id):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT id FROM nodes WHERE varId=?", (var_id,))]
+
+    def match_ids(self, field, value):
+        """
+        Ids of the nodes that may match a SearchIndex query on field (None for
+        titles), value is lower case; the caller checks the nodes it gets
+        """
+        if field == "varId":
+            query, params = "SELECT id FROM nodes WHERE {} OR extra LIKE '%\"varId\"%'".format(
+                _contains("varId", value)), (_pattern(value),)
+        elif field == "source":
+            query, params = "SELECT DISTINCT node FROM sources WHERE {}".format(
+                _contains("source", value, True)), (_pattern(value, True),)
+        elif field == "meta":
+            key, sep, text = value.partition("=")
+            if sep:
+                key_test = "lower(key)=?" if key.isascii() else "search_text(key, 0)=?"
+                query = "SELECT DISTINCT node FROM metadata WHERE {} AND {}".format(
+                    key_test, _contains("value", text.strip(), True))
+                params = (key.strip(), _pattern(text.strip(), True))
+            else:
+                query = "SELECT DISTINCT node FROM metadata WHERE {} OR {}".format(
+                    _contains("key", value), _contains("value", value, True))
+                params = (_pattern(value), _pattern(value, True))
+        else:
+            query, params = "SELECT id FROM nodes WHERE {} OR extra LIKE '%\"title\"%'".format(
+                _contains("title", value)), (_pattern(value),)
+        with self.lock:
+            return [row[0] for row in self.connection.execute(query, params)]
+
+    def matching_ids(self, node_ids, matches):
+        """The ids among node_ids whose node dict matches accepts, only these nodes are read"""
+        result = set()
+        for chunk in _chunks(list(node_ids)):
+            result.update(data.storeId for data in self.nodes(chunk) if matches(data))
+        return result
+
+    def chains_below(self, node_ids, parent_ids):
+        """
+        [parent id, ..., node id] for each of node_ids that lies below one of
+        parent_ids, the ids of the nodes on the way down to it
+        """
+        chains = []
+        for chunk in _chunks(list(node_ids)):
+            ancestors = collections.defaultdict(list)
+            with self.lock:
+                rows = self.connection.execute(
+                    "WITH RECURSIVE up(node, id, depth) AS ("
+                    "SELECT id, parent, 1 FROM nodes WHERE id IN ({}) "
+                    "UNION ALL SELECT up.node, nodes.parent, up.depth + 1 FROM nodes JOIN up ON nodes.id = up.id) "
+                    "SELECT node, id FROM up WHERE id IS NOT NULL ORDER BY node, depth".format(
+                        ",".join("?" * len(chunk))), chunk).fetchall()
+            for node_id, ancestor_id in rows:
+                ancestors[node_id].append(ancestor_id)
+            for node_id in chunk:
+                path = [node_id]
+                for ancestor_id in ancestors.get(node_id, ()):
+                    path.append(ancestor_id)
+                    if ancestor_id in parent_ids:
+                        path.reverse()
+                        chains.append(path)
+                        break
+        return chains
+
+    def iter_elements(self):
+        """Yields (element, percent) like JsonFileManager._stream_array"""
+        ids = self.child_ids(None)
+        count = max(len(ids), 1)
+        done = 0
+        for chunk in _chunks(ids):
+            done += len(chunk)
+            for data in self.nodes(chunk):
+                yield data, done * 100 // count
+
+
+class StoreChildren(collections.abc.Sequence):
+    """Lazy sequence of the child dicts of one stored node, read on access"""
+    __slots__ = ("store", "parent_id", "count", "ids")
+
+    def __init__(self, store, parent_id, count):
+        self.store = store
+        self.parent_id = parent_id
+        self.count = count
+        self.ids = None
+
+    def __len__(self):
+        return self.count
+
+    def child_ids(self):
+        # the rows of an unexpanded node do not change until it is expanded, one query is enough
+        if self.ids is None:
+            self.ids = self.store.child_ids(self.parent_id)
+        return self.ids
+
+    def __getitem__(self, row):
+        return self.store.nodes([self.child_ids()[row]])[0]
+
+    def __iter__(self):
+        for chunk in _chunks(self.child_ids()):
+            yield from self.store.nodes(chunk)
+
+
+def item_fields(item):
+    """The fields of a TreeItem the way create_new_item writes them, without children"""
+    data = {"title": item.data(), "varId": item.getVarId(), "dataType": item.getDataType()}
+    if len(item.getSources()):
+        data["sources"] = list(item.getSources())
+    if len(item.getMetaData()):
+        data["metadata"] = dict(item.getMetaData())
+    return data
+
+
+def _row(data, extra):
+    """(title, varId, dataType, fields, extra) of data, extra are the unknown keys to keep"""
+    extra = dict(extra)
+    fields = 0
+    columns = {}
+    for key, bit in FIELD_BITS:
+        if key not in data:
+            continue
+        fields |= bit
+        if key in COLUMNS and _is_column_value(data[key]):
+            columns[key] = data[key]
+        elif key in COLUMNS or not isinstance(data[key], list if key == "sources" else dict):
+            # read back over the column or table value
+            extra[key] = data[key]
+    return (columns.get("title"), columns.get("varId"), columns.get("dataType"), fields,
+            json.dumps(extra) if extra else None)
+
+
+def _insert_values(cursor, node_id, data):
+    sources = data.get("sources") if isinstance(data.get("sources"), list) else []
+    if sources:
+        cursor.executemany("INSERT INTO sources (node, position, source) VALUES (?, ?, ?)",
+                           [(node_id, position, json.dumps(source)) for position, source in enumerate(sources)])
+    metadata = data.get("metadata") if isinstance(data.get("metadata"), dict) else {}
+    if metadata:
+        cursor.executemany("INSERT INTO metadata (node, position, key, value) VALUES (?, ?, ?, ?)",
+                           [(node_id, position, key, json.dumps(value))
+                            for position, (key, value) in enumerate(metadata.items())])
+
+
+def update_fields(cursor, node_id, data):
+    """Rewrites the fields of a stored node, its unknown keys are kept"""
+    extra = cursor.execute("SELECT extra FROM nodes WHERE id=?", (node_id,)).fetchone()
+    unknown = json.loads(extra[0]) if extra and extra[0] else {}
+    row = _row(data, {key: value for key, value in unknown.items() if key not in FIELDS})
+    cursor.execute("UPDATE nodes SET title=?, varId=?, dataType=?, fields=?, extra=? WHERE id=?", row + (node_id,))
+    cursor.execute("DELETE FROM sources WHERE node=?", (node_id,))
+    cursor.execute("DELETE FROM metadata WHERE node=?", (node_id,))
+    _insert_values(cursor, node_id, data)
+
+
+def insert_subtree(cursor, data, parent_id, position, ids=None):
+    """Inserts data and its children, appends the new row ids to ids in depth-first order"""
+    stack = [(data, parent_id, position)]
+    while stack:
+        data, parent_id, position = stack.pop()
+        children = data.get("children")
+        row = _row(data, {key: value for key, value in data.items() if key != "children" and key not in FIELDS})
+        cursor.execute("INSERT INTO nodes (parent, position, title, varId, dataType, fields, extra, has_children) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (parent_id, position) + row + (int(children is not None),))
+        node_id = cursor.lastrowid
+        if ids is not None:
+            ids.append(node_id)
+        _insert_values(cursor, node_id, data)
+        if children:
+            # reversed so the stack pops them in order
+            stack.extend((child, node_id, row) for row, child in reversed(list(enumerate(children))))
+
+
+def delete_subtree(cursor, node_id):
+    ids = [row[0] for row in cursor.execute(
+        "WITH RECURSIVE sub(id) AS (SELECT ? UNION ALL SELECT nodes.id FROM nodes JOIN sub ON nodes.parent = sub.id) "
+        "SELECT id FROM sub", (node_id,))]
+    for chunk in _chunks(ids):
+        marks = ",".join("?" * len(chunk))
+        for table, column in (("sources", "node"), ("metadata", "node"), ("nodes", "id")):
+            cursor.execute("DELETE FROM {} WHERE {} IN ({})".format(table, column, marks), chunk)
+
+
+class StoreChanges(object):
+    """
+    The rows a save has to write, collected from the ChangeTracker on the GUI
+    thread so the tree can keep changing while the worker writes them
+    """
+
+    def __init__(self, root_item, tracker):
+        self.updates = []
+        self.inserts = []
+        self.positions = []
+        self.deletes = []
+        # TreeItems of the inserted subtrees in depth-first order, they get the new ids
+        self.inserted_items = []
+        self.new_ids = []
+        # an added item inside another added subtree is written with that subtree
+        added = [item for item in tracker.added if tracker.is_attached(item) and not tracker.is_added(item.parent())]
+        for item, pristine in tracker.modified.items():
+            if item.storeId is not None and tracker.is_attached(item) and not tracker.is_added(item):
+                self.updates.append((item.storeId, item_fields(item)))
+        parents = set(item.parent() for item in added)
+        for item in added:
+            if item.parent() is root_item:
+                parent_id = None
+            elif item.parent().storeId is not None:
+                parent_id = item.parent().storeId
+            else:
+                continue
+            self.inserts.append((item.create_new_item(), parent_id, item.childNumber()))
+            # same depth-first order as insert_subtree, raw pending dicts get no item
+            stack = [item]
+            while stack:
+                current = stack.pop()
+                if isinstance(current, dict):
+                    self.inserted_items.append(None)
+                    stack.extend(reversed(list(current.get("children") or [])))
+                else:
+                    self.inserted_items.append(current)
+                    stack.extend(reversed(list(current.childItems) + list(current.pendingChildren or [])))
+                    if current.storeId is not None:
+                        # a stored item moved into the new subtree, its old rows go after the insert
+                        self.deletes.append(current.storeId)
+        for item, (parent, row) in tracker.moved.items():
+            parents.add(parent)
+            parents.add(item.parent())
+        for item, (parent, row) in tracker.removed.items():
+            parents.add(parent)
+            if item.storeId is not None:
+                self.deletes.append(item.storeId)
+        for parent in parents:
+            if parent is None or not tracker.is_attached(parent) or tracker.is_added(parent):
+                continue
+            if parent is not root_item and parent.storeId is None:
+                continue
+            parent_id = parent.storeId if parent is not root_item else None
+            rows = [(parent_id, row, child.storeId) for row, child in enumerate(parent.childItems)
+                    if child.storeId is not None]
+            self.positions.append((parent_id, parent.childCount(), rows))
+
+    def write(self, file_path, progress=None):
+        """Writes all rows in one transaction on a connection of the calling thread"""
+        connection = connect(file_path)
+        try:
+            steps = max(len(self.updates) + len(self.inserts) + len(self.positions) + len(self.deletes), 1)
+            done = 0
+            with connection:
+                cursor = connection.cursor()
+                for node_id, data in self.updates:
+                    update_fields(cursor, node_id, data)
+                    done += 1
+                    if progress is not None:
+                        progress(done * 100 // steps)
+                for data, parent_id, position in self.inserts:
+                    insert_subtree(cursor, data, parent_id, position, self.new_ids)
+                    done += 1
+                    if progress is not None:
+                        progress(done * 100 // steps)
+                for parent_id, count, rows in self.positions:
+                    cursor.executemany("UPDATE nodes SET parent=?, position=? WHERE id=?", rows)
+                    if parent_id is not None and count:
+                        cursor.execute("UPDATE nodes SET has_children=1 WHERE id=?", (parent_id,))
+                    done += 1
+                    if progress is not None:
+                        progress(done * 100 // steps)
+                for node_id in self.deletes:
+                    delete_subtree(cursor, node_id)
+                    done += 1
+                    if progress is not None:
+                        progress(done * 100 // steps)
+        finally:
+            connection.close()
+
+    def bind_ids(self):
+        """Gives the inserted items their new row ids, called on the GUI thread after the save"""
+        for item, node_id in zip(self.inserted_items, self.new_ids):
+            if item is not None:
+                item.storeId = node_id
+                if isinstance(item.pendingChildren, StoreChildren):
+                    # the old rows are deleted, the children are read below the new one
+                    item.pendingChildren = StoreChildren(item.pendingChildren.store, node_id,
+                                                         len(item.pendingChildren))
+
+
+def json_to_store(json_path, store_path):
+    with open(json_path) as file:
+        elements = json.load(file)
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    connection = connect(store_path)
+    try:
+        with connection:
+            cursor = connection.cursor()
+            for position, data in enumerate(elements):
+                insert_subtree(cursor, data, None, position)
+    finally:
+        connection.close()
+
+
+def store_to_json(store_path, json_path):
+    store = TreeStore(store_path)
+    with open(json_path, 'w') as file:
+        file.write('[')
+        for i, data in enumerate(store.children()):
+            if i:
+                file.write(', ')
+            file.write(json.dumps(data, default=json_default))
+        file.write(']')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: python -m model.tree_store input.json output.sqlite | input.sqlite output.json")
+        sys.exit(1)
+    if is_store_file(sys.argv[1]):
+        store_to_json(sys.argv[1], sys.argv[2])
+    else:
+        json_to_store(sys.argv[1], sys.argv[2])
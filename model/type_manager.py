@@ -3,8 +3,13 @@ simple static class for convenient work with data types
 
 You can easily add new types and icons here.
 
+Icons are rendered once and cached here, qtawesome re-renders the font
+glyph on every call otherwise.
+
 """
 
+import qtawesome as qta
+
 
 class TypeManager(object):
     collections = ["Folder", "List", "KeyedList"]
@@ -22,6 +27,34 @@ class TypeManager(object):
         "Decimal": 'fa5s.file',
         "Float": 'fa5s.file'
     }
+    state_colors = ["black", "blue", "green"]
+    icon_cache = {}
+
+    @staticmethod
+    def build_icon_cache():
+        """must be called after the QApplication is created"""
+        for data_type in TypeManager.type_icon_dictionary:
+            for color in TypeManager.state_colors:
+                TypeManager.get_type_icon(data_type, color)
+        TypeManager.get_icon('fa5s.plus-circle')
+        TypeManager.get_icon('fa5s.minus-circle')
+
+    @staticmethod
+    def get_type_icon(value_type, color='black'):
+        key = (value_type, color)
+        icon = TypeManager.icon_cache.get(key)
+        if icon is None:
+            icon = qta.icon(TypeManager.type_icon_dictionary[value_type], options=[{'color': color}])
+            TypeManager.icon_cache[key] = icon
+        return icon
+
+    @staticmethod
+    def get_icon(name):
+        icon = TypeManager.icon_cache.get(name)
+        if icon is None:
+            icon = qta.icon(name)
+            TypeManager.icon_cache[name] = icon
+        return icon
 
     @staticmethod
     def get_types_list(value_type):
@@ -0,0 +1,86 @@
+"""
+Undo history
+
+An entry holds the steps of one user action, everything between begin and end
+is one entry. A step is a pair of small operation dicts, one that undoes it and
+one that redoes it, see TreeModel.undo. Steps name the affected TreeItems
+directly and carry only the changed field values: a removed subtree stays
+alive by reference instead of being copied, a move only remembers a parent and
+a row, so undoing or redoing it is one re-link whatever the size of the subtree.
+Sources and metadata steps keep only the rows that changed, see changed_rows.
+
+"""
+
+import collections
+
+
+class UndoStack(object):
+
+    def __init__(self, limit=1000):
+        self.undo_entries = collections.deque(maxlen=limit)
+        self.redo_entries = []
+        self._entry = None
+        self._depth = 0
+        # nothing is recorded while an entry is undone or redone
+        self.paused = False
+
+    def clear(self):
+        self.undo_entries.clear()
+        self.redo_entries = []
+
+    def begin(self):
+        if self._depth == 0:
+            self._entry = []
+        self._depth += 1
+
+    def end(self):
+        self._depth -= 1
+        if self._depth:
+            return
+        entry, self._entry = self._entry, None
+        if entry:
+            self._push(entry)
+
+    def record(self, undo, redo):
+        if self.paused:
+            return
+        if self._entry is not None:
+            self._entry.append((undo, redo))
+        else:
+            self._push([(undo, redo)])
+
+    def _push(self, entry):
+        self.undo_entries.append(entry)
+        self.redo_entries = []
+
+    def can_undo(self):
+        return bool(self.undo_entries)
+
+    def can_redo(self):
+        return bool(self.redo_entries)
+
+    def take_undo(self):
+        """The undo operations of the last entry, latest first"""
+        entry = self.undo_entries.pop()
+        self.redo_entries.append(entry)
+        return [undo for undo, redo in reversed(entry)]
+
+    def take_redo(self):
+        entry = self.redo_entries.pop()
+        self.undo_entries.append(entry)
+        return [redo for undo, redo in entry]
+
+
+def changed_rows(old, new):
+    """
+    Returns (row, old rows, new rows): the slice of old that is replaced to
+    get new, without the common head and tail
+    """
+    row = 0
+    end = min(len(old), len(new))
+    while row < end and old[row] == new[row]:
+        row += 1
+    tail = 0
+    while tail < end - row and old[len(old) - 1 - tail] == new[len(new) - 1 - tail]:
+        tail += 1
+    return row, old[row:len(old) - tail], new[row:len(new) - tail]
@@ -0,0 +1,13 @@
+import os
+import sys
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PyQt5 import QtWidgets
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
@@ -0,0 +1,98 @@
+"""
+The controller creates its own QApplication, so it runs in a child process.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AUTOSAVE_SCRIPT = r'''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+json_path = sys.argv[2]
+sys.argv[1:] = ["--no-cache"]
+from PyQt5 import QtWidgets
+from model.json_file_manager import JsonFileManager
+from model.tree_item import TreeItem
+
+def choose_file(self):
+    self.file_path = self.file_path or json_path
+    return self.file_path
+JsonFileManager.choose_file = choose_file
+controller = importlib.import_module("сontroller.main_controller").MainController()
+model = controller.main_view.tree_view.tree_model
+state = {}
+
+def edit_and_autosave(name):
+    model.insert_items(model.root_item, 0, [TreeItem({"title": name, "varId": name, "dataType": "Text"})])
+    controller.autosave()
+    state[name] = controller.saver is not None
+    if controller.saver is not None:
+        controller.saver.wait()
+
+# the loader was started by the constructor, its queued batches are dropped
+controller.cancel_loading()
+edit_and_autosave("cancelled")
+controller.create_tree()
+while controller.loader is not None:
+    QtWidgets.QApplication.processEvents()
+    time.sleep(0.005)
+edit_and_autosave("loaded")
+print(json.dumps(state))
+'''
+
+
+def test_autosave_only_after_completed_load(tmp_path):
+    json_path = tmp_path / "tree.json"
+    json_path.write_text(json.dumps([{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text"}
+                                     for i in range(5000)]))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run([sys.executable, "-c", AUTOSAVE_SCRIPT, ROOT, str(json_path)], env=env,
+                            capture_output=True, text=True, timeout=60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    assert lines, result.stderr[-2000:]
+    assert json.loads(lines[-1]) == {"cancelled": False, "loaded": True}
+
+
+SAVE_SCRIPT = r'''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+json_path = sys.argv[2]
+sys.argv[1:] = ["--no-cache"]
+from PyQt5 import QtWidgets
+from model.json_file_manager import JsonFileManager
+from model.tree_item import TreeItem
+
+def choose_file(self):
+    self.file_path = self.file_path or json_path
+    return self.file_path
+JsonFileManager.choose_file = choose_file
+QtWidgets.QMessageBox.question = staticmethod(lambda *args: QtWidgets.QMessageBox.Yes)
+controller = importlib.import_module("сontroller.main_controller").MainController()
+model = controller.main_view.tree_view.tree_model
+while controller.loader is not None:
+    QtWidgets.QApplication.processEvents()
+    time.sleep(0.005)
+controller.journal = None
+model.insert_items(model.root_item, 0, [TreeItem({"title": "new", "varId": "new", "dataType": "Text"})])
+controller.save_clicked()
+while controller.saver is not None:
+    QtWidgets.QApplication.processEvents()
+    time.sleep(0.005)
+print(json.dumps({"has_changes": model.change_tracker.has_changes()}))
+'''
+
+
+def test_save_without_journal(tmp_path):
+    json_path = tmp_path / "tree.json"
+    json_path.write_text(json.dumps([{"title": "t", "varId": "t", "dataType": "Text"}]))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run([sys.executable, "-c", SAVE_SCRIPT, ROOT, str(json_path)], env=env,
+                            capture_output=True, text=True, timeout=60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    assert lines, result.stderr[-2000:]
+    assert json.loads(lines[-1]) == {"has_changes": False}
+    assert "failed" not in result.stdout
+    assert [element["title"] for element in json.loads(json_path.read_text())] == ["new", "t"]
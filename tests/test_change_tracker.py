@@ -0,0 +1,48 @@
+from model.change_tracker import ChangeTracker
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+def _folder(title, children=()):
+    folder = TreeItem({"title": title, "varId": title, "dataType": "Folder"})
+    folder.createChildren([{"title": child, "varId": child, "dataType": "Text"} for child in children])
+    folder.setNewAdded(True)
+    return folder
+
+
+def _save(model):
+    version, children, entries = model.snapshot()
+    return lambda: model.saved(version, children, [None] * len(children))
+
+
+def test_save_keeps_later_changes_inside_an_added_subtree(qapp):
+    model = TreeModel()
+    model.load_data([{"title": "A", "varId": "a", "dataType": "Text"}])
+    folder = _folder("F", ["x"])
+    model.insert_items(model.root_item, 1, [folder])
+    saved = _save(model)
+    # changed while the save is written
+    late = _folder("L")
+    model.insert_items(folder, 1, [late])
+    model.setData(model.index_of(folder.child(0)), "y")
+    saved()
+    tracker = model.change_tracker
+    assert tracker.changes() == [(ChangeTracker.ADDED, late), (ChangeTracker.MODIFIED, folder.child(0))]
+    assert not folder.newAdded and late.newAdded
+    assert folder.child(0).valueChanged and not folder.child(0).newAdded
+    assert tracker.modified[folder.child(0)][0] == "x"
+    _save(model)()
+    assert not tracker.has_changes()
+    assert not late.newAdded and not folder.child(0).valueChanged
+
+
+def test_save_clears_an_added_subtree_changed_before_it(qapp):
+    model = TreeModel()
+    folder = _folder("F", ["x"])
+    model.insert_items(model.root_item, 0, [folder])
+    model.insert_items(folder, 1, [_folder("L")])
+    model.setData(model.index_of(folder.child(0)), "y")
+    assert model.change_tracker.changes() == [(ChangeTracker.ADDED, folder)]
+    _save(model)()
+    assert not model.change_tracker.has_changes()
+    assert not any(item.newAdded or item.valueChanged for item in [folder] + folder.childItems)
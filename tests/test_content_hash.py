@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from model.content_hash import data_hash, node_digest
+from model.tree_diff import warm_digests
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+def _elements(count, depth):
+    if depth == 0:
+        return [{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text",
+                 "metadata": {"unit": "u{}".format(i)}} for i in range(count)]
+    return [{"title": "f{}".format(i), "varId": "f{}".format(i), "dataType": "Folder",
+             "children": _elements(count, depth - 1)} for i in range(count)]
+
+
+def _items(item):
+    stack = list(item.childItems)
+    while stack:
+        item = stack.pop()
+        yield item
+        stack.extend(item.childItems)
+
+
+def _fresh_hash(item):
+    return node_digest(item.itemData, item.varId, item.dataType, item.sources, item.metadata,
+                       [_fresh_hash(child) for child in item.childItems])
+
+
+def test_item_and_element_digests_agree(qapp):
+    elements = _elements(3, 2)
+    model = TreeModel()
+    model.load_data(elements)
+    for element, item in zip(elements, model.root_item.childItems):
+        assert item.contentHash() == data_hash(element)
+
+
+def test_an_edit_drops_only_the_digests_up_to_the_root(qapp):
+    model = TreeModel()
+    model.load_data(_elements(3, 2))
+    root = model.root_item
+    root.contentHash()
+    leaf = root.child(1).child(2).child(0)
+    model.setData(model.index_of(leaf), "renamed")
+    path = {leaf, leaf.parent(), leaf.parent().parent(), root}
+    assert all(item.contentDigest is None for item in path)
+    assert all(item.contentDigest is not None for item in _items(root) if item not in path)
+    assert root.contentHash() == _fresh_hash(root)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_model_edits_keep_digests(qapp, seed):
+    model = TreeModel()
+    model.load_data(_elements(4, 2))
+    root = model.root_item
+    rng = random.Random(seed)
+    for step in range(60):
+        items = list(_items(root))
+        root.contentHash()
+        folders = [item for item in items if item.getDataType() == "Folder"]
+        choice = rng.random()
+        if choice < 0.2 or len(items) < 3:
+            parent = rng.choice(folders + [root])
+            new = TreeItem({"title": "n{}".format(step), "varId": "n{}".format(step), "dataType": "Folder"})
+            model.insert_items(parent, rng.randint(0, parent.childCount()), [new])
+        elif choice < 0.35 and len(items) > 10:
+            model.remove_items(rng.sample(items, 2))
+        elif choice < 0.5 and folders:
+            model.move_items(rng.sample(items, 3), rng.choice(folders))
+        elif choice < 0.6:
+            model.setData(model.index_of(rng.choice(items)), "r{}".format(step))
+        elif choice < 0.7:
+            model.set_var_id(rng.choice(items), "x{}".format(step))
+        elif choice < 0.8:
+            model.set_sources(rng.choice(items), ["s{}".format(step)])
+        elif choice < 0.9:
+            model.set_metadata_key(rng.choice(items), "unit", "m{}".format(step))
+        else:
+            model.set_data_type(rng.choice(items), "Integer")
+        for item in items:
+            if item.contentDigest is not None:
+                assert item.contentDigest == _fresh_hash(item)
+        assert root.contentHash() == _fresh_hash(root)
+    while model.undo_stack.can_undo():
+        model.undo()
+        assert root.contentHash() == _fresh_hash(root)
+
+
+def test_warm_digests_in_slices_with_edits_in_between(qapp):
+    model = TreeModel()
+    model.load_data(_elements(6, 3))
+    root = model.root_item
+    steps = warm_digests(root, step=50)
+    percents = [next(steps), next(steps)]
+    model.setData(model.index_of(root.child(0).child(0)), "renamed")
+    percents.extend(steps)
+    assert len(percents) > 3 and percents == sorted(percents)
+    assert all(item.contentDigest is not None for item in _items(root.child(5)))
+    assert root.contentHash() == _fresh_hash(root)
@@ -0,0 +1,59 @@
+"""
+The controller creates its own QApplication, so it runs in a child process.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SELECTION_SCRIPT = r'''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+json_path = sys.argv[2]
+sys.argv[1:] = ["--no-cache"]
+from PyQt5 import QtCore, QtWidgets
+from model.json_file_manager import JsonFileManager
+
+def choose_file(self):
+    self.file_path = self.file_path or json_path
+    return self.file_path
+JsonFileManager.choose_file = choose_file
+controller = importlib.import_module("сontroller.main_controller").MainController()
+while controller.loader is not None:
+    QtWidgets.QApplication.processEvents()
+    time.sleep(0.005)
+view = controller.main_view.tree_view
+model = view.tree_model
+first, second = model.root_item.childItems
+view.select_item(second)
+# the first row is selected too, the second stays the current item
+view.selectionModel().select(view._to_view(model.index_of(first)),
+                             QtCore.QItemSelectionModel.Select | QtCore.QItemSelectionModel.Rows)
+changed = []
+model.dataChanged.connect(lambda top, bottom, roles: changed.append([top.row(), bottom.row()]))
+controller.data_type_changed("Integer")
+controller.metadata_model.setData(controller.metadata_model.index(0, 1), "10")
+view.clearSelection()
+controller.data_type_changed("Decimal")
+print(json.dumps({"types": [first.getDataType(), second.getDataType()], "metadata": second.getMetaData(),
+                  "changed": changed}))
+'''
+
+
+def test_edits_apply_to_the_current_item(tmp_path):
+    json_path = tmp_path / "tree.json"
+    json_path.write_text(json.dumps([{"title": "first", "varId": "first", "dataType": "Text"},
+                                     {"title": "second", "varId": "second", "dataType": "Text",
+                                      "metadata": {"unit": "1"}}]))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run([sys.executable, "-c", SELECTION_SCRIPT, ROOT, str(json_path)], env=env,
+                            capture_output=True, text=True, timeout=60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    assert lines, result.stderr[-2000:]
+    state = json.loads(lines[-1])
+    assert state["types"] == ["Text", "Decimal"]
+    assert state["metadata"] == {"unit": "10"}
+    assert state["changed"] and all(rows == [1, 1] for rows in state["changed"])
+    assert "failed" not in result.stdout
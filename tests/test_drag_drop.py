@@ -0,0 +1,69 @@
+"""
+Drag and drop runs through QDrag.exec, which the offscreen platform does not
+implement, so the drag runs in a child process on the vnc platform.
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DRAG_SCRIPT = r'''
+import json, sys
+sys.path.insert(0, sys.argv[1])
+from PyQt5 import QtWidgets, QtCore, QtGui
+app = QtWidgets.QApplication([])
+from view.tree_view import TreeView
+view = TreeView()
+view.load_data([{"title": "F1", "varId": "f1", "dataType": "Folder",
+                 "children": [{"title": "P", "varId": "p", "dataType": "Text"}]},
+                {"title": "F2", "varId": "f2", "dataType": "Folder", "children": []}])
+view.resize(300, 300)
+view.show()
+view.expandAll()
+QtWidgets.QApplication.processEvents()
+model = view.tree_model
+item = model.root_item.child(0).child(0)
+folder = model.root_item.child(1)
+source = view._to_view(model.index_of(item))
+view.selectionModel().select(source, QtCore.QItemSelectionModel.ClearAndSelect | QtCore.QItemSelectionModel.Rows)
+view.setCurrentIndex(source)
+target = view.visualRect(view._to_view(model.index_of(folder))).center()
+
+def drop():
+    viewport = view.viewport()
+    for pos in (target, target + QtCore.QPoint(1, 0)):
+        QtWidgets.QApplication.sendEvent(viewport, QtGui.QMouseEvent(
+            QtCore.QEvent.MouseMove, pos, viewport.mapToGlobal(pos),
+            QtCore.Qt.LeftButton, QtCore.Qt.LeftButton, QtCore.Qt.NoModifier))
+    QtWidgets.QApplication.sendEvent(viewport, QtGui.QMouseEvent(
+        QtCore.QEvent.MouseButtonRelease, pos, viewport.mapToGlobal(pos),
+        QtCore.Qt.LeftButton, QtCore.Qt.NoButton, QtCore.Qt.NoModifier))
+
+QtCore.QTimer.singleShot(100, drop)
+view.startDrag(QtCore.Qt.MoveAction)
+print(json.dumps({"parent": item.parent().data(), "attached": model.change_tracker.is_attached(item),
+                  "F1": [child.data() for child in model.root_item.child(0).childItems],
+                  "F2": [child.data() for child in folder.childItems]}))
+'''
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_dropped_item_stays_in_tree():
+    env = dict(os.environ, QT_QPA_PLATFORM="vnc:port={}".format(_free_port()))
+    result = subprocess.run([sys.executable, "-c", DRAG_SCRIPT, ROOT], env=env, capture_output=True,
+                            text=True, timeout=60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if not lines:
+        pytest.skip("no vnc platform plugin: " + result.stderr[-200:])
+    state = json.loads(lines[-1])
+    assert state == {"parent": "F2", "attached": True, "F1": [], "F2": ["P"]}
@@ -0,0 +1,43 @@
+from model.edit_journal import EditJournal
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+def _elements():
+    return [{"title": "A", "varId": "a", "dataType": "Folder",
+             "children": [{"title": "B", "varId": "b", "dataType": "Text", "metadata": {"unit": "m"}}]}]
+
+
+def test_added_subtrees_are_serialised_when_written(qapp, tmp_path, monkeypatch):
+    model = TreeModel()
+    model.load_data(_elements())
+    edits = []
+    model.edited.connect(edits.append)
+    serialised = []
+    create_new_item = TreeItem.create_new_item
+    monkeypatch.setattr(TreeItem, "create_new_item", lambda item: serialised.append(item) or create_new_item(item))
+    folder = TreeItem({"title": "C", "varId": "c", "dataType": "Folder",
+                       "children": [{"title": "D", "varId": "d", "dataType": "Text"}]})
+    model.insert_items(model.root_item, 1, [folder])
+    assert edits[-1]["item"] is folder
+    assert serialised == []
+    journal = EditJournal(str(tmp_path / "tree.json"))
+    for edit in edits:
+        journal.append(edit)
+    journal.close()
+    replayed = TreeModel()
+    replayed.load_data(_elements())
+    for entry in journal.entries():
+        assert replayed.apply_edit(entry)
+    assert replayed.root_item.contentHash() == model.root_item.contentHash()
+
+
+def test_append_reaches_the_disk(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr("model.edit_journal.os.fsync", synced.append)
+    journal = EditJournal(str(tmp_path / "tree.json"))
+    journal.append({"op": "rename", "path": [0], "value": "x"})
+    journal.append({"op": "rename", "path": [0], "value": "y"})
+    assert synced == [journal.file.fileno()] * 2
+    journal.close()
+    assert [entry["value"] for entry in journal.entries()] == ["x", "y"]
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+def _elements(count, depth):
+    if depth == 0:
+        return [{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text"} for i in range(count)]
+    return [{"title": "f{}".format(i), "varId": "f{}".format(i), "dataType": "Folder",
+             "children": _elements(count, depth - 1)} for i in range(count)]
+
+
+def _items(item):
+    stack = list(item.childItems)
+    while stack:
+        item = stack.pop()
+        yield item
+        stack.extend(item.childItems)
+
+
+def _fresh_path(item):
+    titles = []
+    while item.parent() is not None:
+        titles.append(item.data())
+        item = item.parent()
+    return "/" + "/".join(reversed(titles))
+
+
+def test_rename_drops_the_cached_paths_of_the_subtree(qapp):
+    model = TreeModel()
+    model.load_data(_elements(3, 2))
+    root = model.root_item
+    for item in _items(root):
+        item.fullPath()
+    folder = root.child(1)
+    model.setData(model.index_of(folder), "renamed")
+    subtree = {folder} | set(_items(folder))
+    assert all(item.pathCache is None for item in subtree)
+    assert all(item.pathCache is not None for item in _items(root) if item not in subtree)
+    assert folder.child(2).child(0).fullPath() == "/renamed/f2/t0"
+
+
+def test_title_path_finds_the_item(qapp):
+    model = TreeModel()
+    model.load_data(_elements(3, 2))
+    item = model.root_item.child(2).child(1).child(0)
+    assert model.item_at_title_path("/f2/f1/t0") is item
+    model.move_items([item], model.root_item.child(0))
+    assert model.item_at_title_path("/f0/t0") is item
+    assert model.item_at_title_path("/f2/f1/t0") is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_model_edits_keep_paths(qapp, seed):
+    model = TreeModel()
+    model.load_data(_elements(4, 2))
+    root = model.root_item
+    rng = random.Random(seed)
+    for step in range(60):
+        items = list(_items(root))
+        # fill the caches so the edit has something to invalidate
+        for item in rng.sample(items, min(10, len(items))):
+            item.fullPath()
+        folders = [item for item in items if item.getDataType() == "Folder"]
+        choice = rng.random()
+        if choice < 0.25 or len(items) < 3:
+            parent = rng.choice(folders + [root])
+            new = TreeItem({"title": "n{}".format(step), "varId": "n{}".format(step), "dataType": "Folder"})
+            model.insert_items(parent, rng.randint(0, parent.childCount()), [new])
+        elif choice < 0.45 and len(items) > 10:
+            model.remove_items(rng.sample(items, 2))
+        elif choice < 0.75 and folders:
+            model.move_items(rng.sample(items, 3), rng.choice(folders))
+        else:
+            model.setData(model.index_of(rng.choice(items)), "r{}".format(step))
+        for item in _items(root):
+            if item.pathCache is not None:
+                assert item.pathCache == _fresh_path(item)
+    while model.undo_stack.can_undo():
+        model.undo()
+        for item in _items(root):
+            assert item.fullPath() == _fresh_path(item)
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from model.json_file_manager import JsonFileManager
+from model.tree_item import TreeItem
+
+ELEMENTS = [1.5, -2.25e+10, 3E-2, 12, 0.125, 7e5, {"title": "a", "value": 1.75}, "x.e", [0.5, 1e-3], 42,
+            True, None, 6.02e23]
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 40))
+def test_numbers_cut_at_chunk_boundaries(qapp, tmp_path, chunk_size):
+    path = tmp_path / "numbers.json"
+    text = json.dumps(ELEMENTS).replace(", ", ",")
+    path.write_text(text)
+    manager = JsonFileManager()
+    manager.chunk_size = chunk_size
+    assert [element for element, _ in manager._stream_array(str(path))] == json.loads(text)
+
+
+def test_invalid_number_is_rejected(qapp, tmp_path):
+    path = tmp_path / "invalid.json"
+    path.write_text("[1.5,2.]")
+    manager = JsonFileManager()
+    manager.chunk_size = 4
+    with pytest.raises(ValueError):
+        list(manager._stream_array(str(path)))
+
+
+def test_streamed_items_share_metadata_keys(qapp, tmp_path):
+    path = tmp_path / "tree.json"
+    path.write_text(json.dumps([{"title": "t{}".format(i), "metadata": {"unit": "m"}} for i in range(3)]))
+    items = [TreeItem(element) for element, _ in JsonFileManager()._stream_array(str(path))]
+    keys = [next(iter(item.getMetaData())) for item in items]
+    assert keys == ["unit"] * 3
+    assert keys[0] is keys[1] is keys[2]
@@ -0,0 +1,49 @@
+"""
+The controller creates its own QApplication, so it runs in a child process.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAILURE_SCRIPT = r'''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+json_path = sys.argv[2]
+sys.argv[1:] = ["--no-cache"]
+from PyQt5 import QtWidgets
+from model.json_file_manager import JsonFileManager
+
+def choose_file(self):
+    self.file_path = self.file_path or json_path
+    return self.file_path
+JsonFileManager.choose_file = choose_file
+messages = []
+QtWidgets.QMessageBox.critical = staticmethod(lambda parent, title, text: messages.append(text))
+controller = importlib.import_module("сontroller.main_controller").MainController()
+while controller.loader is not None:
+    QtWidgets.QApplication.processEvents()
+    time.sleep(0.005)
+model = controller.main_view.tree_view.tree_model
+print(json.dumps({"messages": messages, "rows": model.root_item.childCount(), "journal": controller.journal is None,
+                  "save": controller.main_view.save_button.isEnabled()}))
+'''
+
+
+def test_broken_file_leaves_an_empty_tree(tmp_path):
+    json_path = tmp_path / "tree.json"
+    elements = json.dumps([{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text"}
+                           for i in range(5000)])
+    json_path.write_text(elements[:-1] + ', {"title": ]')
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run([sys.executable, "-c", FAILURE_SCRIPT, ROOT, str(json_path)], env=env,
+                            capture_output=True, text=True, timeout=60)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    assert lines, result.stderr[-2000:]
+    state = json.loads(lines[-1])
+    assert len(state["messages"]) == 1 and state["messages"][0].startswith("Loading failed.\n")
+    assert len(state["messages"][0]) > len("Loading failed.\n")
+    assert state["rows"] == 0 and state["journal"] and not state["save"]
+    assert "Traceback" in result.stdout
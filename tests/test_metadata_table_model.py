@@ -0,0 +1,95 @@
+import pytest
+from PyQt5 import QtWidgets
+
+from model.metadata_table_model import MetadataTableModel
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+@pytest.fixture
+def table(qapp, monkeypatch):
+    monkeypatch.setattr(QtWidgets.QMessageBox, "critical", staticmethod(lambda *args: None))
+    return MetadataTableModel({"a": "1", "b": "2", "c": "3"})
+
+
+def test_value_edit_is_a_key_edit(table):
+    assert table.setData(table.index(1, 1), "20")
+    assert table.key_edit == ("b", "20")
+    assert table.setData(table.index(1, 0), "bb")
+    assert table.key_edit is None
+    assert table.getMetaData() == {"a": "1", "bb": "20", "c": "3"}
+
+
+def test_inserted_row_is_written_back_whole(table):
+    table.insertRow(0)
+    assert table.setData(table.index(2, 1), "20")
+    assert table.key_edit is None
+    assert list(table.getMetaData()) == ["a", "#real_empty#", "b", "c"]
+    assert table.setData(table.index(2, 1), "21")
+    assert table.key_edit == ("b", "21")
+
+
+def test_get_metadata_returns_a_new_dict(table):
+    metadata = table.getMetaData()
+    table.setData(table.index(0, 1), "10")
+    assert metadata == {"a": "1", "b": "2", "c": "3"}
+    assert table.getMetaData() is not metadata
+
+
+def test_set_metadata_key_keeps_the_old_dict(qapp):
+    model = TreeModel()
+    model.load_data([{"title": "A", "varId": "a", "dataType": "Text", "metadata": {"x": "1", "y": "2"}}])
+    item = model.root_item.child(0)
+    loaded = item.getMetaData()
+    model.set_metadata_key(item, "x", "10")
+    assert list(item.getMetaData().items()) == [("x", "10"), ("y", "2")]
+    assert loaded == {"x": "1", "y": "2"}
+    assert model.search("meta:x=10") == {item}
+    model.undo()
+    assert item.getMetaData() == loaded
+    assert not item.valueChanged
+
+
+def test_set_metadata_key_edits_in_place(qapp):
+    model = TreeModel()
+    model.load_data([{"title": "A", "varId": "a", "dataType": "Text",
+                      "metadata": {"x": "red apple", "y": "apple pie"}}])
+    item = model.root_item.child(0)
+    edits = []
+    model.edited.connect(edits.append)
+    model.set_metadata_key(item, "x", "green pear")
+    owned = item.getMetaData()
+    model.set_metadata_key(item, "y", "cherry")
+    # copied once, later edits change the same dict
+    assert item.getMetaData() is owned
+    assert edits[-1] == {"op": "metadataKey", "path": [0], "key": "y", "value": "cherry"}
+    assert model.search("meta:pear") == {item}
+    assert model.search("meta:apple") == set()
+    assert model.search("meta:red") == set()
+    # a save snapshot shares the dict, the next edit copies it again
+    version, children, entries = model.snapshot()
+    model.set_metadata_key(item, "x", "plum")
+    assert entries[0]["metadata"] == {"x": "green pear", "y": "cherry"}
+    assert item.getMetaData() == {"x": "plum", "y": "cherry"}
+    model.remove_metadata_key(item, "x")
+    assert model.search("meta:plum") == set()
+    assert model.search("meta:x=") == set()
+    model.remove_items([item])
+    assert not any(item in items for items in model.search_index.meta_tokens.token_items.values())
+
+
+def test_metadata_key_edits_replay_from_the_journal(qapp):
+    elements = [{"title": "A", "varId": "a", "dataType": "Text", "metadata": {"x": "1", "y": "2", "z": "3"}}]
+    model = TreeModel()
+    model.load_data(elements)
+    edits = []
+    model.edited.connect(edits.append)
+    item = model.root_item.child(0)
+    model.set_metadata_key(item, "w", "0")
+    model.remove_metadata_key(item, "y")
+    model.undo()
+    replayed = TreeModel()
+    replayed.load_data(elements)
+    for edit in edits:
+        assert replayed.apply_edit(edit)
+    assert list(replayed.root_item.child(0).getMetaData().items()) == list(item.getMetaData().items())
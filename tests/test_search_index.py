@@ -0,0 +1,41 @@
+import pytest
+
+from model.search_index import SearchIndex
+from model.tree_model import TreeModel
+
+ELEMENTS = [
+    {"title": "A", "varId": "a", "dataType": "Folder", "children": [
+        {"title": "bar", "varId": "bar", "dataType": "Text", "metadata": {"unit": "bar", "note": "foobar baz"}},
+        {"title": "dash", "varId": "dash", "dataType": "Text", "metadata": {"range": "a-x", "Scale": "Big Film"}},
+        {"title": "empty", "varId": "empty", "dataType": "Text"}]},
+]
+
+QUERIES = ["meta:ar", "meta:ba", "meta:bar b", "meta:-x", "meta:-", "meta:unit=ar", "meta:unit=ba",
+           "meta:note=baz", "meta:scale=film", "meta:scale=", "meta:sca", "meta:", "meta:big f", "meta:ig"]
+
+
+def _raw(elements):
+    for element in elements:
+        yield element
+        yield from _raw(element.get("children", []))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_metadata_search_matches_raw_data(qapp, query):
+    matcher = SearchIndex.data_matcher(query)
+    expected = sorted(data["title"] for data in _raw(ELEMENTS) if matcher(data))
+    model = TreeModel()
+    model.load_data(ELEMENTS)
+    assert sorted(item.data() for item in model.search(query)) == expected
+    lazy = TreeModel()
+    lazy.lazy = True
+    lazy.load_data(ELEMENTS)
+    assert sorted(item.data() for item in lazy.search(query)) == expected
+
+
+def test_metadata_search_starts_at_words(qapp):
+    model = TreeModel()
+    model.load_data(ELEMENTS)
+    assert {item.data() for item in model.search("meta:ba")} == {"bar"}
+    assert model.search("meta:ar") == set()
+    assert {item.data() for item in model.search("meta:-x")} == {"dash"}
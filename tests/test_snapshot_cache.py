@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+from model.json_file_manager import JsonFileManager
+from model.snapshot_cache import SnapshotCache
+
+ELEMENTS = [{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text"} for i in range(7)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SnapshotCache(str(tmp_path / "cache"))
+    cache.chunk_size = 2
+    return cache
+
+
+@pytest.fixture
+def json_path(tmp_path):
+    path = tmp_path / "tree.json"
+    path.write_text(json.dumps(ELEMENTS))
+    return str(path)
+
+
+def _elements(cache, json_path):
+    return [element for element, _ in cache.stream(JsonFileManager(), json_path)]
+
+
+def _corrupt(cache, json_path, corrupt):
+    entry = cache.cache_path(json_path)
+    with open(entry, 'rb') as file:
+        data = file.read()
+    with open(entry, 'wb') as file:
+        file.write(corrupt(data))
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:-5],
+    lambda data: data[:-3] + b"\xff\xff\xff",
+    lambda data: data[:-30] + b"\x00" * 30,
+])
+def test_corrupt_entry_falls_back_to_json(qapp, cache, json_path, corrupt):
+    assert _elements(cache, json_path) == ELEMENTS
+    _corrupt(cache, json_path, corrupt)
+    assert _elements(cache, json_path) == ELEMENTS
+    # the entry was rebuilt from the json
+    assert list(element for element, _ in cache.read(cache.key(json_path))) == ELEMENTS
+
+
+def test_corrupt_header_removes_entry(qapp, cache, json_path):
+    _elements(cache, json_path)
+    _corrupt(cache, json_path, lambda data: data[:4])
+    assert cache.read(cache.key(json_path)) is None
+    assert not os.path.exists(cache.cache_path(json_path))
+    assert _elements(cache, json_path) == ELEMENTS
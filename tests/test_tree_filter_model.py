@@ -0,0 +1,85 @@
+import pytest
+from PyQt5 import QtCore
+
+from model.tree_filter_model import TreeFilterModel
+from model.tree_model import TreeModel
+from view.tree_view import TreeView
+
+
+class CountingFilterModel(TreeFilterModel):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        self.calls += 1
+        return super().filterAcceptsRow(source_row, source_parent)
+
+
+def _elements():
+    return [{"title": "f{}".format(i), "varId": "f{}".format(i), "dataType": "Folder",
+             "children": [{"title": "t{}{}".format(i, j), "varId": "t{}{}".format(i, j), "dataType": "Text"}
+                          for j in range(50)]} for i in range(50)]
+
+
+def _titles(proxy, parent=None):
+    parent = parent or QtCore.QModelIndex()
+    return [proxy.index(row, 0, parent).data() for row in range(proxy.rowCount(parent))]
+
+
+@pytest.fixture
+def filtered(qapp):
+    model = TreeModel()
+    model.load_data(_elements())
+    proxy = CountingFilterModel()
+    proxy.setSourceModel(model)
+    proxy.start_filter()
+    return model, proxy
+
+
+def test_matches_show_their_paths_and_subtrees(filtered):
+    model, proxy = filtered
+    root = model.root_item
+    assert _titles(proxy) == []
+    proxy.add_matches([root.child(3).child(7)])
+    assert _titles(proxy) == ["f3"]
+    f3 = proxy.index(0, 0)
+    assert _titles(proxy, f3) == ["t37"]
+    proxy.add_matches([root.child(1).child(2), root.child(1).child(4)])
+    assert _titles(proxy) == ["f1", "f3"]
+    assert _titles(proxy, proxy.index(0, 0)) == ["t12", "t14"]
+    # a match above earlier matches shows its whole subtree
+    proxy.add_matches([root.child(3)])
+    assert len(_titles(proxy, proxy.index(1, 0))) == 50
+
+
+def test_new_matches_refilter_only_the_changed_rows(filtered):
+    model, proxy = filtered
+    root = model.root_item
+    _titles(proxy)
+    proxy.add_matches([root.child(3).child(7)])
+    _titles(proxy, proxy.index(0, 0))
+    proxy.calls = 0
+    proxy.add_matches([root.child(3).child(9)])
+    assert _titles(proxy, proxy.index(0, 0)) == ["t37", "t39"]
+    assert proxy.calls <= 2
+
+
+def test_clearing_a_search_shows_the_tree_model(qapp):
+    view = TreeView()
+    view.load_data(_elements())
+    item = view.tree_model.root_item.child(2).child(5)
+    view._start_search("t25")
+    assert view.model() is view.filter_model
+    worker = view._search_worker
+    worker.requestInterruption()
+    worker.wait()
+    view._pending_matches = [item]
+    view._flush_matches()
+    view.select_item(item)
+    view._start_search("")
+    assert view.model() is view.tree_model
+    assert not view.filter_model.is_filtering()
+    assert view.currentIndex() == view.tree_model.index_of(item)
+    assert view.isExpanded(view.tree_model.index_of(item.parent()))
+    assert view.selected_items() == [item]
@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+
+
+def _elements(count, depth):
+    if depth == 0:
+        return [{"title": "t{}".format(i), "varId": "v{}".format(i), "dataType": "Text"} for i in range(count)]
+    return [{"title": "f{}".format(i), "varId": "f{}".format(i), "dataType": "Folder",
+             "children": _elements(count, depth - 1)} for i in range(count)]
+
+
+def _items(item):
+    stack = list(item.childItems)
+    while stack:
+        item = stack.pop()
+        yield item
+        stack.extend(item.childItems)
+
+
+def _check(root):
+    for parent in [root] + list(_items(root)):
+        assert [child.rowNumber for child in parent.childItems] == list(range(parent.childCount()))
+        assert all(child.parent() is parent for child in parent.childItems)
+
+
+def test_child_list_edits_keep_rows(qapp):
+    parent = TreeItem(None)
+    parent.createChildren(_elements(5, 0))
+    rng = random.Random(1)
+    for step in range(200):
+        count = parent.childCount()
+        new = [TreeItem({"title": "n{}".format(step), "varId": "n"}) for _ in range(rng.randint(1, 3))]
+        choice = rng.random()
+        if choice < 0.3:
+            parent.appendChild(new[0])
+        elif choice < 0.6:
+            parent.insertChild(rng.randint(0, count), new[0])
+        elif choice < 0.8:
+            parent.insertChildren(rng.randint(0, count), new)
+        elif count:
+            position = rng.randrange(count)
+            parent.removeChildren(position, rng.randint(1, count - position))
+        _check(parent)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_model_edits_keep_rows(qapp, seed):
+    model = TreeModel()
+    model.load_data(_elements(4, 2))
+    root = model.root_item
+    rng = random.Random(seed)
+    for step in range(60):
+        items = list(_items(root))
+        folders = [item for item in items if item.getDataType() == "Folder"]
+        choice = rng.random()
+        if choice < 0.25 or len(items) < 3:
+            parent = rng.choice(folders + [root])
+            new = TreeItem({"title": "n{}".format(step), "varId": "n{}".format(step), "dataType": "Folder"})
+            model.insert_items(parent, rng.randint(0, parent.childCount()), [new])
+        elif choice < 0.45 and len(items) > 10:
+            model.remove_items(rng.sample(items, 2))
+        elif choice < 0.7 and folders:
+            model.move_items(rng.sample(items, 3), rng.choice(folders))
+        elif choice < 0.85:
+            model.setData(model.index_of(rng.choice(items)), "r{}".format(step))
+        else:
+            model.set_var_id(rng.choice(items), "x{}".format(step))
+        _check(root)
+    while model.undo_stack.can_undo():
+        model.undo()
+        _check(root)
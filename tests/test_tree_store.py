@@ -0,0 +1,148 @@
+import json
+
+from model.tree_file import json_default
+from model.tree_item import TreeItem
+from model.tree_model import TreeModel
+from model.tree_store import TreeStore, json_to_store
+
+ELEMENTS = [
+    {"title": "A", "varId": "a", "dataType": "Folder", "children": [
+        {"title": "x", "varId": "x", "dataType": "Folder", "children": [
+            {"title": "y", "varId": "y", "dataType": "Text"}]},
+        {"title": "z", "varId": "z", "dataType": "Text"}]},
+    {"title": "B", "varId": "b", "dataType": "Folder", "children": [
+        {"title": "q", "varId": "q", "dataType": "Text"}]},
+]
+
+
+def _store(tmp_path):
+    json_path = tmp_path / "tree.json"
+    json_path.write_text(json.dumps(ELEMENTS))
+    store_path = str(tmp_path / "tree.sqlite")
+    json_to_store(str(json_path), store_path)
+    return store_path
+
+
+def _open(store_path):
+    model = TreeModel()
+    model.lazy = True
+    model.load_data(TreeStore(store_path).children())
+    return model
+
+
+def _expand(model, item):
+    index = model.index_of(item)
+    if model.canFetchMore(index):
+        model.fetchMore(index)
+
+
+def _save(model, store_path):
+    version, children, changes = model.store_snapshot()
+    changes.write(store_path)
+    changes.bind_ids()
+    model.saved(version, children, [])
+
+
+def _tree(model):
+    return json.loads(json.dumps([child.create_new_item() for child in model.root_item.childItems],
+                                 default=json_default))
+
+
+def _new_folder(model, parent):
+    folder = TreeItem({"title": "New", "varId": "new", "dataType": "Folder"})
+    model.insert_items(parent, parent.childCount(), [folder])
+    return folder
+
+
+def test_move_stored_item_into_new_folder(qapp, tmp_path):
+    store_path = _store(tmp_path)
+    model = _open(store_path)
+    folder_a = model.root_item.child(0)
+    _expand(model, folder_a)
+    item_x = folder_a.child(0)
+    folder = _new_folder(model, folder_a)
+    model.move_items([item_x], folder)
+    expected = _tree(model)
+    _save(model, store_path)
+    reopened = _open(store_path)
+    assert _tree(reopened) == expected
+    assert [child["title"] for child in _tree(reopened)[0]["children"]] == ["z", "New"]
+    # the pending children of the moved item are read from its new row
+    _expand(model, item_x)
+    assert [child.data() for child in item_x.childItems] == ["y"]
+
+
+def test_move_item_out_of_new_folder(qapp, tmp_path):
+    store_path = _store(tmp_path)
+    model = _open(store_path)
+    folder_a = model.root_item.child(0)
+    folder_b = model.root_item.child(1)
+    _expand(model, folder_a)
+    folder = _new_folder(model, folder_a)
+    model.move_items([folder_a.child(0)], folder)
+    item = TreeItem({"title": "w", "varId": "w", "dataType": "Text"})
+    model.insert_items(folder, 0, [item])
+    model.move_items([item, folder.child(1)], folder_b)
+    expected = _tree(model)
+    _save(model, store_path)
+    assert _tree(_open(store_path)) == expected
+    assert [child.data() for child in folder_b.childItems] == ["q", "w", "x"]
+
+
+def test_moved_folder_saved_twice(qapp, tmp_path):
+    store_path = _store(tmp_path)
+    model = _open(store_path)
+    folder_a = model.root_item.child(0)
+    _expand(model, folder_a)
+    folder = _new_folder(model, folder_a)
+    model.move_items([folder_a.child(0)], folder)
+    _save(model, store_path)
+    model.set_var_id(folder.child(0), "x2")
+    expected = _tree(model)
+    _save(model, store_path)
+    assert _tree(_open(store_path)) == expected
+
+
+def _expand_all(model):
+    stack = list(model.root_item.childItems)
+    while stack:
+        item = stack.pop()
+        _expand(model, item)
+        stack.extend(item.childItems)
+
+
+def _paths(model, items):
+    return sorted(model.item_path(item) for item in items)
+
+
+def test_store_search_expands_only_the_way_to_matches(qapp, tmp_path):
+    store_path = _store(tmp_path)
+    reference = _open(store_path)
+    _expand_all(reference)
+    for query in ["Y", "varid:z", "y"]:
+        model = _open(store_path)
+        assert _paths(model, model.search(query)) == _paths(reference, reference.search(query))
+    model = _open(store_path)
+    model.search("y")
+    folder_a, folder_b = model.root_item.childItems
+    assert not folder_a.hasPendingChildren() and not folder_a.child(0).hasPendingChildren()
+    assert folder_b.hasPendingChildren()
+
+
+def test_store_var_id_lookup(qapp, tmp_path):
+    model = _open(_store(tmp_path))
+    assert model.search_index.var_id_count("y") == 1
+    assert model.var_id_in_use("y") and not model.var_id_in_use("missing")
+    assert model.item_with_var_id("y").fullPath() == "/A/x/y"
+    assert model.search_index.var_id_count("y") == 1
+
+
+def test_stored_children_query_their_ids_once(tmp_path):
+    store = TreeStore(_store(tmp_path))
+    children = store.children()[0]["children"]
+    queries = []
+    child_ids = store.child_ids
+    store.child_ids = lambda parent_id: queries.append(parent_id) or child_ids(parent_id)
+    assert [children[row]["title"] for row in range(len(children))] == ["x", "z"]
+    assert [child["title"] for child in children] == ["x", "z"]
+    assert len(queries) == 1
@@ -0,0 +1,79 @@
+import pytest
+
+from model.tree_model import TreeModel
+from model.undo_stack import changed_rows
+
+
+@pytest.mark.parametrize("old, new, expected", [
+    ([1, 2, 3], [1, 2, 3], (3, [], [])),
+    ([1, 2, 3], [1, 5, 3], (1, [2], [5])),
+    ([1, 2, 3], [1, 2, 3, 4], (3, [], [4])),
+    ([1, 2, 3], [1, 3], (1, [2], [])),
+    ([1, 1, 1], [1, 1], (2, [1], [])),
+    ([], [1], (0, [], [1])),
+    ([1, 2], [3, 4, 5], (0, [1, 2], [3, 4, 5])),
+])
+def test_changed_rows(old, new, expected):
+    row, old_rows, new_rows = changed_rows(old, new)
+    assert (row, old_rows, new_rows) == expected
+    assert old[:row] + new_rows + old[row + len(old_rows):] == new
+
+
+@pytest.fixture
+def model(qapp):
+    model = TreeModel()
+    model.load_data([{"title": "A", "varId": "a", "dataType": "Text",
+                      "sources": ["s{}".format(i) for i in range(100)],
+                      "metadata": {"k{}".format(i): "v{}".format(i) for i in range(100)}}])
+    return model
+
+
+def _last_steps(model):
+    return model.undo_stack.undo_entries[-1]
+
+
+def test_source_edit_keeps_the_changed_row(model):
+    item = model.root_item.child(0)
+    loaded = list(item.getSources())
+    sources = list(loaded)
+    sources[50] = "edited"
+    del sources[10]
+    model.set_sources(item, sources)
+    (undo, redo), = _last_steps(model)
+    assert (len(undo["value"]), len(redo["value"])) == (41, 40)
+    model.set_sources(item, sources + ["new"])
+    (undo, redo), = _last_steps(model)
+    assert (undo["value"], redo["value"]) == ([], ["new"])
+    model.undo()
+    assert item.getSources() == sources
+    model.undo()
+    assert item.getSources() == loaded
+    assert not item.valueChanged
+    model.redo()
+    model.redo()
+    assert item.getSources() == sources + ["new"]
+
+
+def _key_step(step):
+    return step["key"], step.get("value"), step.get("row")
+
+
+def test_metadata_key_edits_keep_one_key(model):
+    item = model.root_item.child(0)
+    loaded = list(item.getMetaData().items())
+    model.set_metadata_key(item, "k40", "edited")
+    model.set_metadata_key(item, "added", "new")
+    model.remove_metadata_key_items([item], "k10")
+    steps = [step for entry in model.undo_stack.undo_entries for step in entry]
+    assert [(_key_step(undo), _key_step(redo)) for undo, redo in steps] == [
+        (("k40", "v40", None), ("k40", "edited", None)), (("added", None, None), ("added", "new", None)),
+        (("k10", "v10", 10), ("k10", None, None))]
+    edited = list(item.getMetaData().items())
+    for _ in steps:
+        model.undo()
+    # removed keys come back in their place
+    assert list(item.getMetaData().items()) == loaded
+    assert not item.valueChanged
+    for _ in steps:
+        model.redo()
+    assert list(item.getMetaData().items()) == edited
@@ -0,0 +1,52 @@
+from PyQt5 import QtCore, QtWidgets
+import traceback
+
+
+class ChangesView(QtWidgets.QDialog):
+    # sygnals
+    revert_requested = QtCore.pyqtSignal(object)
+    item_activated = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        try:
+            self.initUI()
+            self.connect_signals()
+        except Exception as e:
+            print("ChangesView creation failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def initUI(self):
+        self.setWindowTitle("Changed items")
+        self.resize(500, 400)
+        self.changes_list = QtWidgets.QListWidget()
+        self.changes_list.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.revert_button = QtWidgets.QPushButton("Revert selected")
+        self.close_button = QtWidgets.QPushButton("Close")
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.revert_button)
+        buttons.addStretch()
+        buttons.addWidget(self.close_button)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.changes_list)
+        layout.addLayout(buttons)
+
+    def connect_signals(self):
+        self.revert_button.clicked.connect(self._revert_clicked)
+        self.close_button.clicked.connect(self.close)
+        self.changes_list.itemDoubleClicked.connect(self._item_double_clicked)
+
+    def set_changes(self, changes):
+        self.changes_list.clear()
+        for kind, item in sorted(changes, key=lambda change: (change[0], change[1].fullPath() or "")):
+            row = QtWidgets.QListWidgetItem("{}\t{}".format(kind, item.fullPath()))
+            row.setData(QtCore.Qt.UserRole, (kind, item))
+            self.changes_list.addItem(row)
+
+    def _revert_clicked(self):
+        changes = [row.data(QtCore.Qt.UserRole) for row in self.changes_list.selectedItems()]
+        if changes:
+            self.revert_requested.emit(changes)
+
+    def _item_double_clicked(self, row):
+        self.item_activated.emit(row.data(QtCore.Qt.UserRole)[1])
@@ -0,0 +1,45 @@
+from PyQt5 import QtCore, QtWidgets
+import traceback
+
+
+class DiffView(QtWidgets.QDialog):
+    # sygnals
+    path_activated = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        try:
+            self.initUI()
+            self.connect_signals()
+        except Exception as e:
+            print("DiffView creation failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def initUI(self):
+        self.resize(600, 400)
+        self.summary_label = QtWidgets.QLabel()
+        self.diff_list = QtWidgets.QListWidget()
+        self.close_button = QtWidgets.QPushButton("Close")
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(self.close_button)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.summary_label)
+        layout.addWidget(self.diff_list)
+        layout.addLayout(buttons)
+
+    def connect_signals(self):
+        self.close_button.clicked.connect(self.close)
+        self.diff_list.itemDoubleClicked.connect(self._item_double_clicked)
+
+    def set_changes(self, title, changes):
+        self.setWindowTitle(title)
+        self.summary_label.setText("{} difference(s)".format(len(changes)) if changes else "No differences")
+        self.diff_list.clear()
+        for kind, path, fields in sorted(changes, key=lambda change: (change[1], change[0])):
+            row = QtWidgets.QListWidgetItem("{}\t{}\t{}".format(kind, path, ", ".join(fields)))
+            row.setData(QtCore.Qt.UserRole, path)
+            self.diff_list.addItem(row)
+
+    def _item_double_clicked(self, row):
+        self.path_activated.emit(row.data(QtCore.Qt.UserRole))
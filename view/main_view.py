@@ -12,6 +12,11 @@ class MainWindow(QtWidgets.QWidget):
     save_clicked = QtCore.pyqtSignal()
     search_text_entered = QtCore.pyqtSignal("QString ")
     change_var_id = QtCore.pyqtSignal()
+    cancel_clicked = QtCore.pyqtSignal()
+    changes_clicked = QtCore.pyqtSignal()
+    compare_disk_clicked = QtCore.pyqtSignal()
+    compare_files_clicked = QtCore.pyqtSignal()
+    go_to_entered = QtCore.pyqtSignal("QString")
 
     def __init__(self):
         super().__init__()
@@ -32,7 +37,14 @@ class MainWindow(QtWidgets.QWidget):
             self.save_button.clicked.connect(self.save_clicked)
             self.var_id_textbox.editingFinished.connect(self.change_var_id)
             self.revert_button.clicked.connect(self.revert_button_clicked)
-            self.search_field.textChanged.connect(self.search_text_entered)
+            self.changes_button.clicked.connect(self.changes_clicked)
+            self.compare_disk_action.triggered.connect(self.compare_disk_clicked)
+            self.compare_files_action.triggered.connect(self.compare_files_clicked)
+            # searching starts once typing pauses
+            self.search_field.textChanged.connect(self._search_timer.start)
+            self._search_timer.timeout.connect(self._emit_search_text)
+            self.cancel_button.clicked.connect(self.cancel_clicked)
+            self.go_to_field.returnPressed.connect(self._emit_go_to)
         except Exception as e:
             print("connect_signals failed: {}".format(e))
             print(traceback.format_exc())
@@ -78,11 +90,21 @@ class MainWindow(QtWidgets.QWidget):
         layout = QtWidgets.QHBoxLayout()
         self.save_button = QtWidgets.QPushButton("Save")
         self.revert_button = QtWidgets.QPushButton("Revert")
+        self.changes_button = QtWidgets.QPushButton("Changes")
+        self.compare_button = QtWidgets.QPushButton("Compare")
+        compare_menu = QtWidgets.QMenu(self.compare_button)
+        self.compare_disk_action = compare_menu.addAction("With File on Disk")
+        self.compare_files_action = compare_menu.addAction("Two Files...")
+        self.compare_button.setMenu(compare_menu)
         self.validate_button = QtWidgets.QPushButton("Validate")
         layout.addWidget(self.save_button)
         layout.addStretch()
         layout.addWidget(self.revert_button)
         layout.addStretch()
+        layout.addWidget(self.changes_button)
+        layout.addStretch()
+        layout.addWidget(self.compare_button)
+        layout.addStretch()
         layout.addWidget(self.validate_button)
         return layout
 
@@ -91,8 +113,39 @@ class MainWindow(QtWidgets.QWidget):
         self.search_field = QtWidgets.QLineEdit()
         self.search_field.setPlaceholderText("Search...")
         layout.addWidget(self.search_field)
+        self.go_to_field = QtWidgets.QLineEdit()
+        self.go_to_field.setPlaceholderText("Go to VarId or /path...")
+        layout.addWidget(self.go_to_field)
+        self._search_timer = QtCore.QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(250)
         return layout
 
+    def _emit_search_text(self):
+        self.search_text_entered.emit(self.search_field.text())
+
+    def _emit_go_to(self):
+        self.go_to_entered.emit(self.go_to_field.text().strip())
+
+    def _create_progress_bar(self):
+        layout = QtWidgets.QHBoxLayout()
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.cancel_button)
+        self.show_progress(False)
+        return layout
+
+    def show_progress(self, visible, text=""):
+        self.progress_bar.setFormat(text + " %p%")
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(visible)
+        self.cancel_button.setVisible(visible)
+
+    def set_progress(self, value):
+        self.progress_bar.setValue(value)
+
     def _create_right_side_layout(self):
         layout = QtWidgets.QGridLayout(self.right_side_widget)
         layout.addWidget(QtWidgets.QLabel("Variable ID:"), 0, 0)
@@ -113,4 +166,5 @@ class MainWindow(QtWidgets.QWidget):
         layout.setContentsMargins(9, 0, 9, 0)
         layout.addLayout(self._create_left_pane_buttons())
         layout.addLayout(self._create_search_bar())
+        layout.addLayout(self._create_progress_bar())
         layout.addWidget(self.tree_view)
@@ -1,9 +1,10 @@
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
 from model.tree_model import TreeModel
+from model.tree_filter_model import FILTER_ROLE, TreeFilterModel
 from model.tree_item import TreeItem
 from model.type_manager import TypeManager
-import random
-import string
+from model.search_index import SearchWorker
+import functools
 import traceback
 
 
@@ -19,7 +20,15 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
             self.set_model()
             self.setDragEnabled(True)
             self.index_selected = None
+            self._curItem = None
             self.text_to_search = ""
+            self._search_worker = None
+            self._search_workers = set()
+            self._pending_matches = []
+            self._search_flush_timer = QtCore.QTimer(self)
+            self._search_flush_timer.setSingleShot(True)
+            self._search_flush_timer.setInterval(100)
+            self._search_flush_timer.timeout.connect(self._flush_matches)
             self.setFocusPolicy(QtCore.Qt.NoFocus)
         except Exception as e:
             print("View initialization failed: {}".format(e))
@@ -34,6 +43,17 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
             self._add_child_primitive_action = self._create_menu_action('New Primitive', self.create_child_primitive)
             self._add_root_folder_action = self._create_menu_action('Add child container', self.add_root_folder)
             self._add_root_primitive_action = self._create_menu_action('Add child primitive', self.create_root_primitive)
+            self._move_action = self._create_menu_action('Move to Folder...', self._move_slot)
+            self._set_type_action = self._create_menu_action('Set Data Type...', self._set_type_slot)
+            self._add_meta_action = self._create_menu_action('Add Metadata Key...', self._add_meta_slot)
+            self._remove_meta_action = self._create_menu_action('Remove Metadata Key...', self._remove_meta_slot)
+            self._undo_action = self._create_menu_action('Undo', self._undo_slot)
+            self._undo_action.setShortcuts(QtGui.QKeySequence.Undo)
+            self._redo_action = self._create_menu_action('Redo', self._redo_slot)
+            self._redo_action.setShortcuts(QtGui.QKeySequence.Redo)
+            # the tree never takes focus, the shortcuts work anywhere in the window
+            self.addAction(self._undo_action)
+            self.addAction(self._redo_action)
         except Exception as e:
             print("set_actions failed: {}".format(e))
             print(traceback.format_exc())
@@ -42,45 +62,87 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         self.tree_model = TreeModel()
         self.tree_model.dataChanged.connect(self._dataChanged)
         self.tree_model.rowMoved.connect(self._rowMoved)
+        # the search filter is put in front of the tree only while a search is shown
+        self.filter_model = TreeFilterModel()
+        self.filter_model.setSourceModel(self.tree_model)
         self.setModel(self.tree_model)
 
     """
         actions
     """
 
-    def load_data(self, data):
+    def load_data(self, data, lazy=False):
+        self.tree_model.lazy = lazy
         self.tree_model.load_data(data)
 
+    def append_items(self, items, lazy=False):
+        self.tree_model.lazy = lazy
+        self.tree_model.append_items(items)
+
     def clearContent(self):
-        root_index = self.tree_model.index(0, 0).parent()
-        i = self.tree_model.rowCount(root_index)
-        while i:
-            self.tree_model.removeRow(i - 1, root_index)
-            i -= 1
+        self._stop_search()
+        self._show_tree()
+        self.tree_model.clear()
 
     def getRootItem(self):
         if self.tree_model.hasIndex(0, 0):
             return self.tree_model.get_item(self.tree_model.index(0, 0).parent())
         return None
 
+    def _to_view(self, index):
+        if self.model() is self.filter_model:
+            return self.filter_model.mapFromSource(index)
+        return index
+
+    def _to_source(self, index):
+        if self.model() is self.filter_model:
+            return self.filter_model.mapToSource(index)
+        return index
+
+    def _set_view_model(self, model):
+        selection_model = self.selectionModel()
+        self.setModel(model)
+        selection_model.deleteLater()
+
     def _rowMoved(self, curIdx):
-        self.setCurrentIndex(curIdx)
+        self.setCurrentIndex(self._to_view(curIdx))
         self.index_selected = curIdx
         self._curItem = self.tree_model.get_item(self.index_selected)
         self.tree_selection_changed.emit(self._curItem)
 
-    def _dataChanged(self, index):
-        self._curItem.setValueChanged(True)
-        self.tree_value_changed.emit(index.data())
+    def _dataChanged(self, index, bottom=None, roles=()):
+        if FILTER_ROLE in roles:
+            return
+        if self.tree_model.get_item(index) is self._curItem:
+            self.tree_value_changed.emit(index.data())
 
     def mousePressEvent(self, event):
         QtWidgets.QTreeView.mousePressEvent(self, event)
-        self.index_selected = self.indexAt(event.pos())
-        self.setCurrentIndex(self.index_selected)
+        self.index_selected = self._to_source(self.indexAt(event.pos()))
+        self.setCurrentIndex(self.indexAt(event.pos()))
         self._curItem = None if self.index_selected.data() is None else self.tree_model.get_item(self.index_selected)
         self.tree_selection_changed.emit(self._curItem)
 
 
+    def select_item(self, item):
+        index = self.tree_model.index_of(item)
+        view_index = self._to_view(index)
+        if not view_index.isValid():
+            return False
+        self._show_index(view_index)
+        self.index_selected = index
+        self._curItem = item
+        self.tree_selection_changed.emit(self._curItem)
+        return True
+
+    def _show_index(self, view_index):
+        parent = view_index.parent()
+        while parent.isValid():
+            self.expand(parent)
+            parent = parent.parent()
+        self.setCurrentIndex(view_index)
+        self.scrollTo(view_index)
+
     def getCurItem(self):
         return self._curItem
 
@@ -90,9 +152,18 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         return action
 
 
-    def randomString(self, stringLength=20):
-        letters = string.ascii_letters + string.digits
-        return ''.join(random.choice(letters) for i in range(stringLength))
+    def selected_items(self):
+        """The selected items in tree order, the current item when nothing is selected"""
+        items = [self.tree_model.get_item(self._to_source(index)) for index in self.selectionModel().selectedRows()]
+        if not items and self._curItem is not None:
+            items = [self._curItem]
+        return self.tree_model.top_items(items) if len(items) > 1 else items
+
+    def _set_batch_items_visible(self, visible):
+        self._move_action.setVisible(visible)
+        self._set_type_action.setVisible(visible)
+        self._add_meta_action.setVisible(visible)
+        self._remove_meta_action.setVisible(visible)
 
     def _set_menu_items_visible(self, visible):
         self._delete_action.setVisible(visible[0])
@@ -104,7 +175,13 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         self._add_root_primitive_action.setVisible(visible[6])
 
     def _open_menu(self, position):
-        if self._curItem is None:
+        selected = self.selected_items()
+        self._undo_action.setEnabled(self.tree_model.undo_stack.can_undo())
+        self._redo_action.setEnabled(self.tree_model.undo_stack.can_redo())
+        self._set_batch_items_visible(bool(selected) and self._curItem is not None)
+        if len(selected) > 1:
+            self._set_menu_items_visible([True, True, False, False, False, False, False])
+        elif self._curItem is None:
             self._set_menu_items_visible([False, False, False, False, False, True, True])
         else:
             if self._curItem.dataType in TypeManager.collections:
@@ -121,37 +198,187 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
             print(str(e))
 
     def _delete_slot(self):
-        parent = self.index_selected.parent()
-        pos = self.index_selected.row()
-        self.tree_model.removeRow(pos, parent)
-        self._curItem = self.tree_model.get_item(self.currentIndex())
+        items = self.selected_items()
+        if not items:
+            items = [self.tree_model.get_item(self.index_selected)]
+        self.tree_model.begin_batch()
+        try:
+            self.tree_model.remove_items(items)
+        finally:
+            self.tree_model.end_batch()
+        self.index_selected = self._to_source(self.currentIndex())
+        self._curItem = self.tree_model.get_item(self.index_selected) if self.index_selected.isValid() else None
         self.tree_selection_changed.emit(self._curItem)
 
-    def set_copy_of(self, item):
-        item.setVarId("copy_of_" + item.getVarId())
+    def copy_var_id(self, var_id, reserved):
+        """copy_of_<varId>, numbered when taken; reserved holds the ids given by the same clone"""
+        base = var_id or ""
+        while base.startswith("copy_of_"):
+            base = base[len("copy_of_"):]
+        return self.tree_model.unique_var_id("copy_of_" + base, reserved)
+
+    def set_copy_of(self, item, reserved):
+        item.setVarId(self.copy_var_id(item.getVarId(), reserved))
         item.setNewAdded(True)
         for child in item.childItems:
-            self.set_copy_of(child)
+            self.set_copy_of(child, reserved)
 
     def _clone_slot(self):
+        items = self.selected_items()
+        if len(items) > 1:
+            self._clone_items(items)
+            return
         parentItem = self._curItem.parent()
-        dup_Item = self.create_slot(parentItem)
+        reserved = set()
+        dup_Item = self.create_slot(parentItem, reserved=reserved)
         for item in dup_Item.childItems:
-            self.set_copy_of(item)
+            self.set_copy_of(item, reserved)
         pos = self.index_selected.row()
         parentItem.insertChild(pos + 1, dup_Item)
-        self.tree_model.insertRow(pos, self.index_selected.parent())
+        self.tree_model.insertRow(pos + 1, self.index_selected.parent())
+        self._keep_visible(dup_Item)
         self._curItem = dup_Item
         self.tree_selection_changed.emit(self._curItem)
 
-    def create_slot(self, parentItem):
-        dup_Item = self._curItem.create_duplicate(parentItem)
-        dup_Item.setData("Copy of " + self._curItem.data())
-        dup_Item.setVarId("copy_of_" + self._curItem.getVarId())
+    def create_slot(self, parentItem, item=None, reserved=None):
+        item = item or self._curItem
+        dup_Item = item.create_duplicate(parentItem)
+        dup_Item.setData("Copy of " + item.data())
+        dup_Item.setVarId(self.copy_var_id(item.getVarId(), reserved if reserved is not None else set()))
         dup_Item.setNewAdded(True)
         return dup_Item
 
+    def _clone_items(self, items):
+        # the copies of each parent go in one block after its last selected row
+        by_parent = {}
+        for item in items:
+            by_parent.setdefault(item.parent(), []).append(item)
+        reserved = set()
+        self.tree_model.begin_batch()
+        try:
+            for parentItem, siblings in by_parent.items():
+                copies = []
+                for item in siblings:
+                    dup_Item = self.create_slot(parentItem, item, reserved)
+                    for child in dup_Item.childItems:
+                        self.set_copy_of(child, reserved)
+                    copies.append(dup_Item)
+                row = max(item.childNumber() for item in siblings) + 1
+                self.tree_model.insert_items(parentItem, row, copies)
+                for dup_Item in copies:
+                    self._keep_visible(dup_Item)
+        finally:
+            self.tree_model.end_batch()
+
+    def _move_slot(self):
+        try:
+            items = self.selected_items()
+            path, ok = QtWidgets.QInputDialog.getText(self, "Move to Folder", "Folder path (/ for the top level):",
+                                                      text=items[0].parent().fullPath() if items[0].parent() is not self.tree_model.root_item else "/")
+            if not ok:
+                return
+            folder = self.tree_model.item_at_title_path(path)
+            if folder is None or (folder is not self.tree_model.root_item and
+                                  folder.getDataType() not in TypeManager.collections):
+                QtWidgets.QMessageBox.warning(self, "Move to Folder", "No folder at " + path)
+                return
+            self.tree_model.begin_batch()
+            try:
+                moved = self.tree_model.move_items(items, folder)
+            finally:
+                self.tree_model.end_batch()
+            for item in moved:
+                self._keep_visible(item)
+            self.tree_selection_changed.emit(self._curItem)
+        except Exception as e:
+            print("_move_slot failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def _set_type_slot(self):
+        try:
+            items = self.selected_items()
+            types = TypeManager.collections + TypeManager.primitives
+            current = items[0].getDataType()
+            data_type, ok = QtWidgets.QInputDialog.getItem(self, "Set Data Type", "Data type:", types,
+                                                           types.index(current) if current in types else 0, False)
+            if not ok:
+                return
+            if data_type not in TypeManager.collections and any(item.childCount() or item.hasPendingChildren() for item in items):
+                QtWidgets.QMessageBox.warning(self, "Set Data Type", "Items with children must stay collections")
+                return
+            self.tree_model.begin_batch()
+            try:
+                self.tree_model.set_data_type_items(items, data_type)
+            finally:
+                self.tree_model.end_batch()
+            self.tree_selection_changed.emit(self._curItem)
+        except Exception as e:
+            print("_set_type_slot failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def _add_meta_slot(self):
+        try:
+            items = self.selected_items()
+            key, ok = QtWidgets.QInputDialog.getText(self, "Add Metadata Key", "Key:")
+            if not ok or not key:
+                return
+            value, ok = QtWidgets.QInputDialog.getText(self, "Add Metadata Key", "Value:")
+            if not ok:
+                return
+            self.tree_model.begin_batch()
+            try:
+                self.tree_model.set_metadata_key_items(items, key, value)
+            finally:
+                self.tree_model.end_batch()
+            self.tree_selection_changed.emit(self._curItem)
+        except Exception as e:
+            print("_add_meta_slot failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def _remove_meta_slot(self):
+        try:
+            items = self.selected_items()
+            keys = sorted(set(key for item in items for key in item.getMetaData()))
+            if not keys:
+                return
+            key, ok = QtWidgets.QInputDialog.getItem(self, "Remove Metadata Key", "Key:", keys, 0, False)
+            if not ok:
+                return
+            self.tree_model.begin_batch()
+            try:
+                self.tree_model.remove_metadata_key_items(items, key)
+            finally:
+                self.tree_model.end_batch()
+            self.tree_selection_changed.emit(self._curItem)
+        except Exception as e:
+            print("_remove_meta_slot failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def _undo_slot(self):
+        self._history_slot(self.tree_model.undo)
+
+    def _redo_slot(self):
+        self._history_slot(self.tree_model.redo)
+
+    def _history_slot(self, apply):
+        try:
+            item = apply()
+            if item is not None and self.tree_model.change_tracker.is_attached(item):
+                self._keep_visible(item)
+                if self.select_item(item):
+                    return
+            if self._curItem is not None and not self.tree_model.change_tracker.is_attached(self._curItem):
+                self.clearSelection()
+                self.index_selected = QtCore.QModelIndex()
+                self._curItem = None
+            self.tree_selection_changed.emit(self._curItem)
+        except Exception as e:
+            print("_history_slot failed: {}".format(e))
+            print(traceback.format_exc())
+
     def add_child_folder(self):
+        if self.tree_model.canFetchMore(self.index_selected):
+            self.tree_model.fetchMore(self.index_selected)
         parentItem = self.tree_model.get_item(self.index_selected)
         new_Item = self.create_new_folder(parentItem)
         parentItem.insertChild(0, new_Item)
@@ -175,6 +402,8 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         self.insert_row_to_tree(count, new_Item)
 
     def create_child_primitive(self):
+        if self.tree_model.canFetchMore(self.index_selected):
+            self.tree_model.fetchMore(self.index_selected)
         parentItem = self.tree_model.get_item(self.index_selected)
         new_Item = self.create_new_item(parentItem)
         parentItem.insertChild(0, new_Item)
@@ -183,7 +412,8 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
 
     def insert_row_to_tree(self, count, new_Item):
         self.tree_model.insertRow(count, self.index_selected)
-        self.setCurrentIndex(self.tree_model.index(count, 0, self.index_selected))
+        self._keep_visible(new_Item)
+        self.setCurrentIndex(self._to_view(self.tree_model.index(count, 0, self.index_selected)))
         self._curItem = new_Item
         self.tree_selection_changed.emit(self._curItem)
 
@@ -191,7 +421,7 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         new_Item = TreeItem(None, parentItem)
         new_Item.setData("New Primitive")
         new_Item.setDataType("Text")
-        new_Item.setVarId(self.randomString())
+        new_Item.setVarId(self.tree_model.unique_var_id())
         new_Item.setNewAdded(True)
         new_Item.setMetaData({})
         new_Item.setSources([])
@@ -201,65 +431,72 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         new_Item = TreeItem(None, parentItem)
         new_Item.setData("New Folder")
         new_Item.setDataType("Folder")
-        new_Item.setVarId(self.randomString())
+        new_Item.setVarId(self.tree_model.unique_var_id())
         new_Item.setMetaData({})
         new_Item.setSources([])
         new_Item.setNewAdded(True)
         return new_Item
 
     def _start_search(self, text):
+        self._stop_search()
         if not self.tree_model.hasIndex(0, 0) or text.replace(' ', '') == "":
-            self._show_all(self.tree_model.index(0, 0).parent())
-            self.collapseAll()
+            self._show_tree()
             return
-        root_idx = self.tree_model.index(0, 0).parent()
-        self._show_all(root_idx)
         self.text_to_search = text
-        self._searching(root_idx)
-        self.expandAll()
-
-    def _show_all(self, index):
-        item = self.tree_model.get_item(index)
-        if item.childCount() == 0:
+        # everything is hidden until matches arrive
+        self.filter_model.start_filter()
+        if self.model() is not self.filter_model:
+            self._set_view_model(self.filter_model)
+        self.tree_model.fetch_pending_matches(text)
+        worker = SearchWorker(self.tree_model.search_index, text)
+        worker.matches_found.connect(functools.partial(self._search_chunk, worker))
+        worker.finished.connect(functools.partial(self._search_workers.discard, worker))
+        self._search_workers.add(worker)
+        self._search_worker = worker
+        worker.start()
+
+    def _stop_search(self):
+        if self._search_worker is not None:
+            self._search_worker.requestInterruption()
+            self._search_worker = None
+        self._pending_matches = []
+        self._search_flush_timer.stop()
+
+    def _search_chunk(self, worker, matches):
+        # chunks of a stale query can still be queued
+        if worker is not self._search_worker:
             return
-        for i in range(item.childCount()):
-            idx = self.tree_model.index(i, 0, index)
-            _item = self.tree_model.get_item(idx)
-            _item.isHidden = False
-            self.setRowHidden(_item.childNumber(), idx.parent(), False)
-
-            self._show_all(idx)
-
+        self._pending_matches.extend(matches)
+        # the filter is re-applied at most once per interval
+        if not self._search_flush_timer.isActive():
+            self._search_flush_timer.start()
 
-    def _searching(self, index):
-        for i in range(self.tree_model.rowCount(index)):
-            idx = self.tree_model.index(i, 0)
-            self._search_func(idx)
-
-    def _search_func(self, index):
+    def _flush_matches(self):
         try:
-            item = self.tree_model.get_item(index)
-            if self.text_to_search.lower() in item.data().lower():
-                item.isHidden = False
-                item.parent().isHidden = False
-                self.setRowHidden(item.childNumber(), index.parent(), False)
-                return
-
-            if item.childCount() == 0:
-                item.isHidden = True
-                item.parent().isHidden = True
-                self.setRowHidden(item.childNumber(), index.parent(), True)
-                return
-
-            for i in range(item.childCount()):
-                idx = self.tree_model.index(i, 0, index)
-                self._search_func(idx)
-
-            self.setRowHidden(item.childNumber(), index.parent(), item.isHidden)
+            matches = [item for item in self._pending_matches if self.tree_model.change_tracker.is_attached(item)]
+            self._pending_matches = []
+            for item in self.filter_model.add_matches(matches):
+                if item is not self.tree_model.root_item:
+                    self.expand(self._to_view(self.tree_model.index_of(item)))
         except Exception as e:
             print("search failed: {}".format(e))
             print(traceback.format_exc())
 
+    def _show_tree(self):
+        # the whole tree is back without asking the filter about any row
+        if self.model() is self.tree_model:
+            return
+        self.filter_model.clear_filter()
+        self._set_view_model(self.tree_model)
+        if self._curItem is not None and self.tree_model.change_tracker.is_attached(self._curItem):
+            self._show_index(self.tree_model.index_of(self._curItem))
+
+    def _keep_visible(self, item):
+        # items added while a search is shown must not vanish behind the filter
+        if self.filter_model.is_filtering():
+            self.filter_model.add_matches([item])
+
+
 
 
     """
@@ -274,8 +511,17 @@ class TreeView(QtWidgets.QTreeView, QtCore.QObject):
         self._context_menu.addAction(self._add_child_primitive_action)
         self._context_menu.addAction(self._add_root_folder_action)
         self._context_menu.addAction(self._add_root_primitive_action)
+        self._context_menu.addSeparator()
+        self._context_menu.addAction(self._move_action)
+        self._context_menu.addAction(self._set_type_action)
+        self._context_menu.addAction(self._add_meta_action)
+        self._context_menu.addAction(self._remove_meta_action)
+        self._context_menu.addSeparator()
+        self._context_menu.addAction(self._undo_action)
+        self._context_menu.addAction(self._redo_action)
         self.header().hide()
         self.setDragDropMode(QtWidgets.QAbstractItemView.InternalMove)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self._open_menu)
 
@@ -1,10 +1,17 @@
+import os
 import sys
-from PyQt5 import QtCore, QtWidgets
+import functools
+from PyQt5 import QtCore, QtGui, QtWidgets
 from model.type_manager import TypeManager
-from model.json_file_manager import JsonFileManager
+from model.json_file_manager import JsonFileManager, JsonLoader, JsonSaver
+from model.edit_journal import EditJournal
+from model.snapshot_cache import SnapshotCache
+from model.tree_diff import DiffLoader, diff_items, warm_digests
 from model.source_table_model import SourceTableModel
 from model.metadata_table_model import MetadataTableModel
 from view.main_view import MainWindow
+from view.changes_view import ChangesView
+from view.diff_view import DiffView
 import traceback
 
 
@@ -12,11 +19,31 @@ class MainController:
 
     def __init__(self):
         self._app = QtWidgets.QApplication(sys.argv)
-        self._source_model = SourceTableModel()
+        TypeManager.build_icon_cache()
+        # one model per table, rebound to the selected item
+        self.source_model = SourceTableModel()
+        self.metadata_model = MetadataTableModel()
         self.main_view = MainWindow()
         self.selectedItem = None
         self.is_selection_changed = False
         self.is_selection_changed = False
+        # build tree items on expand instead of all at once
+        self.lazy_loading = "--lazy" in sys.argv
+        # parsed files are cached unless disabled
+        self.snapshot_cache = None if "--no-cache" in sys.argv else SnapshotCache()
+        self.loader = None
+        self.saver = None
+        self.changes_view = None
+        self.differ = None
+        self.diff_view = None
+        self.journal = None
+        self.recovering = False
+        # only a completely loaded tree is autosaved, a partial one would replace the recovery source
+        self.tree_loaded = False
+        # the journal is folded into <file>.autosave every few minutes
+        self.autosave_timer = QtCore.QTimer()
+        self.autosave_timer.setInterval(5 * 60 * 1000)
+        self.autosave_timer.timeout.connect(self.autosave)
         self.init()
 
     def init(self):
@@ -34,6 +61,13 @@ class MainController:
             self.main_view.save_clicked.connect(self.save_clicked)
             self.main_view.search_text_entered.connect(self.do_search)
             self.main_view.change_var_id.connect(self.change_var_id)
+            self.main_view.cancel_clicked.connect(self.cancel_clicked)
+            self.main_view.changes_clicked.connect(self.changes_clicked)
+            self.main_view.compare_disk_clicked.connect(self.compare_disk_clicked)
+            self.main_view.compare_files_clicked.connect(self.compare_files_clicked)
+            self.main_view.go_to_entered.connect(self.go_to)
+            self.main_view.tree_view.tree_model.edited.connect(self.tree_edited)
+            self.autosave_timer.start()
         except Exception as e:
             print("Controller initialization failed: {}".format(e))
             print(traceback.format_exc())
@@ -44,16 +78,20 @@ class MainController:
             self.main_view.right_side_widget.setTitle("")
             self.main_view.var_id_textbox.setText("")
             self.main_view.path_value_textbox.setText("")
-            self.main_view.source_table.setModel(SourceTableModel())
-            self.main_view.metadata_table.setModel(MetadataTableModel())
+            self.source_model.reset()
+            self.metadata_model.reset()
         except Exception as e:
             print("disable_right_panel failed: {}".format(e))
             print(traceback.format_exc())
 
     def metadata_changed(self):
         try:
-            self.selectedItem.setMetaData(self.main_view.metadata_table.model().getMetaData())
-            self.selectedItem.setValueChanged(True)
+            tree_model = self.main_view.tree_view.tree_model
+            key_edit = self.metadata_model.key_edit
+            if key_edit is not None:
+                tree_model.set_metadata_key(self.selectedItem, *key_edit)
+            else:
+                tree_model.set_metadata(self.selectedItem, self.metadata_model.getMetaData())
             self.set_decoration_role()
             return
         except Exception as e:
@@ -70,11 +108,19 @@ class MainController:
     def change_var_id(self):
         try:
             if self.selectedItem is not None and self.main_view.var_id_textbox.text() != self.selectedItem.getVarId():
+                tree_model = self.main_view.tree_view.tree_model
+                var_id = self.main_view.var_id_textbox.text()
+                if tree_model.var_id_in_use(var_id, self.selectedItem):
+                    owner = tree_model.item_with_var_id(var_id)
+                    self.main_view.var_id_textbox.setText(self.selectedItem.getVarId())
+                    QtWidgets.QMessageBox.warning(None, "VarId", "VarId {} is already used{}".format(
+                        var_id, " by " + owner.fullPath() if owner is not None else ""))
+                    return
                 dialog_result = QtWidgets.QMessageBox.question(QtWidgets.QMessageBox(), "Confirm",
                                                                "Are you sure you want to change VarId?")
                 if dialog_result == QtWidgets.QMessageBox.Yes:
-                    self.selectedItem.setVarId(self.main_view.var_id_textbox.text())
-                    self.selectedItem.setValueChanged(True)
+                    self.main_view.tree_view.tree_model.set_var_id(self.selectedItem,
+                                                                   self.main_view.var_id_textbox.text())
                     self.set_decoration_role()
         except Exception as e:
             print("change_var_id failed: {}".format(e))
@@ -82,8 +128,8 @@ class MainController:
 
     def source_changed(self):
         try:
-            self.selectedItem.setSources(self.main_view.source_table.model().getSources())
-            self.selectedItem.setValueChanged(True)
+            self.main_view.tree_view.tree_model.set_sources(self.selectedItem,
+                                                            self.source_model.getSources())
             self.set_decoration_role()
             return
         except Exception as e:
@@ -91,39 +137,31 @@ class MainController:
             print(traceback.format_exc())
 
     def set_decoration_role(self):
-        index = self.main_view.tree_view.selectedIndexes()[0]
-        self.main_view.tree_view.dataChanged(index,
-                                             index,
-                                             [QtCore.Qt.DecorationRole])
-        self.main_view.tree_view.dataChanged(index,
-                                             index,
-                                             [QtCore.Qt.ForegroundRole])
+        # the edited item is the current one, not the first of a multi-selection
+        self.main_view.tree_view.tree_model.items_changed([self.selectedItem])
         self.set_style_to_tree('blue')
 
     def set_style_to_tree(self, style):
-        self.main_view.tree_view.setStyleSheet(
-            '''
-                QTreeView::item::selected {
-                  selection-color: ''' + style + ''';
-                }
-            '''
-        )
+        # a style sheet re-polishes every row of the tree, a palette change only repaints
+        palette = self.main_view.tree_view.palette()
+        color = QtGui.QColor(style)
+        if palette.color(QtGui.QPalette.HighlightedText) == color:
+            return
+        for group in (QtGui.QPalette.Active, QtGui.QPalette.Inactive):
+            palette.setColor(group, QtGui.QPalette.HighlightedText, color)
+        self.main_view.tree_view.setPalette(palette)
 
     def data_type_changed(self, selected):
         try:
             if self.is_selection_changed:
                 return
-            model = SourceTableModel(self.selectedItem.getSources())
-            self.main_view.source_table.setModel(model)
-            model.dataChanged.connect(self.source_changed)
+            self.source_model.reset(self.selectedItem)
             self.main_view.source_table.setDisabled(selected == "Folder")
             if self.selectedItem.getDataType() == selected:
                 return
-            self.selectedItem.setDataType(selected)
-            current_index = self.main_view.tree_view.selectedIndexes()[0]
-            self.main_view.tree_view.dataChanged(current_index, current_index, [QtCore.Qt.DecorationRole])
-            self.selectedItem.setValueChanged(True)
-            self.set_decoration_role()
+            # the same path as Set Data Type on a selection, it repaints the item
+            self.main_view.tree_view.tree_model.set_data_type_items([self.selectedItem], selected)
+            self.set_style_to_tree('blue')
         except Exception as e:
             print("data_type_changed failed: {}".format(e))
             print(traceback.format_exc())
@@ -167,7 +205,9 @@ class MainController:
 
 
     def select_dynamic_style(self, selected):
-        if selected.valueChanged:
+        if selected is None:
+            style = 'black'
+        elif selected.valueChanged:
             style = 'blue'
         elif selected.newAdded:
             style = 'green'
@@ -178,9 +218,7 @@ class MainController:
 
     def update_metadata_model(self):
         try:
-            model = MetadataTableModel(self.selectedItem.getMetaData())
-            self.main_view.metadata_table.setModel(model)
-            model.dataChanged.connect(self.metadata_changed)
+            self.metadata_model.reset(self.selectedItem)
         except Exception as e:
             print("update_metadata_model failed: {}".format(e))
             print(traceback.format_exc())
@@ -220,40 +258,417 @@ class MainController:
 
     def save_clicked(self):
         try:
+            if self.saver is not None and self.saver.file_path is not None:
+                # an autosave in progress is dropped, the journal still has everything
+                self.cancel_saving()
+            if self.saver is not None:
+                return
             dialog_result = QtWidgets.QMessageBox.question(QtWidgets.QMessageBox(), "Save", "Would you save the changes?")
             if dialog_result == QtWidgets.QMessageBox.Yes:
-                root_item = self.main_view.tree_view.getRootItem()
-                result_file = []
-                for child in root_item.childItems:
-                    result_file.append(child.create_new_item())
-                self.JsonManager.save_json_file(result_file)
-                self.JsonManager.json_data = result_file
+                # only subtrees changed since the last save are serialised again, on the worker
+                if self.JsonManager.is_store_file():
+                    version, children, entries = self.main_view.tree_view.tree_model.store_snapshot()
+                else:
+                    version, children, entries = self.main_view.tree_view.tree_model.snapshot()
+                saver = JsonSaver(self.JsonManager, entries)
+                saver.progress.connect(self.main_view.set_progress)
+                # a tree that was never opened from a file has no journal
+                seq = self.journal.seq if self.journal is not None else 0
+                saver.saving_finished.connect(functools.partial(self.tree_saved, saver, version, children, seq))
+                saver.saving_failed.connect(functools.partial(self.tree_saving_failed, saver))
+                self.saver = saver
+                self.main_view.save_button.setEnabled(False)
+                self.main_view.revert_button.setEnabled(False)
+                self.main_view.show_progress(True, "Saving")
+                saver.start()
         except Exception as e:
             print("save_clicked failed: {}".format(e))
             print(traceback.format_exc())
 
+    def tree_saved(self, saver, version, children, seq, texts):
+        try:
+            if saver is not self.saver:
+                return
+            self.saving_done()
+            if self.JsonManager.is_store_file():
+                saver.entries.bind_ids()
+            self.main_view.tree_view.tree_model.saved(version, children, texts)
+            if self.journal is not None:
+                self.journal.saved(seq)
+            self.main_view.tree_view.viewport().update()
+        except Exception as e:
+            print("tree_saved failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def tree_saving_failed(self, saver, message):
+        if saver is not self.saver:
+            return
+        self.saving_done()
+        QtWidgets.QMessageBox.critical(QtWidgets.QMessageBox(), "Save Error", "Saving failed, the file was not changed.\n" + message)
+
+    def saving_done(self):
+        self.saver = None
+        self.main_view.show_progress(False)
+        self.main_view.save_button.setEnabled(True)
+        self.main_view.revert_button.setEnabled(True)
+
+    def cancel_saving(self):
+        if self.saver is None:
+            return
+        # the temp file is dropped, the original stays as it was
+        self.saver.requestInterruption()
+        self.saver.wait()
+        self.saving_done()
+
+    def cancel_clicked(self):
+        self.cancel_loading()
+        self.cancel_saving()
+        self.cancel_diff()
+
+    def changes_clicked(self):
+        try:
+            if self.changes_view is None:
+                self.changes_view = ChangesView(self.main_view)
+                self.changes_view.revert_requested.connect(self.revert_changes)
+                self.changes_view.item_activated.connect(self.main_view.tree_view.select_item)
+            self.changes_view.set_changes(self.main_view.tree_view.tree_model.change_tracker.changes())
+            self.changes_view.show()
+            self.changes_view.raise_()
+        except Exception as e:
+            print("changes_clicked failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def compare_disk_clicked(self):
+        try:
+            if self.loader is not None or self.differ is not None or not self.JsonManager.file_path:
+                return
+            file_path = self.JsonManager.file_path
+            self.start_diff([file_path], "Changes against " + os.path.basename(file_path))
+        except Exception as e:
+            print("compare_disk_clicked failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def compare_files_clicked(self):
+        try:
+            if self.differ is not None:
+                return
+            file_paths = []
+            for caption in ("Old File", "New File"):
+                file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self.main_view, caption, "",
+                                                                     self.JsonManager.file_filter,
+                                                                     options=QtWidgets.QFileDialog.DontUseNativeDialog)
+                if not file_path:
+                    return
+                file_paths.append(file_path)
+            self.start_diff(file_paths, "{} against {}".format(*[os.path.basename(path) for path in reversed(file_paths)]))
+        except Exception as e:
+            print("compare_files_clicked failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def start_diff(self, file_paths, title):
+        # the files are read and hashed on the worker, the comparison itself only visits what differs
+        differ = DiffLoader(file_paths)
+        differ.loading_finished.connect(functools.partial(self.diff_loaded, differ, title))
+        differ.loading_failed.connect(functools.partial(self.diff_failed, differ))
+        self.differ = differ
+        self.main_view.show_progress(True, "Comparing")
+        differ.start()
+
+    def diff_loaded(self, differ, title, roots):
+        try:
+            if differ is not self.differ:
+                return
+            if len(roots) > 1:
+                self.show_diff(title, roots[0], roots[1])
+                return
+            # the open tree can only be hashed on the GUI thread, in slices with progress in between
+            self.main_view.show_progress(True, "Hashing")
+            steps = warm_digests(self.main_view.tree_view.tree_model.root_item)
+            QtCore.QTimer.singleShot(0, functools.partial(self.diff_hash_step, differ, title, roots[0], steps))
+        except Exception as e:
+            print("diff_loaded failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def diff_hash_step(self, differ, title, old_root, steps):
+        try:
+            # cancelled or replaced by another compare
+            if differ is not self.differ:
+                return
+            percent = next(steps, None)
+            if percent is None:
+                self.show_diff(title, old_root, self.main_view.tree_view.tree_model.root_item)
+                return
+            self.main_view.set_progress(percent)
+            QtCore.QTimer.singleShot(0, functools.partial(self.diff_hash_step, differ, title, old_root, steps))
+        except Exception as e:
+            print("diff_hash_step failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def show_diff(self, title, old_root, new_root):
+        try:
+            self.differ = None
+            self.main_view.show_progress(False)
+            changes = diff_items(old_root, new_root)
+            if self.diff_view is None:
+                self.diff_view = DiffView(self.main_view)
+                self.diff_view.path_activated.connect(self.diff_path_activated)
+            self.diff_view.set_changes(title, changes)
+            self.diff_view.show()
+            self.diff_view.raise_()
+        except Exception as e:
+            print("show_diff failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def diff_failed(self, differ, message):
+        if differ is not self.differ:
+            return
+        self.differ = None
+        self.main_view.show_progress(False)
+        QtWidgets.QMessageBox.critical(QtWidgets.QMessageBox(), "Compare Error", "Comparing failed.\n" + message)
+
+    def diff_path_activated(self, path):
+        try:
+            # an item only in the other tree shows its closest existing ancestor
+            tree_model = self.main_view.tree_view.tree_model
+            item = tree_model.item_at_title_path(path)
+            while item is None and "/" in path.strip("/"):
+                path = path.rstrip("/").rsplit("/", 1)[0]
+                item = tree_model.item_at_title_path(path)
+            if item is not None and item is not tree_model.root_item:
+                self.main_view.tree_view.select_item(item)
+        except Exception as e:
+            print("diff_path_activated failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def go_to(self, text):
+        try:
+            # a /path selects by titles, anything else by varId
+            if not text:
+                return
+            tree_view = self.main_view.tree_view
+            if text.startswith("/"):
+                item = tree_view.tree_model.item_at_title_path(text)
+                if item is tree_view.tree_model.root_item:
+                    item = None
+                message = "No item at " + text
+            else:
+                item = tree_view.tree_model.item_with_var_id(text)
+                message = "No item with VarId " + text
+            if item is not None:
+                tree_view._keep_visible(item)
+            if item is None or not tree_view.select_item(item):
+                QtWidgets.QMessageBox.warning(None, "Go to", message)
+        except Exception as e:
+            print("go_to failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def cancel_diff(self):
+        if self.differ is None:
+            return
+        self.differ.requestInterruption()
+        self.differ.wait()
+        self.differ = None
+        self.main_view.show_progress(False)
+
+    def revert_changes(self, changes):
+        try:
+            tree_model = self.main_view.tree_view.tree_model
+            failed = [item.fullPath() for kind, item in changes if not tree_model.revert_change(kind, item)]
+            if failed:
+                QtWidgets.QMessageBox.warning(None, "Revert", "Could not revert:\n" + "\n".join(failed))
+            self.changes_view.set_changes(tree_model.change_tracker.changes())
+            self.main_view.tree_view.viewport().update()
+            selected = self.selectedItem
+            if selected is not None and not tree_model.change_tracker.is_attached(selected):
+                selected = None
+            self.tree_selection_changed(selected)
+        except Exception as e:
+            print("revert_changes failed: {}".format(e))
+            print(traceback.format_exc())
+
     def get_json_data(self):
         try:
             self.JsonManager = JsonFileManager()
-            self.JsonManager.get_json_data()
+            self.JsonManager.choose_file()
         except Exception as e:
             print("get_json_data failed: {}".format(e))
             print(traceback.format_exc())
 
     def create_tree(self):
         try:
-            self.main_view.tree_view.load_data(self.JsonManager.json_data)
             self.disable_right_panel()
+            self.tree_loaded = False
+            if not self.JsonManager.file_path:
+                return
+            # a partially loaded tree must not overwrite the file
+            self.main_view.save_button.setEnabled(False)
+            self.main_view.show_progress(True, "Loading")
+            file_path = self.JsonManager.file_path
+            if self.journal is None:
+                self.journal = EditJournal(file_path)
+                self.recovering = self.journal.has_recovery() and self.ask_recovery()
+                if self.recovering:
+                    file_path = self.journal.recovery_source(file_path)
+                else:
+                    self.journal.discard()
+            # the autosave of a recovery is not worth caching
+            cache = self.snapshot_cache if file_path == self.JsonManager.file_path else None
+            loader = JsonLoader(self.JsonManager, self.is_lazy(), file_path, cache)
+            loader.batch_loaded.connect(functools.partial(self.tree_batch_loaded, loader))
+            loader.loading_finished.connect(functools.partial(self.tree_loading_finished, loader))
+            loader.loading_failed.connect(functools.partial(self.tree_loading_failed, loader))
+            self.loader = loader
+            loader.start()
         except Exception as e:
             print("create_tree failed: {}".format(e))
             print(traceback.format_exc())
 
+    def is_lazy(self):
+        # tree files and stores can be larger than memory, their subtrees are read on expand
+        return self.lazy_loading or self.JsonManager.is_tree_file() or self.JsonManager.is_store_file()
+
+    def tree_batch_loaded(self, loader, items, percent):
+        try:
+            # batches of a cancelled or replaced loader can still be queued
+            if loader is not self.loader or loader.isInterruptionRequested():
+                return
+            self.main_view.tree_view.append_items(items, self.is_lazy())
+            self.main_view.set_progress(percent)
+        except Exception as e:
+            print("tree_batch_loaded failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def tree_loading_finished(self, loader):
+        if loader is not self.loader:
+            return
+        self.loader = None
+        self.main_view.show_progress(False)
+        self.main_view.save_button.setEnabled(True)
+        if self.recovering:
+            self.recovering = False
+            self.replay_journal()
+        self.tree_loaded = True
+
+    def ask_recovery(self):
+        dialog_result = QtWidgets.QMessageBox.question(QtWidgets.QMessageBox(), "Recover",
+                                                       "Unsaved changes of a previous session were found.\n"
+                                                       "Would you recover them?")
+        return dialog_result == QtWidgets.QMessageBox.Yes
+
+    def replay_journal(self):
+        try:
+            tree_model = self.main_view.tree_view.tree_model
+            entries = self.journal.entries()
+            failed = 0
+            # replayed edits are already in the journal
+            self.journal.paused = True
+            try:
+                for entry in entries:
+                    try:
+                        applied = tree_model.apply_edit(entry)
+                    except Exception as e:
+                        print("apply_edit failed: {}".format(e))
+                        applied = False
+                    if not applied:
+                        failed += 1
+            finally:
+                self.journal.paused = False
+            self.journal.resume()
+            if failed:
+                QtWidgets.QMessageBox.warning(None, "Recover", "{} of {} changes could not be recovered".format(
+                    failed, len(entries)))
+        except Exception as e:
+            print("replay_journal failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def tree_edited(self, edit):
+        try:
+            if self.journal is not None and self.loader is None:
+                self.journal.append(edit)
+        except Exception as e:
+            print("tree_edited failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def autosave(self):
+        try:
+            if self.journal is None or not self.tree_loaded or self.saver is not None:
+                return
+            # a store is saved incrementally, its journal is compacted by the next save
+            if self.JsonManager.is_store_file():
+                return
+            if not self.journal.seq or not self.main_view.tree_view.tree_model.change_tracker.has_changes():
+                return
+            version, children, entries = self.main_view.tree_view.tree_model.snapshot()
+            saver = JsonSaver(self.JsonManager, entries, self.journal.autosave_path)
+            saver.saving_finished.connect(functools.partial(self.autosaved, saver, self.journal.seq))
+            saver.saving_failed.connect(functools.partial(self.autosave_failed, saver))
+            self.saver = saver
+            saver.start()
+        except Exception as e:
+            print("autosave failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def autosaved(self, saver, seq, texts):
+        if saver is not self.saver:
+            return
+        self.saver = None
+        if self.journal is not None:
+            self.journal.compact(seq)
+
+    def autosave_failed(self, saver, message):
+        if saver is not self.saver:
+            return
+        self.saver = None
+        print("autosave failed: {}".format(message))
+
+    def tree_loading_failed(self, loader, message):
+        try:
+            if loader is not self.loader:
+                return
+            self.loader = None
+            self.load_stopped()
+            # back to the empty tree, the batches shown so far are a broken part of the file
+            self.main_view.tree_view.clearContent()
+            self.disable_right_panel()
+            if self.journal is not None:
+                # edits of the empty tree do not belong to the file, its journal stays on disk
+                self.journal.close()
+                self.journal = None
+            self.main_view.show_progress(False)
+            QtWidgets.QMessageBox.critical(QtWidgets.QMessageBox(), "Json Error", "Loading failed.\n" + message)
+        except Exception as e:
+            print("tree_loading_failed failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def cancel_loading(self):
+        try:
+            if self.loader is None:
+                return
+            self.loader.requestInterruption()
+            self.loader.wait()
+            self.loader = None
+            self.load_stopped()
+            self.main_view.show_progress(False)
+        except Exception as e:
+            print("cancel_loading failed: {}".format(e))
+            print(traceback.format_exc())
+
+    def load_stopped(self):
+        self.tree_loaded = False
+        if self.recovering:
+            # the journal is not replayed, new edits continue after its entries
+            self.recovering = False
+            self.journal.resume()
+
     def revert_clicked(self):
         try:
             dialog_result = QtWidgets.QMessageBox.question(QtWidgets.QMessageBox(), "Confirm", "Would you revert?")
             if dialog_result == QtWidgets.QMessageBox.Yes:
+                self.cancel_loading()
+                self.cancel_saving()
                 self.main_view.tree_view.clearContent()
-                self.JsonManager.get_json_data()
+                if self.journal is not None:
+                    self.journal.discard()
                 self.create_tree()
                 self.selectedItem = None
         except Exception as e:
@@ -262,7 +677,8 @@ class MainController:
 
     def set_metadata_table_model(self):
         try:
-            self.main_view.metadata_table.setModel(MetadataTableModel())
+            self.main_view.metadata_table.setModel(self.metadata_model)
+            self.metadata_model.dataChanged.connect(self.metadata_changed)
             horizontal_header = self.main_view.metadata_table.horizontalHeader()
             horizontal_header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
             horizontal_header.setSectionResizeMode(1, QtWidgets.QHeaderView.Stretch)
@@ -274,7 +690,8 @@ class MainController:
 
     def set_source_table_model(self):
         try:
-            self.main_view.source_table.setModel(SourceTableModel())
+            self.main_view.source_table.setModel(self.source_model)
+            self.source_model.dataChanged.connect(self.source_changed)
             horizontal_header = self.main_view.source_table.horizontalHeader()
             horizontal_header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
             horizontal_header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)